@@ -1,17 +1,16 @@
 #!/usr/bin/env python3
+"""
+Lists port assignments that clash. AssignedPorts refuses to create such
+and drops them, with a warning, when it loads the assignments. The
+dropped entities gets a new port the next time they are started.
+"""
+import logging
+import sys
 
-import json
+from oidctest.ass_port import AssignedPorts
 
-ap = json.loads(open('assigned_ports.json').read())
+logging.basicConfig(stream=sys.stdout, level=logging.WARNING,
+                    format='%(message)s')
 
-inv = {}
-
-for iss, port in ap.items():
-    try:
-        inv[port].append(iss)
-    except KeyError:
-        inv[port] = [iss]
-
-for port, iss in inv.items():
-    if len(iss) != 1:
-        print(port, iss)
\ No newline at end of file
+ap = AssignedPorts('assigned_ports.json', 0, 0)
+ap.load()
@@ -6,6 +6,8 @@ import importlib
 import logging
 import os
 import sys
+import threading
+import time
 import traceback
 
 from oic.oic import Client
@@ -27,6 +29,7 @@ from oidctest.op import profiles
 from oidctest.op.profiles import PROFILEMAP
 from oidctest.prof_util import ProfileHandler
 from oidctest.tool import WebTester
+from oidctest.tt.supervisor import notify_ready
 
 urllib3.disable_warnings()
 
@@ -58,6 +61,22 @@ def pick_grp(name):
     return name.split('-')[1]
 
 
+def notify_when_ready(srv, port, interval=0.05):
+    """
+    Tell the supervisor that started us once the server is listening.
+    SRV.start() doesn't return until the server stops, so this runs in a
+    thread of its own.
+    """
+    def _wait():
+        while not srv.ready:
+            time.sleep(interval)
+        notify_ready(port=port)
+
+    _thread = threading.Thread(target=_wait, name='ReadyNotifier')
+    _thread.daemon = True
+    _thread.start()
+
+
 if __name__ == '__main__':
     from beaker.middleware import SessionMiddleware
     from cherrypy import wsgiserver
@@ -161,6 +180,7 @@ if __name__ == '__main__':
     logger.info(txt)
     print('base_url: {}'.format(app_args['client_info']['base_url']))
     print(txt)
+    notify_when_ready(SRV, args.port)
     try:
         SRV.start()
     except KeyboardInterrupt:
@@ -7,10 +7,7 @@ import json
 import logging
 import os
 import re
-import subprocess
 import sys
-import time
-import shlex
 
 from oic.oic.message import ProviderConfigurationResponse
 from oic.oic.message import RegistrationResponse
@@ -32,6 +29,10 @@ from otest.prof_util import verify_profile
 from otest.rp.setup import read_path2port_map
 
 from oidctest.ass_port import AssignedPorts
+from oidctest.tt.store import FileStore
+from oidctest.tt.supervisor import StartFailed
+from oidctest.tt.supervisor import Supervisor
+from oidctest.tt.supervisor import kill_pid
 
 logger = logging.getLogger(__name__)
 
@@ -178,10 +179,16 @@ def update(typ, conf):
 
 
 class REST(object):
-    def __init__(self, base_url, entpath='entities', entinfo='entity_info'):
+    def __init__(self, base_url, entpath='entities', entinfo='entity_info',
+                 backend=None):
+        """
+        :param backend: A store, see :py:mod:`oidctest.tt.store`, where
+            the configurations are kept, by default files in entpath
+        """
         self.base_url = base_url
         self.entpath = entpath
         self.entinfo = entinfo
+        self.backend = backend or FileStore(entpath)
 
     def entity_file_name(self, iss, tag):
         """
@@ -233,18 +240,14 @@ class REST(object):
         return _conf
 
     def list_dir(self, dirname, qiss):
-        if not os.path.isdir(dirname):
-            if qiss.endswith('%2F'):  # try to remove
-                qiss = qiss[:-3]
-            else:  # else add
-                qiss += '%2F'
-            dirname = self.entity_file_name(qiss, '')
-            if not os.path.isdir(dirname):
-                raise NoSuchFile(dirname)
+        try:
+            _tags = self.backend.tags(qiss)
+        except KeyError:
+            raise NoSuchFile(dirname)
 
         iss = unquote_plus(qiss)
         res = ['<p>']
-        for file in os.listdir(dirname):
+        for file in _tags:
             _url = '{}{}/{}'.format(self.base_url, qiss, quote_plus(file))
             res.append('<a href="{}">{}</a><br>'.format(_url, file))
         res.append('</p')
@@ -264,34 +267,17 @@ class REST(object):
         :param qtag: test instance tag quote_plus converted
         :return: Returns the instance configuration as a dictionary
         """
-        fname = self.entity_file_name(qiss, qtag)
-        if fname:
-            if not os.path.isfile(fname):
-                if qiss.endswith('%2F'):  # try to remove
-                    qiss = qiss[:-3]
-                else:  # else add
-                    qiss += '%2F'
-                fname = self.entity_file_name(qiss, qtag)
-                if not os.path.isfile(fname):
-                    return self.list_dir(fname, qiss)
-
-            try:
-                _data = open(fname, 'r').read()
-            except Exception as err:
-                if sys.version[0] == '2':
-                    if isinstance(err, IOError):
-                        return None
-                    else:
-                        raise
-                elif isinstance(err, FileNotFoundError):
-                    return None
-                else:
-                    raise
-            try:
-                return 'json', json.loads(_data)
-            except Exception as err:
-                return None
-        else:
+        if not qiss:
+            return None
+        if not qtag:
+            return self.list_dir(self.entity_dir(qiss), qiss)
+        try:
+            _data = self.backend.read(qiss, qtag)
+        except KeyError:
+            return self.list_dir(self.entity_file_name(qiss, qtag), qiss)
+        try:
+            return 'json', json.loads(_data)
+        except Exception as err:
             return None
 
     def read(self, qiss, qtag, path):
@@ -324,10 +310,10 @@ class REST(object):
         except Exception as err:
             return BadRequest(err)
 
-        _js0 = self.read_conf(qiss, qtag)
-        if _js == _js0:  # don't bother
-            pass
-        else:
+        # Only written if changed
+        try:
+            self.backend.replace(qiss, qtag, json.dumps(_js))
+        except KeyError:
             self.write(qiss, qtag, json.dumps(_js))
 
         return Response('OK')
@@ -345,42 +331,22 @@ class REST(object):
         return Created(fname)
 
     def delete(self, qiss, qtag):
-        fname = self.entity_file_name(qiss, qtag)
-        if os.path.isfile(fname):
-            os.unlink(fname)
+        _uqp = [unquote_plus(p) for p in [qiss, qtag]]
+        self.backend.delete(*[quote_plus(p) for p in _uqp])
         # If it doesn't exit don't tell because it leaks information.
         return Response('OK')
 
     def write(self, qiss, qtag, ent_conf):
-        fdir = self.entity_dir(qiss)
-        if os.path.isdir(fdir) is False:
-            os.makedirs(fdir)
-
-        fname = os.path.join(fdir, qtag)
-        fp = open(fname, 'w')
         if isinstance(ent_conf, dict):
-            json.dump(ent_conf, fp)
-        else:
-            fp.write(ent_conf)
-        fp.close()
+            ent_conf = json.dumps(ent_conf)
+        self.backend.write(qiss, qtag, ent_conf)
 
     def items(self):
         """
 
         :return: dictionary with issuer IDs as keys and tags as values
         """
-        res = {}
-        for iss in os.listdir(self.entpath):
-            dname = os.path.join(self.entpath, iss)
-            if os.path.isdir(dname):
-                for tag in os.listdir(dname):
-                    fname = os.path.join(dname, tag)
-                    if os.path.isfile(fname):
-                        try:
-                            res[iss].append(tag)
-                        except KeyError:
-                            res[iss] = [tag]
-        return res
+        return self.backend.items()
 
 
 class IO(object):
@@ -486,10 +452,8 @@ class IO(object):
             kill_process(pid)
             del app.running_processes[_key]
 
-        os.unlink(os.path.join(self.entpath, *qp))
-        # Remove issuer if out of tags
-        if not os.listdir(os.path.join(self.entpath, qp[0])):
-            os.rmdir(os.path.join(self.entpath, qp[0]))
+        # The issuer goes too if out of tags
+        self.rest.backend.delete(*qp)
 
         del app.assigned_ports[_key]
 
@@ -515,9 +479,9 @@ class IO(object):
                         template_lookup=self.lookup,
                         headers=[])
 
-        fils = os.listdir(self.entpath)
         # Remove examples
-        fils.remove('https%3A%2F%2Fexample.com')
+        fils = [f for f in self.rest.backend.issuers()
+                if f != 'https%3A%2F%2Fexample.com']
         args = {'base': self.baseurl, 'issuers': fils}
         return resp(self.environ, self.start_response, **args)
 
@@ -528,7 +492,7 @@ class IO(object):
 
         _iss = unquote_plus(iss)
         qiss = quote_plus(_iss)
-        fils = os.listdir(os.path.join(self.entpath, qiss))
+        fils = self.rest.backend.tags(qiss)
 
         active = dict([(fil, isrunning(_iss, fil)) for fil in fils])
 
@@ -549,7 +513,7 @@ class IO(object):
             active = False
 
         qp = [quote_plus(p) for p in lp]
-        info = open(os.path.join(self.entpath, *qp), 'r').read()
+        info = self.rest.backend.read(*qp)
         args = {'base': self.baseurl, 'info': json.loads(info),
                 "qargs": qp, "largs": lp, 'active': active}
         return resp(self.environ, self.start_response, **args)
@@ -597,6 +561,7 @@ class Application(object):
                                             port_max)
         self.assigned_ports.load()
         self.running_processes = self.assigned_ports.sync(test_script)
+        self.supervisor = Supervisor()
 
         # self.ent_path = ent_path
         self.rest = REST(base_url, ent_path, ent_info)
@@ -630,8 +595,8 @@ class Application(object):
         _port = self.assigned_ports.register_port(iss, tag)
         
         args = [self.test_script]
-        args.extend(["-i", shlex.quote(unquote_plus(iss))])
-        args.extend(["-t", shlex.quote(unquote_plus(tag))])        
+        args.extend(["-i", unquote_plus(iss)])
+        args.extend(["-t", unquote_plus(tag)])
         args.extend(["-p", str(_port)])
         args.extend(["-M", self.mako_dir])
         args.extend(["-f", self.flowdir])
@@ -657,37 +622,31 @@ class Application(object):
         args.append(self.test_tool_conf)
 
         # If already running - kill
-        try:
-            pid = isrunning(unquote_plus(iss), unquote_plus(tag))
-        except KeyError:
-            pass
-        else:
+        _key = self.assigned_ports.make_key(iss, tag)
+        pid = self.running_processes.pop(_key, 0)
+        if not self.supervisor.stop(_key):
+            if not pid:
+                try:
+                    pid = isrunning(unquote_plus(iss), unquote_plus(tag))
+                except KeyError:
+                    pass
             if pid:
                 logger.info('kill {}'.format(pid))
-                subprocess.call(['kill', str(pid)])
+                kill_pid(pid)
 
         # Now get it running
-        args.append('&')
-        cmd = " ".join(args)
-        logger.info("Test tool command: {}".format(cmd))
-
-        # spawn independent process
-        os.system(cmd)
-        
-        pid = 0
-        for i in range(0,10):
-            time.sleep(1)
-            pid = isrunning(unquote_plus(iss), unquote_plus(tag))
-            if pid:
-                break
-
-        if pid:
-            logger.info("process id: {}".format(pid))
-            self.running_processes[self.key(iss, tag)] = pid
-            return url
-        else:
+        logger.info("Test tool command: {}".format(" ".join(args)))
+        try:
+            child = self.supervisor.start(_key, args, _port)
+        except StartFailed as err:
+            logger.error('Failed to start the test tool: {}'.format(err))
             return None
 
+        logger.info("process id: {}, started in {:.3f}s".format(
+            child.pid, child.latency))
+        self.running_processes[_key] = child.pid
+        return url
+
     def form_handling(self, path, io):
         iss, tag = get_iss_and_tag(path)
 
@@ -846,6 +805,7 @@ class Application(object):
                 resp = self.rest.store(_qiss, _qtag, get_post(environ))
             elif _met == 'DELETE':
                 resp = self.rest.delete(_qiss, _qtag)
+                self.return_port(_qiss, _qtag)
             else:
                 resp = BadRequest('Unsupported request method')
 
@@ -0,0 +1,254 @@
+"""
+Tar archives of test logs, made while they are sent.
+
+An archive is produced chunk by chunk by :py:func:`tar_stream` from a list
+of members, each a name in the archive and a file or the content. Files
+are read a chunk at a time so the memory used does not depend on the
+size of the logs, and no files are written or working directory changed.
+With compression the output is gzipped as it is produced.
+
+An :py:class:`ArchiveCache` keeps archives on disk under a fingerprint of
+the directory they were made from, so one is only made again when a file
+in the directory has changed.
+"""
+import hashlib
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+# What zlib needs to produce the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class Sink(object):
+    """
+    Collects the output and hands it out in chunks of about chunk_size
+    bytes, compressed or not.
+    """
+
+    def __init__(self, compress=False, chunk_size=CHUNK_SIZE):
+        if compress:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        else:
+            self.compressor = None
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        """
+        :return: A chunk if there is enough to send, otherwise None
+        """
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+        if self.size >= self.chunk_size:
+            return self.pop()
+        return None
+
+    def pop(self):
+        _res = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return _res
+
+    def close(self):
+        if self.compressor is not None:
+            self.chunks.append(self.compressor.flush())
+        return self.pop()
+
+
+def _padding(size):
+    _rest = size % tarfile.BLOCKSIZE
+    if _rest:
+        return tarfile.NUL * (tarfile.BLOCKSIZE - _rest)
+    return b''
+
+
+def _file_member(arcname, path, chunk_size):
+    with open(path, 'rb') as fp:
+        _stat = os.fstat(fp.fileno())
+        info = tarfile.TarInfo(arcname)
+        info.size = _stat.st_size
+        info.mtime = _stat.st_mtime
+        info.mode = _stat.st_mode & 0o7777
+        yield info.tobuf(tarfile.PAX_FORMAT)
+
+        # The file may grow while it's read, only what was there is sent
+        _left = info.size
+        while _left:
+            _data = fp.read(min(chunk_size, _left))
+            if not _data:  # It has shrunk
+                _data = tarfile.NUL * min(chunk_size, _left)
+            _left -= len(_data)
+            yield _data
+    yield _padding(info.size)
+
+
+def _data_member(arcname, data):
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = time.time()
+    yield info.tobuf(tarfile.PAX_FORMAT)
+    yield data
+    yield _padding(info.size)
+
+
+def tar_stream(members, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    :param members: Iterable of (name in the archive, source) where the
+        source is the path to a file, the content as bytes or a function
+        returning the content
+    :param compress: Whether to gzip the archive
+    :param chunk_size: About how many bytes to produce at a time
+    :return: Generator of chunks of the archive
+    """
+    sink = Sink(compress, chunk_size)
+    size = 0
+    for arcname, src in members:
+        if callable(src):
+            src = src()
+        if isinstance(src, bytes):
+            _blocks = _data_member(arcname, src)
+        else:
+            _blocks = _file_member(arcname, src, chunk_size)
+        for _block in _blocks:
+            size += len(_block)
+            _chunk = sink.add(_block)
+            if _chunk:
+                yield _chunk
+
+    # Two empty blocks and then filled up to a full record
+    _end = 2 * tarfile.BLOCKSIZE
+    _end += (tarfile.RECORDSIZE - (size + _end) % tarfile.RECORDSIZE) % \
+        tarfile.RECORDSIZE
+    for _chunk in [sink.add(tarfile.NUL * _end), sink.close()]:
+        if _chunk:
+            yield _chunk
+
+
+def dir_members(path, prefix=''):
+    """
+    :param path: A directory
+    :param prefix: Put in front of the file names in the archive
+    :return: List of (name in the archive, path) for the files in path
+    """
+    res = []
+    for item in sorted(os.listdir(path)):
+        if item.startswith('.'):
+            continue
+        fn = os.path.join(path, item)
+        if os.path.isfile(fn):
+            res.append(('{}{}'.format(prefix, item), fn))
+    return res
+
+
+def write_archive(file_name, chunks):
+    """
+    Write an archive to a file, as it is produced.
+
+    :param file_name: Where to write it
+    :param chunks: What :py:func:`tar_stream` returns
+    :return: The file name
+    """
+    _dir = os.path.dirname(file_name)
+    if _dir:
+        # Another download may be creating it too
+        os.makedirs(_dir, exist_ok=True)
+    with open(file_name, 'wb') as fp:
+        for _chunk in chunks:
+            fp.write(_chunk)
+    return file_name
+
+
+def fingerprint(path):
+    """
+    :param path: A directory
+    :return: A digest of the names, sizes and modification times of the
+        files in it
+    """
+    _hash = hashlib.sha256()
+    for _name, fn in dir_members(path):
+        _stat = os.stat(fn)
+        _hash.update('{}\0{}\0{}\n'.format(_name, _stat.st_size,
+                                           _stat.st_mtime_ns).encode('utf-8'))
+    return _hash.hexdigest()[:32]
+
+
+def file_chunks(file_name, chunk_size=CHUNK_SIZE):
+    with open(file_name, 'rb') as fp:
+        while True:
+            _data = fp.read(chunk_size)
+            if not _data:
+                return
+            yield _data
+
+
+class ArchiveCache(object):
+    def __init__(self, directory):
+        """
+        :param directory: Where the archives are kept
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def archive(self, key, _fingerprint, make):
+        """
+        :param key: Tuple of path components for the archive, e.g. the
+            tester id, tag and profile
+        :param _fingerprint: Fingerprint of what the archive is made from
+        :param make: Function returning a generator of chunks of a new
+            archive
+        :return: Generator of chunks of the archive
+        """
+        _dir = os.path.join(self.directory, *key)
+        _name = os.path.join(_dir, _fingerprint)
+        if os.path.isfile(_name):
+            with self.lock:
+                self.hits += 1
+            return file_chunks(_name)
+
+        with self.lock:
+            self.misses += 1
+        return self.store(_dir, _fingerprint, make())
+
+    @staticmethod
+    def store(_dir, _fingerprint, chunks):
+        """
+        Pass the chunks on while writing them to the cache. If not all of
+        them are used, nothing is kept.
+        """
+        os.makedirs(_dir, exist_ok=True)
+        _tmp = os.path.join(_dir, '.{}.{}'.format(_fingerprint,
+                                                  uuid.uuid4().hex))
+        try:
+            with open(_tmp, 'wb') as fp:
+                for _chunk in chunks:
+                    fp.write(_chunk)
+                    yield _chunk
+            os.rename(_tmp, os.path.join(_dir, _fingerprint))
+        finally:
+            if os.path.exists(_tmp):
+                os.unlink(_tmp)
+
+        # Older versions of the archive
+        for _item in os.listdir(_dir):
+            if _item != _fingerprint and not _item.startswith('.'):
+                try:
+                    os.unlink(os.path.join(_dir, _item))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
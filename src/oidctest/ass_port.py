@@ -1,8 +1,13 @@
+import fcntl
+import heapq
 import json
+import os
+from contextlib import contextmanager
 from urllib.parse import unquote_plus
 
 import logging
-from otest.proc import find_test_instances
+
+from oidctest.proc import ProcessRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -11,22 +16,82 @@ class OutOfRange(Exception):
     pass
 
 
+class PortInUse(Exception):
+    pass
+
+
 class AssignedPorts(object):
-    def __init__(self, filename, min, max):
+    """
+    Keeps track of which port is assigned to which test instance.
+
+    The assignments are kept in a JSON file. Changes are appended to a
+    journal next to it and folded into the JSON file, using an atomic
+    replace, once the journal has grown to compact_after lines.
+
+    Free ports are found using a min-heap of released ports below a high
+    water mark, so the lowest free port is always handed out first.
+
+    Several processes use the same files, so appending to the journal and
+    compacting is done holding an exclusive lock on <filename>.lock, and
+    what is compacted is what is on disk, not what this process has seen.
+    """
+
+    def __init__(self, filename, min, max, compact_after=100):
         self.filename = filename
+        self.journal = '{}.journal'.format(filename)
+        self.lockfile = '{}.lock'.format(filename)
         self.min = min
         self.max = max
+        self.compact_after = compact_after
         self._db = {}
+        self._owner = {}
+        self._released = []
+        self._high = min
+        self._journal_lines = 0
 
     def make_key(self, *args):
         return ']['.join([unquote_plus(v) for v in args])
 
+    # ------------------------------------------------------------------
+    # In memory bookkeeping
+
+    def _assign(self, key, port):
+        try:
+            _owner = self._owner[port]
+        except KeyError:
+            pass
+        else:
+            if _owner != key:
+                raise PortInUse('Port {} already assigned to {}'.format(
+                    port, _owner))
+
+        try:
+            self._release(self._db[key])
+        except KeyError:
+            pass
+
+        self._db[key] = port
+        self._owner[port] = key
+
+    def _release(self, port):
+        del self._owner[port]
+        if self.min <= port < self._high:
+            heapq.heappush(self._released, port)
+
+    def _reset(self):
+        self._db = {}
+        self._owner = {}
+        self._released = []
+        self._high = self.min
+
+    # ------------------------------------------------------------------
+
     def __setitem__(self, key, value):
         if '%' in key:
             key = unquote_plus(key)
 
-        self._db[key] = value
-        self.dump()
+        self._assign(key, value)
+        self._log({'set': [key, value]})
 
     def __getitem__(self, item):
         if "%" in item:
@@ -38,9 +103,9 @@ class AssignedPorts(object):
         if '%' in key:
             key = unquote_plus(key)
 
+        self._release(self._db.pop(key))
         logger.info("Removed {}".format(key))
-        del self._db[key]
-        self.dump()
+        self._log({'del': key})
 
     def keys(self):
         return self._db.keys()
@@ -56,54 +121,198 @@ class AssignedPorts(object):
             item = unquote_plus(item)
         return item in self._db
 
-    def dump(self):
-        fp = open(self.filename, 'w')
-        fp.write(json.dumps(self._db))
+    def release(self, *args):
+        """
+        Return the port assigned to an entity to the free ports.
+
+        :param args: entity identifiers
+        :return: The port or 0 if none was assigned
+        """
+        eid = self.make_key(*args)
+        try:
+            _port = self._db[eid]
+        except KeyError:
+            return 0
+
+        del self[eid]
+        return _port
+
+    # ------------------------------------------------------------------
+    # Persistence
+
+    @contextmanager
+    def _locked(self):
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _log(self, entry):
+        with self._locked():
+            fp = open(self.journal, 'a')
+            fp.write('{}\n'.format(json.dumps(entry)))
+            fp.flush()
+            os.fsync(fp.fileno())
+            fp.close()
+
+            self._journal_lines += 1
+            if self._journal_lines >= self.compact_after:
+                self._compact()
+
+    def _write_atomic(self, filename, data):
+        _tmp = '{}.tmp'.format(filename)
+        fp = open(_tmp, 'w')
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
         fp.close()
+        os.replace(_tmp, filename)
+
+    def dump(self):
+        """
+        Write all assignments to the JSON file and start a new journal.
+        """
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        # Others may have added to the journal since we last looked
+        self.load()
+        self._write_atomic(self.filename, json.dumps(self._db))
+        # The journal is replaced, not truncated, so a reader can tell
+        self._write_atomic(self.journal, '')
+        self._journal_lines = 0
+
+    def _read(self):
+        try:
+            _ino = os.stat(self.journal).st_ino
+        except FileNotFoundError:
+            _ino = None
+
+        try:
+            _ass = open(self.filename, 'r').read()
+        except FileNotFoundError:
+            _ass = ''
+
+        try:
+            fp = open(self.journal, 'r')
+        except FileNotFoundError:
+            _lines = []
+            _jino = None
+        else:
+            _jino = os.fstat(fp.fileno()).st_ino
+            _lines = fp.readlines()
+            fp.close()
+
+        return _ino == _jino, _ass, _lines
+
+    def load(self):
+        """
+        Read the JSON file and replay the journal on top of it.
+        """
+        for _ in range(10):
+            consistent, _ass, _lines = self._read()
+            if consistent:  # not compacted while we were reading
+                break
+
+        self._reset()
 
-    def sync(self, test_script):
+        _entries = []
+        if _ass:
+            for key, val in json.loads(_ass).items():
+                _entries.append({'set': [key, val]})
+        for line in _lines:
+            try:
+                _entries.append(json.loads(line))
+            except ValueError:  # write cut short by a crash
+                logger.warning('Bad line in {}: {}'.format(self.journal,
+                                                           line))
+        self._journal_lines = len(_lines)
+
+        for entry in _entries:
+            if 'set' in entry:
+                key, port = entry['set']
+                try:
+                    self._assign(key, port)
+                except PortInUse as err:
+                    # Will get a new port next time it is started
+                    logger.warning('Dropping {}: {}'.format(key, err))
+                    try:
+                        self._release(self._db.pop(key))
+                    except KeyError:
+                        pass
+            elif 'del' in entry:
+                try:
+                    self._release(self._db.pop(entry['del']))
+                except KeyError:
+                    pass
+
+    def sync(self, test_script, registry=None):
+        """
+        Add port assignments for test instances that are running but not
+        known.
+
+        :param test_script: The test tool script
+        :param registry: A :py:class:`oidctest.proc.ProcessRegistry`
+            instance
+        :return: Dictionary with key and process ID of the running instances
+        """
         running_processes = {}
 
-        update = False
-        inst = find_test_instances(test_script)
+        if registry is None:
+            registry = ProcessRegistry(test_script)
+
+        inst = registry.instances()
         if inst:
             for pid, info in inst.items():
                 key = self.make_key(info["iss"], info["tag"])
                 if key not in self._db:
-                    self[key] = int(info["port"])
-                    update = True
+                    try:
+                        self[key] = int(info["port"])
+                    except (PortInUse, ValueError) as err:
+                        logger.error('Running instance {}: {}'.format(key,
+                                                                      err))
+                        continue
                 running_processes[key] = pid
 
-        if update:
-            self.dump()
-
         return running_processes
 
-    def load(self):
-        try:
-            _ass = open(self.filename, 'r').read()
-        except FileNotFoundError:
-            pass
-        else:
-            if _ass:
-                # So not to write back to disc
-                for key, val in json.loads(_ass).items():
-                    self._db[key] = val
+    # ------------------------------------------------------------------
+    # Allocation
+
+    def _allocate(self):
+        while self._released:
+            _port = heapq.heappop(self._released)
+            if _port not in self._owner:
+                return _port
+
+        while self._high in self._owner:
+            self._high += 1
+        if self._high > self.max:
+            raise OutOfRange('Out of ports')
+        _port = self._high
+        self._high += 1
+        return _port
 
     def next_free_port(self, prev=0):
+        """
+        :param prev: If given the first free port from this one and up,
+            otherwise the lowest free port.
+        :return: port number
+        """
         if not prev:
-            prev = self.min
-        pl = list(self._db.values())
-        if not pl:
-            return prev
-        else:
-            _port = prev
-            while _port <= self.max:
-                if not _port in pl:
-                    break
-                _port += 1
-            if _port > self.max:
-                raise OutOfRange('Out of ports')
+            _port = self._allocate()
+            # Not used yet, put it back
+            heapq.heappush(self._released, _port)
+            return _port
+
+        _port = prev
+        while _port in self._owner:
+            _port += 1
+        if _port > self.max:
+            raise OutOfRange('Out of ports')
         return _port
 
     def register_port(self, *args):
@@ -118,11 +327,7 @@ class AssignedPorts(object):
             # already registered ?
             _port = self._db[eid]
         except KeyError:
-            if self._db == {}:
-                _port = self.min
-            else:
-                _port = self.next_free_port()
+            _port = self._allocate()
             logger.info('Assigned port {} for {}'.format(_port, eid))
-            self._db[eid] = _port
-            self.dump()
+            self[eid] = _port
         return _port
@@ -0,0 +1,213 @@
+"""
+A dictionary like cache with a bounded number of entries or size, least
+recently used eviction and an idle timeout.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Eviction reasons
+LRU = 'lru'
+TTL = 'ttl'
+MEMORY = 'memory'
+SIZE = 'size'
+# Not evictions but passed to on_evict all the same
+REMOVED = 'removed'
+REPLACED = 'replaced'
+
+
+def rss():
+    """The resident set size of this process in bytes."""
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class LRUCache(object):
+    def __init__(self, max_entries=0, ttl=0, max_memory=0, on_evict=None,
+                 name='cache', max_size=0, sizeof=None):
+        """
+        :param max_entries: Max number of entries, 0 means no limit
+        :param ttl: Seconds an entry may go unused before it is dropped,
+            0 means forever
+        :param max_memory: If the process' resident set size goes above
+            this many bytes when an entry is added, least recently used
+            entries are dropped. 0 means no limit.
+        :param on_evict: Function called with key, value and reason when an
+            entry is dropped, also when it is removed or replaced
+        :param name: Used in log messages
+        :param max_size: Max total size of the entries, 0 means no limit
+        :param sizeof: Function called with key and value returning the
+            size of an entry, needed if max_size is used
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.on_evict = on_evict
+        self.name = name
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._db = OrderedDict()
+        self._used = {}
+        self._sizes = {}
+        self.size = 0
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {LRU: 0, TTL: 0, MEMORY: 0, SIZE: 0}
+
+    def _forget(self, key):
+        del self._used[key]
+        self.size -= self._sizes.pop(key, 0)
+
+    def _evict(self, key, reason):
+        _val = self._db.pop(key)
+        self._forget(key)
+        self.evictions[reason] += 1
+        logger.debug('{}: evicted {} ({})'.format(self.name, key, reason))
+        self._dropped(key, _val, reason)
+
+    def _dropped(self, key, value, reason):
+        if self.on_evict:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as err:
+                logger.error('{}: on_evict failed for {}: {}'.format(
+                    self.name, key, err))
+
+    def expire(self, now=None):
+        """
+        Drop entries that has not been used within ttl seconds.
+
+        :return: Number of entries dropped
+        """
+        if not self.ttl:
+            return 0
+        _limit = (now or time.time()) - self.ttl
+        n = 0
+        with self.lock:
+            # Least recently used first
+            for key in list(self._db.keys()):
+                if self._used[key] > _limit:
+                    break
+                self._evict(key, TTL)
+                n += 1
+        return n
+
+    def _shrink(self):
+        while self.max_entries and len(self._db) > self.max_entries:
+            self._evict(next(iter(self._db)), LRU)
+
+        # The entry just added is kept, even if it's too big on its own
+        while self.max_size and len(self._db) > 1 and \
+                self.size > self.max_size:
+            self._evict(next(iter(self._db)), SIZE)
+
+        if self.max_memory and len(self._db) > 1 and rss() > self.max_memory:
+            # Freed memory doesn't show up right away, so drop a tenth of
+            # the entries rather than one at a time until under the limit
+            for i in range(max(1, len(self._db) // 10)):
+                self._evict(next(iter(self._db)), MEMORY)
+
+    def __getitem__(self, key):
+        with self.lock:
+            try:
+                _val = self._db[key]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            if self.ttl and self._used[key] + self.ttl < time.time():
+                self._evict(key, TTL)
+                self.misses += 1
+                raise KeyError(key)
+
+            self._db.move_to_end(key)
+            self._used[key] = time.time()
+            self.hits += 1
+            return _val
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            _old = self._db.get(key, value)
+            if key in self._db:
+                self._forget(key)
+            if self.max_size:
+                self._sizes[key] = self.sizeof(key, value)
+                self.size += self._sizes[key]
+            self._db[key] = value
+            self._db.move_to_end(key)
+            self._used[key] = time.time()
+            if _old is not value:
+                self._dropped(key, _old, REPLACED)
+            self.expire()
+            self._shrink()
+
+    def __delitem__(self, key):
+        with self.lock:
+            _val = self._db.pop(key)
+            self._forget(key)
+            self._dropped(key, _val, REMOVED)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self._db
+
+    def __len__(self):
+        return len(self._db)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key not in self._db:
+                return self._db.pop(key, *default)
+            _val = self._db.pop(key)
+            self._forget(key)
+            self._dropped(key, _val, REMOVED)
+            return _val
+
+    def keys(self):
+        with self.lock:
+            return list(self._db.keys())
+
+    def values(self):
+        with self.lock:
+            return list(self._db.values())
+
+    def items(self):
+        with self.lock:
+            return list(self._db.items())
+
+    def clear(self):
+        with self.lock:
+            _items = list(self._db.items())
+            self._db.clear()
+            self._used.clear()
+            self._sizes.clear()
+            self.size = 0
+            for key, _val in _items:
+                self._dropped(key, _val, REMOVED)
+
+    def stats(self):
+        """
+        :return: Dictionary with the size of the cache and how often
+            entries were found, not found and evicted
+        """
+        with self.lock:
+            return {
+                'name': self.name,
+                'entries': len(self._db),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': dict(self.evictions)
+            }
@@ -6,35 +6,18 @@ import logging
 from otest.events import Events
 from otest.events import EV_HTTP_REQUEST
 from otest.events import HTTPRequest
-from otest.events import layout
+
+from oidctest import eventlog
+from oidctest import logwriter
 
 logger = logging.getLogger(__name__)
 
 
 def write_events(events, oper_id, test_id):
-    _dir = os.path.join("log", oper_id)
-    file_name = os.path.join(_dir, test_id + '.txt')
-
-    try:
-        fp = open(file_name, "a+")
-    except IOError:
-        try:
-            os.makedirs(_dir)
-        except OSError:
-            pass
-
-        try:
-            fp = open(file_name, "w")
-        except Exception as err:
-            logger.error(
-                "Couldn't dump to log file {} reason: {}".format(
-                    file_name, err))
-            raise
-
-    _elem = [layout(0, ev) for ev in events]
-    fp.write("\n".join(_elem))
-    fp.write("\n\n")
-    fp.close()
+    file_name = os.path.join("log", oper_id, test_id + eventlog.LOG_EXT)
+    _endpoint = eventlog.request_endpoint(
+        events, '/{}/{}/'.format(oper_id, test_id))
+    logwriter.write(file_name, eventlog.format_events(events, _endpoint))
 
 
 def dump_log():
@@ -46,6 +29,21 @@ def dump_log():
         write_events(op.events, op.oper_id, op.test_id)
 
 
+def check_etag(etag):
+    """
+    Set the ETag of the response and answer 304 if the client already
+    has what it refers to.
+
+    :param etag: The ETag, quotes included
+    """
+    cherrypy.response.headers['ETag'] = etag
+    _match = [str(x) for x in
+              cherrypy.request.headers.elements('If-None-Match')]
+    if etag in _match or '*' in _match:
+        # The client has got this one already
+        raise cherrypy.HTTPRedirect([], 304)
+
+
 def init_events(path, msg=''):
     ev = Events()
     if msg:
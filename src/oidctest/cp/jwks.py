@@ -0,0 +1,205 @@
+"""
+Serving the OP instances' JWKS documents from memory.
+
+Most OP instances publish the same JWKS, so documents are stored once under
+a digest of their content. A URL containing the digest never changes
+content and can be cached for as long as the client wants. Instances that
+rotate their keys while a test runs also have a URL of their own, where
+the current document is found.
+
+A document published by a Provider instance that is still kept is held,
+it's only let go, and may be dropped, once no such instance refers to it.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import cherrypy
+
+from oidctest.cache import LRUCache
+from oidctest.cp import check_etag
+
+logger = logging.getLogger(__name__)
+
+# What the files written by earlier versions were called
+STALE_PATTERN = ('jwks_', '.json')
+# What the documents written by a JWKSStore are called, not to be taken
+# for stale ones if they are kept in the same directory
+DUMP_PATTERN = 'jwks-{}.json'
+
+
+def digest(jwks):
+    """
+    :param jwks: A JWKS as a dictionary
+    :return: The serialized document and a digest of it
+    """
+    doc = json.dumps(jwks, sort_keys=True).encode('utf-8')
+    return doc, hashlib.sha256(doc).hexdigest()[:32]
+
+
+class JWKSStore(object):
+    def __init__(self, max_entries=1000, directory=''):
+        """
+        :param max_entries: Max number of documents kept
+        :param directory: If given, every new document is also written to a
+            file in this directory
+        """
+        # Documents no one holds
+        self.docs = LRUCache(max_entries=max_entries, name='jwks')
+        # digest -> [document, number of holders]
+        self.held = {}
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def _add(self, jwks):
+        doc, _digest = digest(jwks)
+        if _digest in self.held:
+            return _digest, None
+        # Looked up, not only checked, so it's the most recently used
+        if self.docs.get(_digest) is None:
+            self.docs[_digest] = doc
+            if self.directory:
+                self.dump(_digest, doc)
+        return _digest, doc
+
+    def add(self, jwks):
+        """
+        :param jwks: A JWKS as a dictionary
+        :return: The digest of the document
+        """
+        with self.lock:
+            return self._add(jwks)[0]
+
+    def hold(self, jwks):
+        """
+        Add a document that must be kept until it is released.
+
+        :param jwks: A JWKS as a dictionary
+        :return: The digest of the document
+        """
+        with self.lock:
+            _digest, doc = self._add(jwks)
+            if doc is None:
+                self.held[_digest][1] += 1
+            else:
+                self.docs.pop(_digest, None)
+                self.held[_digest] = [doc, 1]
+        return _digest
+
+    def release(self, _digest):
+        """
+        Let go of a document held by :py:meth:`hold`.
+        """
+        with self.lock:
+            try:
+                _held = self.held[_digest]
+            except KeyError:
+                return
+            _held[1] -= 1
+            if _held[1] <= 0:
+                del self.held[_digest]
+                self.docs[_digest] = _held[0]
+
+    def get(self, _digest):
+        with self.lock:
+            try:
+                return self.held[_digest][0]
+            except KeyError:
+                pass
+            doc = self.docs.get(_digest)
+        if doc is None and self.directory:
+            doc = self.load(_digest)
+        return doc
+
+    def load(self, _digest):
+        """
+        :return: A document dropped from memory but written to a file
+            earlier, None if there is none
+        """
+        # Only digests make it into file names
+        if not _digest.isalnum():
+            return None
+        _name = os.path.join(self.directory, DUMP_PATTERN.format(_digest))
+        try:
+            with open(_name, 'rb') as fp:
+                return fp.read()
+        except IOError:
+            return None
+
+    def dump(self, _digest, doc):
+        _name = os.path.join(self.directory, DUMP_PATTERN.format(_digest))
+        try:
+            with open(_name, 'wb') as fp:
+                fp.write(doc)
+        except IOError as err:
+            logger.error('Could not write {}: {}'.format(_name, err))
+
+    def __len__(self):
+        return len(self.docs) + len(self.held)
+
+
+def remove_stale_files(directory, max_age=86400, now=None):
+    """
+    Remove the JWKS files that were written for each OP instance by
+    earlier versions.
+
+    :param directory: Where the files are
+    :param max_age: Only remove files older than this many seconds
+    :return: Number of files removed
+    """
+    if now is None:
+        now = time.time()
+
+    count = 0
+    for _name in os.listdir(directory):
+        if not (_name.startswith(STALE_PATTERN[0]) and
+                _name.endswith(STALE_PATTERN[1])):
+            continue
+        _path = os.path.join(directory, _name)
+        try:
+            if now - os.stat(_path).st_mtime > max_age:
+                os.unlink(_path)
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+def serve(doc, _digest, cache_control):
+    resp = cherrypy.response
+    resp.headers['Cache-Control'] = cache_control
+    check_etag('"{}"'.format(_digest))
+
+    resp.headers['Content-Type'] = 'application/json'
+    return doc
+
+
+class JWKS(object):
+    """
+    Documents by digest, /jwks/<digest>.json
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @cherrypy.expose
+    def default(self, name):
+        _digest = name[:-5] if name.endswith('.json') else name
+        doc = self.store.get(_digest)
+        if doc is None:
+            raise cherrypy.NotFound()
+        return serve(doc, _digest, 'public, max-age=31536000, immutable')
+
+
+class InstanceJWKS(object):
+    """
+    The present JWKS of an OP instance, <op>/jwks.json
+    """
+
+    @cherrypy.expose
+    def index(self, op):
+        doc, _digest = digest(op.jwks)
+        return serve(doc, _digest, 'no-cache')
@@ -1,12 +1,24 @@
-import gzip
+import functools
 import os
 import shutil
-import tarfile
 import time
 
 import cherrypy
 from otest.result import safe_url
 
+from oidctest import dir_index
+from oidctest import eventlog
+from oidctest import logwriter
+from oidctest.archive import ArchiveCache
+from oidctest.archive import dir_members
+from oidctest.archive import fingerprint
+from oidctest.archive import tar_stream
+from oidctest.archive import write_archive
+from oidctest.cp import check_etag
+from oidctest.cp import tail
+from oidctest.dir_index import page_links
+from oidctest.dir_index import page_of
+
 PRE_HTML = """
 <!DOCTYPE html>
 <html lang="en">
@@ -77,6 +89,19 @@ POST_HTML = """
 """
 
 
+# How much of a log is sent before what is added when it's followed,
+# number of events or, for text files, bytes
+FOLLOW_BACKLOG = 10
+FOLLOW_BYTES = 4096
+
+
+def _page_number(page):
+    try:
+        return int(page)
+    except ValueError:
+        raise cherrypy.HTTPError(400, 'page must be a number')
+
+
 def display_log(opid, logs):
     el = ["<ul>"]
     for name, path in logs:
@@ -93,62 +118,57 @@ def display_testers(logs):
     return "\n".join(el)
 
 
+def rp_log_members(log_dir, bid):
+    """
+    :param log_dir: The log directory
+    :param bid: tester id
+    :return: List of (name in the archive, source) for the logs of a tester
+    """
+    res = []
+    for item in eventlog.log_names(os.listdir(os.path.join(log_dir, bid))):
+        if item.startswith("."):
+            continue
+
+        fn = os.path.join(log_dir, bid, item)
+        _arcname = '{}/{}'.format(bid, item)
+        if item.endswith(eventlog.TEXT_EXT):
+            # The logs are rendered as text, one at a time
+            res.append((_arcname, functools.partial(_log_text, fn)))
+        elif os.path.isfile(fn):
+            res.append((_arcname, fn))
+    return res
+
+
+def _log_text(fn):
+    return (eventlog.read_text(fn) or '').encode('utf-8')
+
+
 def create_rp_tar_archive(wd, bid, backup=False):
     """
-    links all the logfiles in log/<tester_id>/<test_id> to
-    tar/<tester_id>.<test_id> or backup/...
+    Archive all the logfiles in log/<tester_id>. A backup is gzipped and
+    written to backup/<tester_id>/.
 
     :param wd: Base directory
     :param bid: tester id
     :param backup: Is this aa backup or not ?
-    :return:
+    :return: The name of the backup file or, if not a backup, a generator
+        of the parts of the tar file
     """
 
-    if backup:
-        _dir = os.path.join(wd, "backup", bid)
-        tname = "{}.{}.tar".format(bid, time.time())
-    else:
-        _dir = os.path.join(wd, "tar")
-        tname = "{}.tar".format(bid)
-
-    if not os.path.isdir(_dir):
-        os.makedirs(_dir)
-
     _log = os.path.join(wd, 'log')
-    if not os.path.isdir(_log):
+    if not os.path.isdir(os.path.join(_log, bid)):
         raise cherrypy.HTTPError(400, b'No such directory')
 
-    # Must open the tar file in the tar/backup directory
-    os.chdir(_dir)
-    tar = tarfile.open(tname, "w")
-
-    # back to the log directory
-    os.chdir(os.path.join(wd, 'log'))
-    for item in os.listdir(bid):
-        if item.startswith("."):
-            continue
+    # Everything written and the files closed
+    logwriter.flush(os.path.join(_log, bid))
 
-        fn = os.path.join(bid, item)
-        if os.path.isfile(fn):
-            tar.add(fn)
-
-    tar.close()
-
-    # Back to the tar/backup directory
-    os.chdir(_dir)
+    _members = rp_log_members(_log, bid)
     if backup:
-        with open(tname, 'rb') as f_in:
-            with gzip.open('{}.gz'.format(tname), 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-
-        _res = open('{}.gz'.format(tname), 'rb').read()
-    else:
-        _res = open(tname, 'rb').read()
+        tname = "{}.{}.tar.gz".format(bid, time.time())
+        return write_archive(os.path.join(wd, "backup", bid, tname),
+                             tar_stream(_members, compress=True))
 
-    os.chdir(wd)
-
-    # content='application/x-gzip'
-    return _res
+    return tar_stream(_members)
 
 
 class Log(object):
@@ -157,7 +177,17 @@ class Log(object):
         self.version = version
 
     @cherrypy.expose
-    def index(self, op_id='', test_id=''):
+    def index(self, op_id='', test_id='', typ='', endpoint='', start='',
+              limit='0', page='1', follow=''):
+        """
+        :param typ: Only show events of this type
+        :param endpoint: Only show events from requests to this endpoint
+        :param start: Skip this many events, if negative the last events
+        :param limit: Max number of events to show
+        :param page: Which page of a directory listing to show
+        :param follow: If set, the events are sent as they are written, as
+            server-sent events
+        """
         if op_id and test_id:
             path = os.path.join(self.root, op_id, test_id)
         elif op_id:
@@ -165,25 +195,21 @@ class Log(object):
         else:
             path = self.root
 
-        if os.path.isfile(path):
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return open(path).read()
-        elif os.path.isdir(path):
-            item = []
-            for (dirpath, dirnames, filenames) in os.walk(path):
-                if dirnames:
-                    item = [(fn, fn) for fn in dirnames]
-                    break
-                if filenames:
-                    item = [(fn, fn) for fn in filenames]
-                    break
-
-            item.sort()
+        logwriter.flush(path)
+        if os.path.isdir(path):
+            _listing = dir_index.listing(path)
+            if _listing.dirs:
+                names = _listing.dirs
+            else:
+                names = eventlog.log_names(_listing.files)
+            names, page, pages = page_of(names, _page_number(page))
+            item = [(fn, fn) for fn in names]
 
             response = [
                 PRE_HTML,
                 '<p>A list of test results that are saved on disc:</p>',
-                display_log(op_id, item)]
+                display_log(op_id, item),
+                page_links(cherrypy.url(), page, pages)]
 
             response.append('<hr />')
 
@@ -202,6 +228,51 @@ class Log(object):
 
             return '\n'.join(response)
 
+        if follow:
+            return self.follow(path, typ, endpoint, start)
+
+        if os.path.isfile(path) and not path.endswith(eventlog.TEXT_EXT):
+            return tail.serve_log_file(path)
+
+        try:
+            start = int(start or 0)
+            limit = int(limit)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'start and limit must be numbers')
+        _text = eventlog.read_text(path, typ=typ, endpoint=endpoint,
+                                   start=start, limit=limit)
+        if _text is None:
+            raise cherrypy.NotFound()
+        return tail.serve_text(_text)
+
+    @staticmethod
+    def follow(path, typ, endpoint, start):
+        """
+        Send the events of a test log as they are written. The test may not
+        have been started yet.
+        """
+        try:
+            start = int(start or -FOLLOW_BACKLOG)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'start must be a number')
+
+        if path.endswith(eventlog.TEXT_EXT):
+            base = path[:-len(eventlog.TEXT_EXT)]
+        else:
+            base = path
+        _log = eventlog.EventLog(base)
+        if not _log.exists() and os.path.isfile(base + eventlog.TEXT_EXT):
+            # Written before there were records
+            return tail.start_stream(
+                tail.follow_file(base + eventlog.TEXT_EXT,
+                                 tail.last_event_id(-FOLLOW_BYTES)))
+        if not os.path.isdir(os.path.dirname(base)):
+            raise cherrypy.NotFound()
+
+        return tail.start_stream(
+            tail.follow_events(_log, tail.last_event_id(start), typ,
+                               endpoint))
+
     def _cp_dispatch(self, vpath):
         if len(vpath) == 1:
             cherrypy.request.params['op_id'] = vpath.pop()
@@ -222,7 +293,13 @@ class OPLog(object):
         self.tag = tag
 
     @cherrypy.expose
-    def index(self, op_id='', tag='', profile='', test_id=''):
+    def index(self, op_id='', tag='', profile='', test_id='', page='1',
+              follow=''):
+        """
+        :param page: Which page of a directory listing to show
+        :param follow: If set, lines are sent as they are added to the log,
+            as server-sent events
+        """
         prefix = ''
         if test_id:
             path = os.path.join(self.root, op_id, tag, profile, test_id)
@@ -243,19 +320,16 @@ class OPLog(object):
                 prefix = ''
 
         if os.path.isfile(path):
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return open(path).read()
+            if follow:
+                return tail.start_stream(
+                    tail.follow_file(path, tail.last_event_id(-FOLLOW_BYTES)))
+            return tail.serve_log_file(path)
         elif os.path.isdir(path):
-            item = []
-            for (dirpath, dirnames, filenames) in os.walk(path):
-                if dirnames:
-                    item = [(fn, '{}{}'.format(prefix,fn)) for fn in dirnames]
-                    break
-                if filenames:
-                    item = [(fn, '{}{}'.format(prefix,fn)) for fn in filenames]
-                    break
-
-            item.sort()
+            _listing = dir_index.listing(path)
+            names, page, pages = page_of(_listing.dirs or _listing.files,
+                                         _page_number(page))
+            item = [(fn, '{}{}'.format(prefix, fn)) for fn in names]
+            _links = page_links(cherrypy.url(), page, pages)
 
             _pre_html = self.pre_html['logs.html']
             if op_id:
@@ -273,14 +347,14 @@ class OPLog(object):
 
                 response = _pre_html.format(
                     info = 'A list of test results that are saved on disc:',
-                    list=display_log(op_id, item),
+                    list=display_log(op_id, item) + _links,
                     actions='\n'.join(_acts),
                     version=self.version
                 )
             else:
                 response = _pre_html.format(
                     info='A list of all testers registered on this server:',
-                    list=display_testers(item),
+                    list=display_testers(item) + _links,
                     actions='',
                     version=self.version
                 )
@@ -321,11 +395,12 @@ class ClearLog(object):
 
 class Tar(object):
     def __init__(self, root):
-        self.root = root  # The directory where the tar directory resides
+        self.root = root  # The directory where the log directory resides
 
     @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
     def index(self, op_id=''):
-        cherrypy.response.headers['Content-Type'] = 'application/x-gzip'
+        cherrypy.response.headers['Content-Type'] = 'application/x-tar'
         return create_rp_tar_archive(self.root, op_id, False)
 
     def _cp_dispatch(self, vpath):
@@ -339,14 +414,30 @@ class OPTar(object):
     def __init__(self, root, gzip=False):
         self.root = root
         self.gzip = gzip
+        # Archives are only made again if a log has changed
+        self.cache = ArchiveCache(os.path.join(root, 'tar'))
 
     @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
     def index(self, op_id, tag, profile):
+        _src_dir = os.path.join(self.root, 'log', op_id, tag, profile)
+        if not os.path.isdir(_src_dir):
+            raise cherrypy.HTTPError(400, b'No such directory')
+
+        _fingerprint = fingerprint(_src_dir)
         if self.gzip:
+            _name = '{}.tar.gz'.format(_fingerprint)
             cherrypy.response.headers['Content-Type'] = 'application/x-gzip'
         else:
+            _name = '{}.tar'.format(_fingerprint)
             cherrypy.response.headers['Content-Type'] = 'application/x-tar'
-        return self.create_rp_tar_archive(op_id, tag, profile)
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        check_etag('"{}"'.format(_name))
+
+        return self.cache.archive(
+            (op_id, tag, profile), _name,
+            functools.partial(self.create_rp_tar_archive, op_id, tag,
+                              profile))
 
     def _cp_dispatch(self, vpath):
         if len(vpath) == 3:  # Must be op_is, tag and profile
@@ -361,62 +452,32 @@ class OPTar(object):
 
         return vpath
 
-    def _gzip(self, tname, backup):
-        with open(tname, 'rb') as f_in:
-            with gzip.open('{}.gz'.format(tname), 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-
-        if backup:  # Don't keep the tar file
-            os.unlink(tname)
-
-        return open('{}.gz'.format(tname), 'rb').read()
-
     def create_rp_tar_archive(self, op_id, tag, profile, backup=False,
                               gzip=None):
-        # links all the logfiles in log_root/<tester_id>/<test_id> to
-        # tar_root/<tester_id>/<test_id>
-        # mk_tardir('backup', userid)
+        """
+        Archive the logfiles in log_root/<tester_id>/<tag>/<profile>. A
+        backup is written to backup/<tester_id>/.
 
+        :return: The name of the backup file or, if not a backup, a
+            generator of the parts of the archive
+        """
         if gzip is None:
             gzip = self.gzip
 
-        if backup:
-            _target_dir = os.path.join(self.root, 'backup', op_id)
-            tname = "{}.{}.{}.tar".format(tag, profile, time.time())
-        else:
-            _target_dir = os.path.join(self.root, 'tar',op_id)
-            tname = "{}.{}.tar".format(tag, profile)
-
-        if not os.path.isdir(_target_dir):
-            os.makedirs(_target_dir)
-
-        os.chdir(_target_dir)
-        # Start creating the tar file
-        tar = tarfile.open(tname, "w")
-
         _src_dir = os.path.join(self.root, 'log', op_id, tag, profile)
         if not os.path.isdir(_src_dir):
             raise cherrypy.HTTPError(400, b'No such directory')
 
-        os.chdir(_src_dir)
-        for item in os.listdir('.'):
-            if item.startswith("."):
-                continue
-
-            fn = os.path.join('.', item)
-
-            if os.path.isfile(fn):
-                tar.add(fn)
-        tar.close()
-
-        os.chdir(_target_dir)
-        if gzip:
-            res = self._gzip(tname, backup)
-        else:
-            res = open(tname, 'rb').read()
+        _stream = tar_stream(dir_members(_src_dir, './'),
+                             compress=gzip)
+        if backup:
+            tname = "{}.{}.{}.tar".format(tag, profile, time.time())
+            if gzip:
+                tname += '.gz'
+            return write_archive(
+                os.path.join(self.root, 'backup', op_id, tname), _stream)
 
-        os.chdir(self.root)
-        return res
+        return _stream
 
     @cherrypy.expose
     def backup(self, op_id, tag, profile):
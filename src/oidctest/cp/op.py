@@ -18,8 +18,8 @@ from otest.flow import ABBR
 
 from oidctest.cp import init_events
 from oidctest.cp import write_events
+from oidctest.cp.jwks import InstanceJWKS
 from oidctest.cp.op_handler import init_keyjar
-from oidctest.cp.op_handler import write_jwks_uri
 
 logger = logging.getLogger(__name__)
 
@@ -546,14 +546,14 @@ def choice(profiles):
 
 
 class Reset(object):
-    def __init__(self, com_args, op_args):
-        self.com_args = com_args
-        self.op_args = op_args
+    def __init__(self, op_handler):
+        self.op_handler = op_handler
 
     @cherrypy.expose
     def index(self, op):
-        init_keyjar(op, self.op_args['keyjar'], self.com_args)
-        write_jwks_uri(op, self.op_args, {})
+        init_keyjar(op, self.op_handler.op_args['keyjar'],
+                    self.op_handler.com_args)
+        self.op_handler.publish_jwks(op, self.op_handler.op_args['jwks'])
         return b'OK'
 
 
@@ -638,7 +638,8 @@ class Provider(Root):
         self.claims = Claims()
         self.end_session = EndSession()
         self.logout = Logout()
-        self.reset = Reset(self.op_handler.com_args, self.op_handler.op_args)
+        self.reset = Reset(self.op_handler)
+        self.jwks = InstanceJWKS()
         self.check_session_iframe = CheckSessionIframe()
         self.post_logout_page = PostLogoutPage()
 
@@ -688,6 +689,8 @@ class Provider(Root):
                         return self.check_session_iframe
                     elif endpoint == 'post_logout_page':
                         return self.post_logout_page
+                    elif endpoint == 'jwks.json':
+                        return self.jwks
                     else:  # Shouldn't be any other
                         raise cherrypy.NotFound()
                 if len(vpath) == 2:
@@ -1,50 +1,138 @@
 import copy
-import json
-import os
 
-from oic import rndstr
-from oic.utils.keyio import KeyJar
 from oic.utils.keyio import key_summary
 from oic.utils.sdb import create_session_db
 from otest.conversation import Conversation
 
 from oidctest import UnknownTestID
+from oidctest.cache import LRUCache
+from oidctest.cp.jwks import JWKSStore
+from oidctest.keys import SharedKeyJar
+from oidctest.keys import all_active
+from oidctest.keys import copy_issuer_keys
 
 
-def write_jwks_uri(op, op_arg, folder):
-    _name = "jwks_{}.json".format(rndstr())
-    filename = os.path.join(folder,'static',_name)
-    with open(filename, "w") as f:
-        f.write(json.dumps(op_arg["jwks"]))
-    f.close()
-
-    op.jwks_uri = "{}static/{}".format(op_arg["baseurl"], _name)
-    op.jwks_name = filename
+# Behaviors where the OP replaces its keys during the test
+ROLLOVER = ['rotsig', 'rotenc']
 
 
 def init_keyjar(op, kj, com_args):
-    op.keyjar = KeyJar()
+    # The KeyBundles in kj are used by all instances until they are changed
+    op.keyjar = SharedKeyJar(kj, issuers=[''])
     try:
         op.keyjar.verify_ssl = com_args['verify_ssl']
     except KeyError:
         pass
 
-    for kb in kj.issuer_keys['']:
-        for k in kb.keys():
-            k.inactive_since = 0
-        op.keyjar.add_kb('', copy.copy(kb))
+    if not all(all_active(kb) for kb in op.keyjar.issuer_keys['']):
+        for kb in op.keyjar.writable(''):
+            for k in kb.keys():
+                k.inactive_since = 0
+
+
+class Prototype(object):
+    """
+    What all the OP instances for a test have in common, worked out once
+    from the test description.
+    """
+
+    def __init__(self, test_id, test_conf):
+        _tc = test_conf[test_id]
+        if not _tc:
+            raise UnknownTestID(test_id)
+
+        self.test_id = test_id
+        self.capabilities = _tc.get('capabilities', {})
+        self.jwx_def = {}
+        for _typ in ["signing_alg", "encryption_alg", "encryption_enc"]:
+            for item in ["id_token", "userinfo"]:
+                cap_param = '{}_{}_values_supported'.format(item, _typ)
+                try:
+                    self.jwx_def[(_typ, item)] = self.capabilities[
+                        cap_param][0]
+                except KeyError:
+                    pass
+        self.claims_type = _tc.get('claims')
+        self.behavior_type = _tc.get('behavior')
+
+    def apply(self, op):
+        # Each instance gets its own copy, they are small
+        op.capabilities.update(copy.deepcopy(self.capabilities))
+        for (_typ, item), val in self.jwx_def.items():
+            op.jwx_def[_typ][item] = val
+
+        if self.claims_type is not None:
+            op.claims_type = copy.deepcopy(self.claims_type)
+
+        if self.behavior_type is not None:
+            op.behavior_type = copy.deepcopy(self.behavior_type)
+            op.server.behavior_type = op.behavior_type
 
 
 class OPHandler(object):
     def __init__(self, provider_cls, op_args, com_args, test_conf, folder,
-                 check_session_iframe=''):
+                 check_session_iframe='', max_entries=1000, ttl=86400,
+                 max_memory=0, jwks_store=None):
+        """
+        :param max_entries: Max number of Provider instances kept
+        :param ttl: Seconds a Provider instance may go unused before it is
+            thrown away
+        :param max_memory: Max resident set size in bytes before Provider
+            instances are thrown away, 0 means no limit
+        :param jwks_store: Where the published JWKS documents are kept, a
+            :py:class:`oidctest.cp.jwks.JWKSStore` instance
+        """
         self.provider_cls = provider_cls
         self.op_args = op_args
         self.com_args = com_args
         self.test_conf = test_conf  # elsewhere called flows
         self.folder = folder
-        self.op = {}
+        # Thrown away instances are built again on the next request
+        self.op = LRUCache(max_entries, ttl, max_memory,
+                           on_evict=self._evicted, name='OPHandler')
         self.check_session_iframe = check_session_iframe
+        self.prototypes = {}
+        if jwks_store is None:
+            jwks_store = JWKSStore()
+        self.jwks_store = jwks_store
+
+    def prototype(self, test_id):
+        try:
+            return self.prototypes[test_id]
+        except KeyError:
+            _proto = Prototype(test_id, self.test_conf)
+            self.prototypes[test_id] = _proto
+            return _proto
+
+    def stats(self):
+        return self.op.stats()
+
+    def _evicted(self, key, op, reason):
+        # Its JWKS may be dropped now that no one publishes it
+        _digest = getattr(op, 'jwks_digest', None)
+        if _digest:
+            self.jwks_store.release(_digest)
+
+    def publish_jwks(self, op, jwks):
+        """
+        Make jwks the document found at op.jwks_uri.
+
+        :param op: A Provider instance, op.name must be set
+        :param jwks: A JWKS as a dictionary
+        """
+        op.jwks = jwks
+        # Kept as long as the instance is
+        _digest = self.jwks_store.hold(jwks)
+        _prev = getattr(op, 'jwks_digest', None)
+        if _prev:
+            self.jwks_store.release(_prev)
+        op.jwks_digest = _digest
+        if set(ROLLOVER).intersection(op.behavior_type):
+            # The RP has to find the new keys at the same place
+            op.jwks_uri = '{}/jwks.json'.format(op.name)
+        else:
+            op.jwks_uri = '{}jwks/{}.json'.format(self.op_args['baseurl'],
+                                                  _digest)
 
     def get(self, oper_id, test_id, events, endpoint):
         # addr = get_client_address(environ)
@@ -58,16 +146,11 @@ class OPHandler(object):
                     pass
                 elif test_id == 'rp-id_token-kid-absent-multiple-jwks':
                     setattr(_op, 'keys', self.op_args['marg']['keys'])
-                    _op_args = {
-                        'baseurl': self.op_args['baseurl'],
-                        'jwks': self.op_args['marg']['jwks']
-                    }
-                    write_jwks_uri(_op, _op_args, self.folder)
+                    self.publish_jwks(_op, self.op_args['marg']['jwks'])
                 else:
                     init_keyjar(_op, self.op_args['keyjar'], self.com_args)
-                    _kj = _op.keyjar.export_jwks(True, '')
-                    _op.keyjar.import_jwks(_kj, _op.name)
-                    write_jwks_uri(_op, self.op_args, self.folder)
+                    copy_issuer_keys(_op.keyjar, '', _op.name)
+                    self.publish_jwks(_op, self.op_args['jwks'])
         except KeyError:
             if test_id in ['rp-id_token-kid-absent-multiple-jwks']:
                 _op_args = {}
@@ -116,8 +199,6 @@ class OPHandler(object):
         if not op.cookie_path:
             op.cookie_path = '/'
 
-        write_jwks_uri(op, op_arg, self.folder)
-
         if op.baseurl.endswith("/"):
             div = ""
         else:
@@ -128,37 +209,12 @@ class OPHandler(object):
 
         op.logout_verify_url = '{}/{}'.format(op.name, op.logout_path)
         op.post_logout_page = "{}/{}".format(op.baseurl, "post_logout_page")
-        _kj = op.keyjar.export_jwks(True, '')
-        op.keyjar.import_jwks(_kj, op.name)
+        copy_issuer_keys(op.keyjar, '', op.name)
 
-        _tc = test_conf[test_id]
-        if not _tc:
-            raise UnknownTestID(test_id)
-
-        try:
-            _capa = _tc['capabilities']
-        except KeyError:
-            pass
+        if test_conf is self.test_conf:
+            self.prototype(test_id).apply(op)
         else:
-            op.capabilities.update(_capa)
-            # update jwx
-            for _typ in ["signing_alg", "encryption_alg", "encryption_enc"]:
-                for item in ["id_token", "userinfo"]:
-                    cap_param = '{}_{}_values_supported'.format(item, _typ)
-                    try:
-                        op.jwx_def[_typ][item] = _capa[cap_param][0]
-                    except KeyError:
-                        pass
-
-        try:
-            op.claims_type = _tc["claims"]
-        except KeyError:
-            pass
-
-        try:
-            op.behavior_type = _tc["behavior"]
-            op.server.behavior_type = _tc["behavior"]
-        except KeyError:
-            pass
+            Prototype(test_id, test_conf).apply(op)
 
+        self.publish_jwks(op, op_arg['jwks'])
         return op
@@ -15,6 +15,7 @@ from oic.utils.userinfo import UserInfo
 
 from oidctest.endpoints import ENDPOINTS
 from oidctest.endpoints import add_endpoints
+from oidctest.keys import copy_issuer_keys
 from oidctest.rp.provider import Provider
 
 LOGGER = logging.getLogger(__name__)
@@ -67,8 +68,7 @@ def main_setup(args, lookup=None):
         "client_authn": verify_client,
         "symkey": config.SYM_KEY,
         "template_lookup": lookup,
-        "template": {"form_post": "form_response.mako"},
-        "jwks_name": "./static/jwks_{}.json"
+        "template": {"form_post": "form_response.mako"}
     }
 
     # Client data base
@@ -201,8 +201,7 @@ def cb_setup(args, lookup=None):
         "baseurl": _baseurl,
         "client_authn": verify_client,
         "template_lookup": lookup,
-        "template": {"form_post": "form_response.mako"},
-        "jwks_name": "./static/jwks_{}.json"
+        "template": {"form_post": "form_response.mako"}
     }
 
     try:
@@ -303,8 +302,7 @@ def cb_setup(args, lookup=None):
         _op = Provider(sdb=_sdb, **com_args)
         jwks = keyjar_init(_op, config.keys)
         # Add keys under the issuer ID
-        _bj = _op.keyjar.export_jwks(True, '')
-        _op.keyjar.import_jwks(_bj, _op.baseurl)
+        copy_issuer_keys(_op.keyjar, '', _op.baseurl)
     except KeyError:
         pass
     else:
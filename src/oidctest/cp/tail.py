@@ -0,0 +1,252 @@
+"""
+Sending test logs, in part or as they grow.
+
+Log files are sent with Range support. A log can also be followed, like
+``tail -f``, as a stream of server-sent events (text/event-stream). Each
+event carries a position in the log as its id, so a client that
+reconnects with Last-Event-ID carries on where it was.
+
+Every follower occupies a server thread, so only a few at a time are
+allowed and each is ended after a while.
+"""
+import logging
+import threading
+import time
+
+import cherrypy
+from cherrypy.lib import httputil
+from cherrypy.lib.static import serve_file
+
+from oidctest.eventlog import render
+
+logger = logging.getLogger(__name__)
+
+MAX_FOLLOWERS = 4
+# Seconds between looking for more
+INTERVAL = 1.0
+# Seconds between comments sent to find out if the client is still there
+KEEPALIVE = 15
+# Max seconds a follower is kept
+MAX_TIME = 3600
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Followers(object):
+    def __init__(self, max_followers=MAX_FOLLOWERS):
+        self.max_followers = max_followers
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a place if there is one, checked and taken in one go.
+
+        :return: True if a place was taken
+        """
+        with self.lock:
+            if self.active >= self.max_followers:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+followers = Followers()
+
+
+def serve_log_file(path):
+    """
+    A log file, as a whole or the range asked for.
+    """
+    return serve_file(path, content_type='text/plain')
+
+
+def serve_text(text):
+    """
+    Text made on the spot, as a whole or the range asked for.
+    """
+    _data = text.encode('utf-8')
+    resp = cherrypy.response
+    resp.headers['Content-Type'] = 'text/plain;charset=utf-8'
+    resp.headers['Accept-Ranges'] = 'bytes'
+
+    r = httputil.get_ranges(cherrypy.request.headers.get('Range'),
+                            len(_data))
+    if r == []:
+        resp.headers['Content-Range'] = 'bytes */{}'.format(len(_data))
+        raise cherrypy.HTTPError(416, 'Invalid Range')
+    if r and len(r) == 1:
+        start, stop = r[0]
+        stop = min(stop, len(_data))
+        resp.status = '206 Partial Content'
+        resp.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, stop - 1, len(_data))
+        return _data[start:stop]
+    # Several ranges are not worth the trouble, all of it then
+    return _data
+
+
+def sse(text, _id=None):
+    """
+    :param text: The data of the event, may be several lines
+    :param _id: The event id
+    :return: An event in the text/event-stream format
+    """
+    lines = []
+    if _id is not None:
+        lines.append('id: {}'.format(_id))
+    for line in text.split('\n'):
+        lines.append('data: {}'.format(line))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def last_event_id(default):
+    """
+    :return: The id of the last event the client got, as a number
+    """
+    try:
+        return int(cherrypy.request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        return default
+
+
+class Stream(object):
+    """
+    The events sent to a follower. The place the follower holds is given
+    back when the events run out or the stream is closed, or failing that
+    when the stream is thrown away without ever being read.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.held = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.events)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.held:
+            self.held = False
+            followers.release()
+        self.events.close()
+
+    def __del__(self):
+        self.close()
+
+
+def start_stream(events):
+    """
+    Takes a follower place before anything is sent.
+
+    :param events: The events to send
+    :return: The stream to hand back to CherryPy
+    """
+    if not followers.try_acquire():
+        raise cherrypy.HTTPError(503, 'Too many logs followed right now')
+    resp = cherrypy.response
+    resp.headers['Content-Type'] = 'text/event-stream'
+    resp.headers['Cache-Control'] = 'no-cache'
+    # Not buffered by a proxy in front
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.stream = True
+    return Stream(events)
+
+
+def _wait(quiet):
+    """
+    :return: A keepalive comment if it's time for one, otherwise None
+    """
+    time.sleep(INTERVAL)
+    if quiet + INTERVAL >= KEEPALIVE:
+        return b': keepalive\n\n'
+    return None
+
+
+def follow_events(log, start=0, typ='', endpoint='', max_time=MAX_TIME):
+    """
+    The records of a log rendered as text, one event per record. The id of
+    an event is the number of records in the log up to and including it.
+
+    :param log: An :py:class:`oidctest.eventlog.EventLog`
+    :param start: Number of the first record to send, if negative counted
+        from the end
+    :param typ: Only events of this type
+    :param endpoint: Only events of requests to this endpoint
+    """
+    typ = typ.lower()
+    _end = time.time() + max_time
+    _quiet = 0
+    while time.time() < _end:
+        if log.exists():
+            count = log.update_index()
+            if start < 0:
+                start = max(count + start, 0)
+            if count > start:
+                for rec in log.records(start=start, limit=count - start):
+                    start += 1
+                    if typ and rec['type'] != typ:
+                        continue
+                    if endpoint and rec.get('endpoint', '') != endpoint:
+                        continue
+                    yield sse(render(rec), start)
+                _quiet = 0
+                continue
+
+        _keepalive = _wait(_quiet)
+        _quiet += INTERVAL
+        if _keepalive:
+            _quiet = 0
+            yield _keepalive
+
+
+def follow_file(path, offset=0, max_time=MAX_TIME):
+    """
+    The lines added to a text file. The id of an event is the position in
+    the file after the lines in it.
+
+    :param path: The file
+    :param offset: Where in the file to start, if negative counted from
+        the end and moved forward to the start of a line
+    """
+    with open(path, 'rb') as fp:
+        if offset < 0:
+            fp.seek(0, 2)
+            offset = max(fp.tell() + offset, 0)
+            if offset:
+                fp.seek(offset - 1)
+                # Skip the line cut in two
+                fp.readline()
+                offset = fp.tell()
+        fp.seek(offset)
+
+        _end = time.time() + max_time
+        _quiet = 0
+        _rest = b''
+        while time.time() < _end:
+            _data = _rest + fp.read(CHUNK_SIZE)
+            _cut = _data.rfind(b'\n') + 1
+            # Only whole lines
+            _rest = _data[_cut:]
+            if _cut:
+                offset = fp.tell() - len(_rest)
+                yield sse(_data[:_cut - 1].decode('utf-8', 'replace'),
+                          offset)
+                _quiet = 0
+                continue
+
+            _keepalive = _wait(_quiet)
+            _quiet += INTERVAL
+            if _keepalive:
+                _quiet = 0
+                yield _keepalive
@@ -0,0 +1,231 @@
+"""
+Signing and encryption of JWTs in separate processes.
+
+Creating a JWS with an RSA or EC key, in particular EC which is done in
+pure Python, holds the GIL. With many RPs testing at the same time the
+requests then wait for each other. A :py:class:`CryptoPool` with workers
+does the signing and encryption in a pool of processes, without workers
+everything is done inline as before. If the pool can not be used for
+some reason the work is also done inline.
+
+Keys are sent to the workers as JWKs. A worker keeps the keys it has seen
+so a key is only parsed once per worker.
+"""
+import json
+import logging
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from jwkest.jwe import JWE
+from jwkest.jwk import keyrep
+from jwkest.jws import JWS
+
+logger = logging.getLogger(__name__)
+
+# Algorithms where the work is worth sending somewhere else
+OFFLOAD_PREFIX = ('RS', 'PS', 'ES')
+
+# Keys parsed by a worker
+_keys = {}
+MAX_KEYS = 1000
+
+
+def _load_keys(jwks):
+    res = []
+    for jwk in jwks:
+        _id = json.dumps(jwk, sort_keys=True)
+        try:
+            res.append(_keys[_id])
+        except KeyError:
+            if len(_keys) >= MAX_KEYS:
+                _keys.clear()
+            # As KeyBundle does it, with the values as they are
+            _key = keyrep(jwk, enc=None)
+            _keys[_id] = _key
+            res.append(_key)
+    return res
+
+
+def _sign(payload, alg, jwks):
+    return JWS(payload, alg=alg).sign_compact(_load_keys(jwks))
+
+
+def _encrypt(payload, jwks, kwargs):
+    return JWE(payload, **kwargs).encrypt(_load_keys(jwks), context='public')
+
+
+def _ping():
+    return True
+
+
+def sign_inline(payload, alg, keys):
+    return JWS(payload, alg=alg).sign_compact(keys)
+
+
+def encrypt_inline(payload, keys, **kwargs):
+    return JWE(payload, **kwargs).encrypt(keys, context='public')
+
+
+class CryptoPool(object):
+    def __init__(self, workers=0, timeout=10):
+        """
+        :param workers: Number of worker processes, 0 means everything is
+            done inline
+        :param timeout: Seconds to wait for a worker before doing the work
+            inline
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        # Metrics
+        self.offloaded = 0
+        self.inline = 0
+        self.fallbacks = 0
+
+    def start(self):
+        if not self.workers:
+            return
+        with self.lock:
+            if self.executor is not None:
+                return
+            # Not forked, the server has threads running
+            self.executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor = self.executor
+        # Start the workers now rather than on the first request
+        for _future in [_executor.submit(_ping) for _ in range(self.workers)]:
+            try:
+                _future.result(30)
+            except (BrokenProcessPool, TimeoutError, OSError) as err:
+                logger.error('Crypto workers not started: {}'.format(err))
+                self._broken(_executor)
+                return
+        logger.info('Started {} crypto workers'.format(self.workers))
+
+    def stop(self):
+        with self.lock:
+            _executor = self.executor
+            self.executor = None
+        if _executor is not None:
+            # Not waiting leaves the interpreter hanging at exit
+            _executor.shutdown(wait=True)
+
+    def _broken(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=True)
+
+    def _run(self, func, *args):
+        """
+        :return: The result or None if no worker could do it
+        """
+        if self.executor is None:
+            self.start()
+        _executor = self.executor
+        if _executor is None:
+            return None
+
+        try:
+            _res = _executor.submit(func, *args).result(self.timeout)
+        except (BrokenProcessPool, pickle.PicklingError, OSError) as err:
+            logger.error('Crypto workers failed: {}'.format(err))
+            self._broken(_executor)
+        except TimeoutError:
+            logger.warning('No crypto worker answered in {}s'.format(
+                self.timeout))
+        else:
+            with self.lock:
+                self.offloaded += 1
+            return _res
+
+        with self.lock:
+            self.fallbacks += 1
+        return None
+
+    def sign(self, payload, alg, keys):
+        """
+        :param payload: What to sign, a string
+        :param alg: The signing algorithm
+        :param keys: List of jwkest Key instances to choose from
+        :return: A signed JWT
+        """
+        if self.workers and keys and alg.startswith(OFFLOAD_PREFIX):
+            _jwks = [k.serialize(private=True) for k in keys]
+            _res = self._run(_sign, payload, alg, _jwks)
+            if _res is not None:
+                return _res
+
+        with self.lock:
+            self.inline += 1
+        return sign_inline(payload, alg, keys)
+
+    def encrypt(self, payload, keys, **kwargs):
+        """
+        :param payload: What to encrypt, a string
+        :param keys: List of jwkest Key instances to choose from
+        :param kwargs: JWE header parameters like alg, enc and cty
+        :return: A JWE
+        """
+        if self.workers and keys:
+            _jwks = [k.serialize(private=True) for k in keys]
+            _res = self._run(_encrypt, payload, _jwks, kwargs)
+            if _res is not None:
+                return _res
+
+        with self.lock:
+            self.inline += 1
+        return encrypt_inline(payload, keys, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'offloaded': self.offloaded,
+                'inline': self.inline,
+                'fallbacks': self.fallbacks
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(workers=0, timeout=10):
+    """
+    Replace the pool used by the module level functions.
+
+    :return: The new :py:class:`CryptoPool`
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+        _pool = CryptoPool(workers, timeout)
+        return _pool
+
+
+def default_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CryptoPool()
+        return _pool
+
+
+def stop():
+    if _pool is not None:
+        _pool.stop()
+
+
+def sign(payload, alg, keys):
+    return default_pool().sign(payload, alg, keys)
+
+
+def encrypt(payload, keys, **kwargs):
+    return default_pool().encrypt(payload, keys, **kwargs)
@@ -0,0 +1,196 @@
+"""
+Sorted listings of directories, kept in memory.
+
+The log and entity browsers list directories with many thousands of
+entries on every page view. A :py:class:`DirIndex` keeps the sorted
+listing of a directory until the directory changes. Changes are learnt
+about through inotify if it is available, otherwise the modification time
+of the directory is compared with the one the listing was made from, one
+stat instead of reading and sorting the whole directory.
+"""
+import logging
+import os
+import threading
+import time
+
+from oidctest import inotify
+from oidctest.cache import LRUCache
+from oidctest.cache import REMOVED
+from oidctest.cache import REPLACED
+from oidctest.inotify import DIR_CHANGES
+from oidctest.inotify import IN_IGNORED
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+
+# A directory changed this recently may change again within the resolution
+# of the file system's timestamps without its modification time changing
+RACY_NS = 2 * 10 ** 9
+
+
+class Listing(object):
+    def __init__(self, dirs, files, mtime, watched, racy):
+        """
+        :param dirs: Sorted list of the sub directories
+        :param files: Sorted list of the other entries
+        :param mtime: Modification time of the directory when listed
+        :param watched: Whether changes are reported by inotify
+        :param racy: Whether it was listed too soon after the last change
+            to rely on the modification time
+        """
+        self.dirs = dirs
+        self.files = files
+        self.mtime = mtime
+        self.watched = watched
+        self.racy = racy
+
+
+def page_of(items, page=1, page_size=PAGE_SIZE):
+    """
+    :param items: A list
+    :param page: Page number, the first one is 1
+    :return: The items on the page, the page number, within the range of
+        pages, and the number of pages
+    """
+    pages = max(1, (len(items) + page_size - 1) // page_size)
+    page = min(max(page, 1), pages)
+    return items[(page - 1) * page_size:page * page_size], page, pages
+
+
+def page_links(url, page, pages):
+    """
+    :return: HTML with links to the previous and next pages, empty if there
+        is only one page
+    """
+    if pages <= 1:
+        return ''
+    _links = []
+    if page > 1:
+        _links.append('<a href="{}?page={}">&laquo; Previous</a>'.format(
+            url, page - 1))
+    _links.append('Page {} of {}'.format(page, pages))
+    if page < pages:
+        _links.append('<a href="{}?page={}">Next &raquo;</a>'.format(
+            url, page + 1))
+    return '<p>{}</p>'.format(' | '.join(_links))
+
+
+class DirIndex(object):
+    def __init__(self, max_entries=1000, watcher=None):
+        """
+        :param max_entries: Max number of directories whose listings are
+            kept
+        :param watcher: A :py:class:`oidctest.inotify.Watcher`, if None
+            only modification times are used
+        """
+        self.listings = LRUCache(max_entries=max_entries,
+                                 on_evict=self._evicted, name='dir_index')
+        self.watcher = watcher
+        self.watched = set()
+        # Number of changes seen per watched directory
+        self.changes = {}
+        self.lock = threading.Lock()
+
+    def listing(self, path):
+        """
+        :param path: A directory
+        :return: A :py:class:`Listing`
+        """
+        path = os.path.abspath(path)
+        _listing = self.listings.get(path)
+        if _listing is not None:
+            if _listing.watched:
+                return _listing
+            if not _listing.racy and \
+                    os.stat(path).st_mtime_ns == _listing.mtime:
+                return _listing
+
+        _watched = self._watch(path)
+        with self.lock:
+            _changes = self.changes.get(path)
+
+        _stat = os.stat(path)
+        dirs = []
+        files = []
+        for _entry in os.scandir(path):
+            if _entry.is_dir():
+                dirs.append(_entry.name)
+            else:
+                files.append(_entry.name)
+        dirs.sort()
+        files.sort()
+        _racy = time.time_ns() - _stat.st_mtime_ns < RACY_NS
+        _listing = Listing(dirs, files, _stat.st_mtime_ns, _watched, _racy)
+
+        with self.lock:
+            # Not if it changed while it was read
+            if self.changes.get(path) == _changes:
+                self.listings[path] = _listing
+        return _listing
+
+    def _watch(self, path):
+        if self.watcher is None:
+            return False
+        with self.lock:
+            if path in self.watched:
+                return True
+        if not self.watcher.watch(path, self._changed, DIR_CHANGES):
+            return False
+        with self.lock:
+            self.watched.add(path)
+            self.changes[path] = 0
+        return True
+
+    def _changed(self, path, name, mask):
+        with self.lock:
+            self.listings.pop(path, None)
+            if mask & IN_IGNORED:
+                # No longer watched, removed or moved
+                self.watched.discard(path)
+                self.changes.pop(path, None)
+            elif path in self.watched:
+                self.changes[path] += 1
+
+    def _evicted(self, path, listing, reason):
+        if reason in (REMOVED, REPLACED):
+            # Still of interest, only the listing is out of date
+            return
+        if listing.watched and self.watcher is not None:
+            self.watcher.unwatch(path, self._changed)
+            self.watched.discard(path)
+            self.changes.pop(path, None)
+
+    def invalidate(self, path):
+        self._changed(os.path.abspath(path), None, 0)
+
+    def stats(self):
+        return self.listings.stats()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def configure(max_entries=1000, watcher=None):
+    """
+    Replace the index used by the module level functions.
+
+    :return: The new :py:class:`DirIndex`
+    """
+    global _index
+    with _index_lock:
+        _index = DirIndex(max_entries, watcher)
+        return _index
+
+
+def default_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DirIndex(watcher=inotify.default_watcher())
+        return _index
+
+
+def listing(path):
+    return default_index().listing(path)
@@ -31,8 +31,10 @@ from otest.events import EV_REQUEST
 from otest.events import EV_REQUEST_ARGS
 from otest.events import EV_RESPONSE
 from otest.events import Operation
-from otest.events import layout
 
+from oidctest import dir_index
+from oidctest import eventlog
+from oidctest import logwriter
 from oidctest.utils import create_rp_tar_archive
 
 __author__ = 'roland'
@@ -52,34 +54,16 @@ def do_response(cls, *args, **kwargs):
 
 def dump_log(session_info, events):
     try:
-        file_name = os.path.join("log", session_info["oper_id"],
-                                 session_info["test_id"] + '.txt')
-        _dir = os.path.join("log", session_info["oper_id"])
+        _dir = session_info["oper_id"]
     except KeyError:
-        file_name = os.path.join("log", session_info["addr"],
-                                 session_info["test_id"] + '.txt')
-        _dir = os.path.join("log", session_info["addr"])
+        _dir = session_info["addr"]
+    _test_id = session_info["test_id"]
 
-    try:
-        fp = open(file_name, "a+")
-    except IOError:
-        try:
-            os.makedirs(_dir)
-        except OSError:
-            pass
-
-        try:
-            fp = open(file_name, "w")
-        except Exception as err:
-            logging.error(
-                "Couldn't dump to log file {} reason: {}".format(
-                    file_name, err))
-            raise
-
-    _elem = [layout(0, ev) for ev in events]
-    fp.write("\n".join(_elem))
-    fp.write("\n\n")
-    fp.close()
+    # As oidctest.cp.write_events does it
+    file_name = os.path.join("log", _dir, _test_id + eventlog.LOG_EXT)
+    _endpoint = eventlog.request_endpoint(
+        events, '/{}/{}/'.format(_dir, _test_id))
+    logwriter.write(file_name, eventlog.format_events(events, _endpoint))
 
 
 def find_identifier(uri):
@@ -409,18 +393,8 @@ def display_log(path, environ, start_response, lookup):
         else:
             tester_id = ''
 
-        item = []
-        for (dirpath, dirnames, filenames) in os.walk(path):
-            if dirnames:
-                # item = [(fn, os.path.join(path, fn)) for fn in dirnames]
-                item = [(fn, fn) for fn in dirnames]
-                break
-            if filenames:
-                # item = [(fn, os.path.join(path, fn)) for fn in filenames]
-                item = [(fn, fn) for fn in filenames]
-                break
-
-        item.sort()
+        _listing = dir_index.listing(path)
+        item = [(fn, fn) for fn in _listing.dirs or _listing.files]
         resp = Response(mako_template="logs.mako",
                         template_lookup=lookup,
                         headers=CORS_HEADERS)
@@ -0,0 +1,343 @@
+"""
+Test logs as one JSON record per event.
+
+The events of a request to an OP instance are appended to
+``log/<oper_id>/<test_id>.jsonl``, one line per event, with the time,
+the type, the sender, the endpoint the request was sent to and the
+payload. The text that used to be written is rendered from the records
+when the log is looked at.
+
+Next to the log there is an index, ``<test_id>.idx``, with a fixed size
+entry per record holding where the record is in the log and a short hash
+of the type and the endpoint. The index is brought up to date by the
+reader, so the writer only ever appends to the log. Picking records by
+position, type or endpoint then only means reading the index and the
+records asked for.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from oic.oauth2 import Message
+from otest.events import Base
+from otest.events import EV_EXCEPTION
+from otest.events import EV_FUNCTION
+from otest.events import EV_HTTP_REQUEST
+from otest.events import EV_HTTP_RESPONSE
+from otest.events import EV_PROTOCOL_REQUEST
+from otest.events import EV_PROTOCOL_RESPONSE
+from otest.events import HTTPResponse
+from otest.events import OUTGOING
+
+logger = logging.getLogger(__name__)
+
+LOG_EXT = '.jsonl'
+INDEX_EXT = '.idx'
+TEXT_EXT = '.txt'
+
+# offset, length, type hash, endpoint hash
+INDEX_ENTRY = struct.Struct('<QIHH')
+
+_index_lock = threading.Lock()
+
+
+def short_hash(name):
+    return zlib.crc32(name.encode('utf-8')) & 0xffff
+
+
+def _json(item):
+    return json.dumps(item, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def to_record(event, endpoint=''):
+    """
+    :param event: An otest.events.Event instance
+    :param endpoint: Where the request the event belongs to was sent
+    :return: A dictionary
+    """
+    rec = {'ts': event.timestamp, 'type': event.typ}
+    for attr in ['sender', 'ref', 'sub', 'direction']:
+        if getattr(event, attr):
+            rec[attr] = getattr(event, attr)
+    if endpoint:
+        rec['endpoint'] = endpoint
+    if event.kwargs:
+        rec['kwargs'] = event.kwargs
+
+    _data = event.data
+    if isinstance(_data, Message):
+        rec['kind'] = 'message'
+        rec['cls'] = _data.__class__.__name__
+        rec['data'] = _data.to_dict()
+    elif isinstance(_data, Base):
+        rec['kind'] = 'base'
+        rec['data'] = _data.gather_args()
+    elif isinstance(_data, HTTPResponse):
+        rec['kind'] = 'http_response'
+        rec['data'] = {'url': _data.url, 'status_code': _data.status_code,
+                       'text': _data.text}
+    elif isinstance(_data, (dict, list)):
+        rec['kind'] = 'json'
+        rec['data'] = _data
+    else:
+        rec['kind'] = 'text'
+        rec['data'] = str(_data)
+    return rec
+
+
+def request_endpoint(events, prefix=''):
+    """
+    :param events: The events of one request
+    :param prefix: The part of the path that is not the endpoint
+    :return: The endpoint the request was sent to
+    """
+    for event in events:
+        if event.typ == EV_HTTP_REQUEST:
+            _path = event.data.endpoint
+            if prefix and _path.startswith(prefix):
+                return _path[len(prefix):]
+            return _path.lstrip('/')
+    return ''
+
+
+def format_events(events, endpoint=''):
+    """
+    :param events: The events of one request
+    :param endpoint: Where the request was sent
+    :return: The lines to add to the log
+    """
+    lines = []
+    for event in events:
+        lines.append(to_record(event, endpoint))
+    if lines:
+        # The text has an empty line after each request
+        lines[-1]['end'] = True
+    return ''.join(json.dumps(rec, default=str) + '\n' for rec in lines)
+
+
+def render(rec, start=0):
+    """
+    The same text as otest.events.layout() gives for the event.
+
+    :param rec: A record
+    :param start: Timestamps are shown relative to this
+    :return: Text
+    """
+    elem = ['{}'.format(round(rec['ts'] - start, 3))]
+    if rec.get('direction'):
+        if rec['direction'] == OUTGOING:
+            elem.append('-->')
+        else:
+            elem.append('<--')
+
+    typ = rec['type']
+    kind = rec.get('kind')
+    _data = rec.get('data')
+    if typ == EV_FUNCTION and isinstance(_data, dict):
+        elem.append(_data['name'])
+        if _data.get('args'):
+            elem.append('args:{}'.format(_data['args']))
+        if _data.get('kwargs'):
+            elem.append('kwargs:{}'.format(_data['kwargs']))
+    elif typ == EV_HTTP_RESPONSE and kind == 'http_response':
+        elem.append(typ)
+        for key, label in [('url', 'url'), ('status_code', 'status_code'),
+                           ('text', 'message')]:
+            if _data.get(key):
+                elem.append('{}:{}'.format(label, _data[key]))
+    elif typ == EV_EXCEPTION:
+        elem.append(typ)
+        try:
+            elem.append('{} {}'.format(rec['kwargs']['note'], _data))
+        except KeyError:
+            elem.append('{}'.format(_data))
+    elif typ in [EV_PROTOCOL_REQUEST, EV_PROTOCOL_RESPONSE] and \
+            kind == 'message':
+        elem.extend([rec['cls'], _json(_data)])
+    else:
+        elem.append(typ)
+        if kind == 'base':
+            elem.append(_json(_data))
+        else:
+            elem.append(str(_data))
+
+    return ' '.join(elem)
+
+
+class EventLog(object):
+    def __init__(self, base):
+        """
+        :param base: Path to the log without extension,
+            e.g. log/<oper_id>/<test_id>
+        """
+        self.name = base + LOG_EXT
+        self.index_name = base + INDEX_EXT
+
+    def exists(self):
+        return os.path.isfile(self.name)
+
+    def update_index(self):
+        """
+        Add the records written since the last time to the index.
+
+        :return: Number of records in the log
+        """
+        with _index_lock:
+            try:
+                _size = os.path.getsize(self.index_name)
+            except OSError:
+                _size = 0
+            count = _size // INDEX_ENTRY.size
+
+            end = 0
+            if count:
+                with open(self.index_name, 'rb') as fp:
+                    fp.seek((count - 1) * INDEX_ENTRY.size)
+                    _offset, _length, _, _ = INDEX_ENTRY.unpack(
+                        fp.read(INDEX_ENTRY.size))
+                end = _offset + _length
+                if end > os.path.getsize(self.name):
+                    # Not the log the index was made for
+                    count = end = 0
+
+            entries = []
+            with open(self.name, 'rb') as fp:
+                fp.seek(end)
+                for line in fp:
+                    if not line.endswith(b'\n'):  # Still being written
+                        break
+                    try:
+                        rec = json.loads(line.decode('utf-8'))
+                        _typ = rec['type']
+                    except (ValueError, KeyError, TypeError):
+                        # Left out of the index, the rest can still be read
+                        logger.warning('Bad line in {} at {}: {!r}'.format(
+                            self.name, end, line[:200]))
+                        end += len(line)
+                        continue
+                    entries.append(INDEX_ENTRY.pack(
+                        end, len(line), short_hash(_typ),
+                        short_hash(rec.get('endpoint', ''))))
+                    end += len(line)
+
+            if entries or count * INDEX_ENTRY.size != _size:
+                with open(self.index_name, 'r+b' if _size else 'wb') as fp:
+                    fp.seek(count * INDEX_ENTRY.size)
+                    fp.write(b''.join(entries))
+                    fp.truncate()
+            return count + len(entries)
+
+    def entries(self, start=0, stop=None):
+        with open(self.index_name, 'rb') as fp:
+            fp.seek(start * INDEX_ENTRY.size)
+            if stop is None:
+                _data = fp.read()
+            else:
+                _data = fp.read((stop - start) * INDEX_ENTRY.size)
+        return list(INDEX_ENTRY.iter_unpack(_data))
+
+    def records(self, typ='', endpoint='', start=0, limit=0):
+        """
+        :param typ: Only events of this type
+        :param endpoint: Only events of requests to this endpoint
+        :param start: Skip this many of the events asked for, if negative
+            the events are counted from the end
+        :param limit: Max number of events, 0 means no limit
+        :return: List of records
+        """
+        count = self.update_index()
+        if not count:
+            return []
+        typ = typ.lower()
+
+        if not typ and not endpoint:
+            if start < 0:
+                start = max(count + start, 0)
+            stop = min(start + limit, count) if limit else count
+            if start >= stop:
+                return []
+            with open(self.name, 'rb') as fp:
+                return [self._read(fp, _entry)
+                        for _entry in self.entries(start, stop)]
+
+        _typ = short_hash(typ)
+        _endpoint = short_hash(endpoint)
+        res = []
+        with open(self.name, 'rb') as fp:
+            for _entry in self.entries(0, count):
+                if typ and _entry[2] != _typ:
+                    continue
+                if endpoint and _entry[3] != _endpoint:
+                    continue
+                rec = self._read(fp, _entry)
+                # Hashes are short
+                if typ and rec['type'] != typ:
+                    continue
+                if endpoint and rec.get('endpoint', '') != endpoint:
+                    continue
+                res.append(rec)
+                if start >= 0 and limit and len(res) == start + limit:
+                    break
+
+        res = res[start:]
+        if limit:
+            res = res[:limit]
+        return res
+
+    @staticmethod
+    def _read(fp, entry):
+        fp.seek(entry[0])
+        return json.loads(fp.read(entry[1]).decode('utf-8'))
+
+    def text(self, **kwargs):
+        """
+        :param kwargs: As for :py:meth:`records`
+        :return: The log as text
+        """
+        res = []
+        for rec in self.records(**kwargs):
+            res.append(render(rec) + '\n')
+            if rec.get('end'):
+                res.append('\n')
+        return ''.join(res)
+
+
+def read_text(path, **kwargs):
+    """
+    :param path: The log as it is named for the user, <test_id>.txt
+    :param kwargs: As for :py:meth:`EventLog.records`
+    :return: The text, None if there is no such log
+    """
+    if path.endswith(TEXT_EXT):
+        base = path[:-len(TEXT_EXT)]
+    else:
+        base = path
+
+    res = []
+    # Written before there were records
+    if os.path.isfile(base + TEXT_EXT):
+        with open(base + TEXT_EXT) as fp:
+            res.append(fp.read())
+    _log = EventLog(base)
+    if _log.exists():
+        res.append(_log.text(**kwargs))
+    elif not res:
+        return None
+    return ''.join(res)
+
+
+def log_names(names):
+    """
+    :param names: File names in a log directory
+    :return: The names of the logs in it as they are shown to the user
+    """
+    res = set()
+    for name in names:
+        if name.endswith(LOG_EXT):
+            res.add(name[:-len(LOG_EXT)] + TEXT_EXT)
+        elif not name.endswith(INDEX_EXT):
+            res.add(name)
+    return sorted(res)
@@ -1,9 +1,85 @@
+import json
 import logging
 import os
-import time
+import stat
+import threading
+import weakref
+
+from oidctest import inotify
+from oidctest.cache import LRUCache
+from oidctest.cache import REPLACED
+from oidctest.inotify import FILE_CHANGES
+from oidctest.inotify import IN_IGNORED
 
 logger = logging.getLogger(__name__)
 
+# Seconds between looking for changed files, when inotify can't be used
+RESCAN_INTERVAL = 5
+
+# value_conv for files holding JSON
+JSON_CONV = {'to': json.dumps, 'from': json.loads}
+
+
+class Rescanner(object):
+    """
+    Has the file systems that can't be watched look for changes now and
+    then, in a thread of its own.
+    """
+
+    def __init__(self, interval=RESCAN_INTERVAL):
+        self.interval = interval
+        self.stores = weakref.WeakSet()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def add(self, store):
+        """
+        :param store: Something with a rescan method
+        """
+        with self.lock:
+            self.stores.add(store)
+            if self.thread is None:
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.run,
+                                               name='rescan')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def remove(self, store):
+        with self.lock:
+            self.stores.discard(store)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                _stores = list(self.stores)
+            for _store in _stores:
+                try:
+                    _store.rescan()
+                except Exception as err:
+                    logger.error('Rescan failed: {}'.format(err))
+
+    def stop(self):
+        with self.lock:
+            _thread = self.thread
+            self.thread = None
+        if _thread is not None:
+            self.stopped.set()
+            _thread.join()
+
+
+_rescanner = None
+_rescanner_lock = threading.Lock()
+
+
+def default_rescanner():
+    global _rescanner
+    with _rescanner_lock:
+        if _rescanner is None:
+            _rescanner = Rescanner()
+        return _rescanner
+
 
 class FileSystem(object):
     """
@@ -11,9 +87,18 @@ class FileSystem(object):
     It has a dictionary like interface.
     Each key maps one-to-one to a file on disc, where the content of the
     file is the value.
+
+    Files are read once and kept. Changes to them are learnt about through
+    inotify, or if that can't be used by looking at the modification times
+    now and then, so a lookup doesn't touch the disc.
+
+    In the lazy mode files are only read when their values are asked for,
+    and only as much as c_size bytes of them is kept, the least recently
+    used values are dropped first.
     """
 
-    def __init__(self, fdir, key_conv=None, value_conv=None, c_size=0):
+    def __init__(self, fdir, key_conv=None, value_conv=None, c_size=0,
+                 watcher=None, rescanner=None, lazy=False):
         """
         :param fdir: The root of the directory
         :param key_conv: Converts to/from the key displayed by this class to
@@ -26,17 +111,131 @@ class FileSystem(object):
         :param value_conv: As with key_conv you can convert/translate
         the value bound to a key in the database to something that can easily
         be stored in a file. Like with key_conv the value of this parameter
-        is a dictionary with the keys ['to', 'from'].
+        is a dictionary with the keys ['to', 'from']. The value is converted
+        when the file is read, not every time it is used.
         :type value_conv: dictionary
+        :param c_size: Max number of bytes of files whose values are kept,
+        0 means no limit. Implies lazy.
+        :param watcher: A :py:class:`oidctest.inotify.Watcher`, by default
+            the shared one. If False inotify is not used.
+        :param rescanner: A :py:class:`Rescanner` used if the directory
+            can't be watched, by default the shared one
+        :param lazy: If True, keys() only lists the files and items() reads
+            them one at a time
         """
         self.fdir = fdir
         self.fmtime = {}
-        self.db = {}
+        self.fsize = {}
+        self.lazy = lazy or bool(c_size)
+        if c_size:
+            self.db = LRUCache(max_size=c_size, sizeof=self._sizeof,
+                               on_evict=self._evicted, name=fdir)
+        else:
+            self.db = {}
         self.key_conv = key_conv or {}
         self.value_conv = value_conv or {}
         if not os.path.isdir(fdir):
             os.makedirs(fdir)
 
+        self.lock = threading.Lock()
+        # Goes up every time something has changed
+        self.generation = 0
+        if watcher is None:
+            watcher = inotify.default_watcher()
+        self.watcher = watcher or None
+        self.rescanner = rescanner or default_rescanner()
+        self.watched = False
+        self._watch()
+
+    def _watch(self):
+        if self.watcher is not None and self.watcher.watch(
+                os.path.abspath(self.fdir), self._changed, FILE_CHANGES):
+            self.watched = True
+        else:
+            self.watched = False
+            self.rescanner.add(self)
+
+    def _changed(self, path, name, mask):
+        """
+        Called by the watcher when something has happened in the directory.
+        """
+        with self.lock:
+            self.generation += 1
+            if name is None or mask & IN_IGNORED:
+                # The directory itself or events lost, all may have changed
+                self.db.clear()
+                self.fmtime.clear()
+                self.fsize.clear()
+            else:
+                self.db.pop(name, None)
+                self.fmtime.pop(name, None)
+                self.fsize.pop(name, None)
+
+        if mask & IN_IGNORED:
+            # Removed or moved, no longer watched
+            self.watched = False
+            self.rescanner.add(self)
+
+    def rescan(self):
+        """
+        Forget the values of the files that have changed or are gone.
+        """
+        for item, _mtime in list(self.fmtime.items()):
+            if self.get_mtime(os.path.join(self.fdir, item)) != _mtime:
+                self.invalidate(item)
+
+    def invalidate(self, item):
+        with self.lock:
+            self.generation += 1
+            self.db.pop(item, None)
+            self.fmtime.pop(item, None)
+            self.fsize.pop(item, None)
+
+    def _sizeof(self, item, value):
+        return self.fsize.get(item, 0)
+
+    def _evicted(self, item, value, reason):
+        if reason == REPLACED:
+            # fmtime and fsize are already those of the new value
+            return
+        self.fmtime.pop(item, None)
+        self.fsize.pop(item, None)
+
+    def close(self):
+        """
+        Stop looking for changes.
+        """
+        if self.watched:
+            self.watcher.unwatch(os.path.abspath(self.fdir), self._changed)
+            self.watched = False
+        self.rescanner.remove(self)
+
+    def _load(self, item):
+        """
+        Read the file of a key and keep the value, unless the file changed
+        while it was read.
+        """
+        with self.lock:
+            _generation = self.generation
+
+        fname = os.path.join(self.fdir, item)
+        try:
+            _stat = os.stat(fname)
+        except OSError:
+            _stat = None
+        if _stat is None or not stat.S_ISREG(_stat.st_mode):
+            logger.error('Could not access {}'.format(fname))
+            raise KeyError(item)
+        logger.info("File content change in {}".format(item))
+        value = self._read_info(fname)
+
+        with self.lock:
+            if self.generation == _generation:
+                self.fmtime[item] = _stat.st_mtime_ns
+                self.fsize[item] = _stat.st_size
+                self.db[item] = value
+        return value
+
     def __getitem__(self, item):
         """
         Return the value bound to an identifier.
@@ -49,12 +248,10 @@ class FileSystem(object):
         except KeyError:
             pass
 
-        if self.is_changed(item):
-            logger.info("File content change in {}".format(item))
-            fname = os.path.join(self.fdir, item)
-            self.db[item] = self._read_info(fname)
-
-        return self.db[item]
+        try:
+            return self.db[item]
+        except KeyError:
+            return self._load(item)
 
     def __setitem__(self, key, value):
         """
@@ -83,25 +280,29 @@ class FileSystem(object):
             fp.write(value)
         fp.close()
 
-        self.db[_key] = value
-        self.fmtime[_key] = self.get_mtime(fname)
+        with self.lock:
+            self.generation += 1
+            self.fmtime[_key] = self.get_mtime(fname)
+            self.fsize[_key] = os.path.getsize(fname)
+            self.db[_key] = value
 
     def __delitem__(self, key):
         fname = os.path.join(self.fdir, key)
         if os.path.isfile(fname):
             os.unlink(fname)
 
-        try:
-            del self.db[key]
-        except KeyError:
-            pass
+        self.invalidate(key)
 
     def keys(self):
         """
         Implements the dict.keys() method
         """
-        self.sync()
-        for k in self.db.keys():
+        if self.lazy:
+            _keys = self._names()
+        else:
+            self.sync()
+            _keys = list(self.db.keys())
+        for k in _keys:
             try:
                 yield self.key_conv['from'](k)
             except KeyError:
@@ -113,17 +314,13 @@ class FileSystem(object):
         Find the time this file was last modified.
 
         :param fname: File name
-        :return: The last time the file was modified.
+        :return: The last time the file was modified, None if it can't be
+            found, for instance if it is being replaced
         """
         try:
-            mtime = os.stat(fname).st_mtime_ns
+            return os.stat(fname).st_mtime_ns
         except OSError:
-            # The file might be right in the middle of being written
-            # so sleep
-            time.sleep(1)
-            mtime = os.stat(fname).st_mtime_ns
-
-        return mtime
+            return None
 
     def is_changed(self, item):
         """
@@ -133,9 +330,8 @@ class FileSystem(object):
         :return: True/False
         """
         fname = os.path.join(self.fdir, item)
-        if os.path.isfile(fname):
-            mtime = self.get_mtime(fname)
-
+        mtime = self.get_mtime(fname)
+        if mtime is not None and os.path.isfile(fname):
             try:
                 _ftime = self.fmtime[item]
             except KeyError:  # Never been seen before
@@ -176,23 +372,44 @@ class FileSystem(object):
             os.makedirs(self.fdir)
 
         for f in os.listdir(self.fdir):
-            fname = os.path.join(self.fdir, f)
-            if not os.path.isfile(fname):
+            # What is kept is up to date
+            if f in self.db or not os.path.isfile(os.path.join(self.fdir, f)):
                 continue
-            if f in self.fmtime:
-                if self.is_changed(f):
-                    self.db[f] = self._read_info(fname)
-            else:
-                mtime = self.get_mtime(fname)
-                self.db[f] = self._read_info(fname)
-                self.fmtime[f] = mtime
+            try:
+                self._load(f)
+            except KeyError:  # Gone already
+                pass
+
+    def _names(self):
+        """
+        :return: The names of the files in the directory
+        """
+        if not os.path.isdir(self.fdir):
+            return []
+        # No stat needed to tell files from directories
+        return [_entry.name for _entry in os.scandir(self.fdir)
+                if _entry.is_file()]
+
+    def _lazy_items(self):
+        for name in self._names():
+            try:
+                yield name, self.db[name]
+            except KeyError:
+                try:
+                    yield name, self._load(name)
+                except KeyError:  # Gone already
+                    pass
 
     def items(self):
         """
         Implements the dict.items() method
         """
-        self.sync()
-        for k, v in self.db.items():
+        if self.lazy:
+            _items = self._lazy_items()
+        else:
+            self.sync()
+            _items = list(self.db.items())
+        for k, v in _items:
             try:
                 yield self.key_conv['from'](k), v
             except KeyError:
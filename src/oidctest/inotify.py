@@ -0,0 +1,199 @@
+"""
+Being told when directories change, through Linux inotify.
+
+A :py:class:`Watcher` has one thread reading the inotify events and calling
+the functions registered for the directory or file where something
+happened. inotify is used through ctypes. Where it is not available, not
+Linux or no watches left, :py:meth:`Watcher.watch` returns False and the
+user has to find out about changes some other way.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_MASK_ADD = 0x20000000
+
+IN_CLOEXEC = 0o2000000
+
+# Entries added to or removed from a directory
+DIR_CHANGES = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_DELETE_SELF | IN_MOVE_SELF)
+# Files in a directory written to or replaced
+FILE_CHANGES = DIR_CHANGES | IN_CLOSE_WRITE | IN_MODIFY | IN_ATTRIB
+
+# wd, mask, cookie, len
+EVENT = struct.Struct('iIII')
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Watcher(object):
+    def __init__(self):
+        self.fd = None
+        self.libc = None
+        self.thread = None
+        self.wakeup = None
+        # wd -> [path, callbacks]
+        self.watches = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        :return: True if inotify can be used
+        """
+        with self.lock:
+            if self.fd is not None:
+                return True
+            if self.libc is False:  # Tried already
+                return False
+
+            self.libc = _libc()
+            _fd = self.libc.inotify_init1(IN_CLOEXEC) if self.libc else -1
+            if _fd < 0:
+                logger.warning('inotify not available: {}'.format(
+                    os.strerror(ctypes.get_errno()) if self.libc else
+                    'no libc'))
+                self.libc = False
+                return False
+
+            self.fd = _fd
+            self.wakeup = os.pipe()
+            self.thread = threading.Thread(target=self.run, name='inotify')
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            _thread = self.thread
+            self.thread = None
+        if _thread is None:
+            return
+
+        os.write(self.wakeup[1], b'x')
+        _thread.join()
+        with self.lock:
+            os.close(self.fd)
+            for _fd in self.wakeup:
+                os.close(_fd)
+            self.fd = None
+            self.libc = None
+            self.watches = {}
+
+    def watch(self, path, callback, mask=DIR_CHANGES):
+        """
+        :param path: A directory or file
+        :param callback: Called with path, the name of what changed in it
+            (None if it was path itself or if events were lost) and the
+            inotify event mask
+        :param mask: What kind of changes to report
+        :return: True if path is watched
+        """
+        if not self.start():
+            return False
+
+        with self.lock:
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(path), mask | IN_MASK_ADD)
+            if wd < 0:
+                _errno = ctypes.get_errno()
+                if _errno == errno.ENOSPC:
+                    logger.warning('Out of inotify watches')
+                return False
+            try:
+                self.watches[wd][1].append(callback)
+            except KeyError:
+                self.watches[wd] = [path, [callback]]
+        return True
+
+    def unwatch(self, path, callback):
+        with self.lock:
+            for wd, (_path, _callbacks) in list(self.watches.items()):
+                if _path != path or callback not in _callbacks:
+                    continue
+                _callbacks.remove(callback)
+                if not _callbacks:
+                    del self.watches[wd]
+                    self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        while True:
+            _ready = select.select([self.fd, self.wakeup[0]], [], [])[0]
+            if self.wakeup[0] in _ready:
+                return
+            try:
+                _data = os.read(self.fd, 65536)
+            except OSError as err:
+                logger.error('inotify read failed: {}'.format(err))
+                return
+            self.dispatch(_data)
+
+    def dispatch(self, data):
+        _pos = 0
+        while _pos + EVENT.size <= len(data):
+            wd, mask, _, _len = EVENT.unpack_from(data, _pos)
+            _name = data[_pos + EVENT.size:_pos + EVENT.size + _len]
+            _pos += EVENT.size + _len
+            _name = os.fsdecode(_name.rstrip(b'\0')) or None
+
+            with self.lock:
+                if mask & IN_Q_OVERFLOW:
+                    _targets = [(p, list(c)) for p, c in self.watches.values()]
+                elif wd in self.watches:
+                    _path, _callbacks = self.watches[wd]
+                    _targets = [(_path, list(_callbacks))]
+                    if mask & IN_IGNORED:  # Gone
+                        del self.watches[wd]
+                else:
+                    _targets = []
+
+            for _path, _callbacks in _targets:
+                for _callback in _callbacks:
+                    try:
+                        _callback(_path, _name, mask)
+                    except Exception as err:
+                        logger.error('inotify callback failed for {}: '
+                                     '{}'.format(_path, err))
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def default_watcher():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = Watcher()
+        return _watcher
+
+
+def stop():
+    if _watcher is not None:
+        _watcher.stop()
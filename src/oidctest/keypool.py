@@ -0,0 +1,317 @@
+"""
+A stock of freshly generated keys for the key rotation tests.
+
+Generating an RSA key takes from a few hundred milliseconds up to seconds
+of CPU time. Rather than doing that on the thread that handles a request,
+keys are made in advance by a separate process and kept until needed.
+The process is started the first time a key is asked for. If the stock
+has run out the key is generated on the spot, as before.
+
+The generating process reads requests, one per line, like "RSA 2048" or
+"EC P-256" on stdin and answers with one JSON line per key on stdout.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+from Cryptodome.PublicKey import RSA
+from jwkest.ecc import NISTEllipticCurve
+from jwkest.jwk import ECKey
+from jwkest.jwk import RSAKey
+
+logger = logging.getLogger(__name__)
+
+RSA_KEY = 'RSA'
+EC_KEY = 'EC'
+
+DEFAULT_KINDS = [(RSA_KEY, 2048), (EC_KEY, 'P-256')]
+
+
+class UnknownKeyType(Exception):
+    pass
+
+
+def generate(typ, param):
+    """
+    :param typ: RSA_KEY or EC_KEY
+    :param param: Key size for RSA, curve name for EC
+    :return: The key parameters as a dictionary of integers
+    """
+    if typ == RSA_KEY:
+        _key = RSA.generate(int(param))
+        return {'n': _key.n, 'e': _key.e, 'd': _key.d, 'p': _key.p,
+                'q': _key.q, 'u': _key.u}
+    elif typ == EC_KEY:
+        priv, pub = NISTEllipticCurve.by_name(param).key_pair()
+        return {'d': priv, 'x': pub[0], 'y': pub[1]}
+    raise UnknownKeyType(typ)
+
+
+def load(typ, info):
+    """
+    :return: A Cryptodome RSA key or, for EC, the parameters as is
+    """
+    if typ == RSA_KEY:
+        # We made it, so no need to spend time checking it
+        return RSA.construct((info['n'], info['e'], info['d'], info['p'],
+                              info['q'], info['u']), consistency_check=False)
+    return info
+
+
+class KeyPool(object):
+    def __init__(self, depth=2, kinds=None):
+        """
+        :param depth: How many keys of each kind to keep in stock, 0 means
+            always generate keys on the spot
+        :param kinds: List of (type, size or curve) tuples
+        """
+        self.depth = depth
+        self.kinds = kinds or DEFAULT_KINDS
+        self.stock = dict([(k, deque()) for k in self.kinds])
+        self.pending = dict([(k, 0) for k in self.kinds])
+        self.lock = threading.Lock()
+        self.proc = None
+        self.pid = 0
+        self.started = 0
+        # Metrics
+        self.served = 0
+        self.inline = 0
+        self.generated = 0
+        self.gen_time = 0.0
+
+    def is_running(self):
+        # A forked child doesn't have the reader thread
+        return (self.proc is not None and self.pid == os.getpid() and
+                self.proc.poll() is None)
+
+    def start(self):
+        with self.lock:
+            if self.is_running():
+                return
+            for kind in self.kinds:
+                self.pending[kind] = 0
+
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.pathsep.join(sys.path)
+            try:
+                self.proc = subprocess.Popen(
+                    [sys.executable, '-m', 'oidctest.keypool'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                    universal_newlines=True)
+            except OSError as err:
+                logger.error('Could not start key generator: {}'.format(err))
+                self.proc = None
+                return
+            self.pid = os.getpid()
+            self.started = time.time()
+
+            _thread = threading.Thread(target=self._read, args=(self.proc,),
+                                       name='KeyPool')
+            _thread.daemon = True
+            _thread.start()
+        logger.info('Key generator started, pid {}'.format(self.proc.pid))
+        self.refill()
+
+    def stop(self):
+        with self.lock:
+            _proc = self.proc
+            self.proc = None
+        if _proc is None:
+            return
+        try:
+            _proc.stdin.close()
+            _proc.wait(5)
+        except (OSError, subprocess.TimeoutExpired):
+            _proc.kill()
+
+    def refill(self):
+        """
+        Ask for as many keys as are needed to fill up the stock.
+        """
+        _requests = []
+        with self.lock:
+            if not self.is_running():
+                return
+            for kind in self.kinds:
+                _need = self.depth - len(self.stock[kind]) - self.pending[
+                    kind]
+                if _need > 0:
+                    self.pending[kind] += _need
+                    _requests.extend([kind] * _need)
+            _proc = self.proc
+
+        if not _requests:
+            return
+        try:
+            for typ, param in _requests:
+                _proc.stdin.write('{} {}\n'.format(typ, param))
+            _proc.stdin.flush()
+        except (OSError, ValueError) as err:
+            logger.error('Key generator gone: {}'.format(err))
+
+    def _read(self, proc):
+        for line in proc.stdout:
+            try:
+                info = json.loads(line)
+                kind = (info['typ'], info['param'])
+                _key = load(info['typ'], info['key'])
+            except (ValueError, KeyError) as err:
+                logger.error('Bad key from generator: {}'.format(err))
+                continue
+            with self.lock:
+                if kind not in self.stock:
+                    continue
+                self.stock[kind].append(_key)
+                self.pending[kind] = max(0, self.pending[kind] - 1)
+                self.generated += 1
+                self.gen_time += info['elapsed']
+
+        logger.warning('Key generator (pid {}) exited'.format(proc.pid))
+        with self.lock:
+            if self.proc is proc:
+                self.proc = None
+
+    def take(self, typ, param):
+        """
+        Get a new key, from the stock if there is one.
+
+        :param typ: RSA_KEY or EC_KEY
+        :param param: Key size for RSA, curve name for EC
+        :return: See :py:func:`load`
+        """
+        kind = (typ, param)
+        _key = None
+        if self.depth and kind in self.stock:
+            with self.lock:
+                try:
+                    _key = self.stock[kind].popleft()
+                except IndexError:
+                    pass
+                else:
+                    self.served += 1
+
+            if self.is_running():
+                self.refill()
+            else:
+                self.start()
+
+        if _key is None:
+            with self.lock:
+                self.inline += 1
+            _key = load(typ, generate(typ, param))
+        return _key
+
+    def stats(self):
+        with self.lock:
+            _depth = dict([('{}-{}'.format(*k), len(v)) for k, v in
+                           self.stock.items()])
+            if self.started:
+                _rate = self.generated / (time.time() - self.started)
+            else:
+                _rate = 0.0
+            if self.generated:
+                _gen_time = self.gen_time / self.generated
+            else:
+                _gen_time = 0.0
+            return {
+                'depth': _depth,
+                'served': self.served,
+                'inline': self.inline,
+                'generated': self.generated,
+                # keys per second since the generator was started
+                'refill_rate': round(_rate, 3),
+                'mean_generation_time': round(_gen_time, 3)
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(depth=2, kinds=None):
+    """
+    Replace the pool used by the module level functions.
+
+    :return: The new :py:class:`KeyPool`
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+        _pool = KeyPool(depth, kinds)
+        return _pool
+
+
+def default_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPool()
+        return _pool
+
+
+def stop():
+    if _pool is not None:
+        _pool.stop()
+
+
+def rsa_key(size=2048):
+    """
+    :return: A new Cryptodome RSA key
+    """
+    return default_pool().take(RSA_KEY, size)
+
+
+def new_rsa_key(size=2048, **kwargs):
+    """
+    :param kwargs: Passed on to RSAKey, like kid and use
+    :return: A RSAKey instance with a new key
+    """
+    return RSAKey(**kwargs).load_key(rsa_key(size))
+
+
+def new_ec_key(crv='P-256', **kwargs):
+    """
+    :param kwargs: Passed on to ECKey, like kid and use
+    :return: An ECKey instance with a new key
+    """
+    info = default_pool().take(EC_KEY, crv)
+    _key = ECKey(**kwargs)
+    # What ECKey.load_key does
+    _key.curve = NISTEllipticCurve.by_name(crv)
+    _key.d, _key.x, _key.y = info['d'], info['x'], info['y']
+    return _key
+
+
+def serve(rfile, wfile):
+    """
+    What the generating process runs.
+    """
+    for line in rfile:
+        try:
+            typ, param = line.split()
+            if typ == RSA_KEY:
+                param = int(param)
+            _start = time.time()
+            info = generate(typ, param)
+        except (ValueError, UnknownKeyType) as err:
+            sys.stderr.write('Bad request {}: {}\n'.format(line.strip(), err))
+            continue
+        try:
+            wfile.write('{}\n'.format(json.dumps({
+                'typ': typ, 'param': param, 'key': info,
+                'elapsed': time.time() - _start})))
+            wfile.flush()
+        except BrokenPipeError:  # The pool is gone
+            return
+
+
+if __name__ == '__main__':
+    # Not to compete with the server for the CPU
+    os.nice(10)
+    serve(sys.stdin, sys.stdout)
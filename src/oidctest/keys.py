@@ -0,0 +1,119 @@
+"""
+Sharing parsed keys between KeyJars.
+
+Importing a private RSA key from a JWKS is slow since the key is checked
+for consistency. So keys that have already been parsed are copied rather
+than exported and imported again. A copy shares the key material with the
+original but has its own state, like when it became inactive.
+
+A :py:class:`SharedKeyJar` goes one step further and uses the KeyBundles of
+another KeyJar as they are until the keys of an issuer are changed.
+"""
+import copy
+
+from oic.utils.keyio import KeyBundle
+from oic.utils.keyio import KeyJar
+
+
+def clone_keybundle(kb, active_only=False):
+    """
+    :param kb: A KeyBundle instance
+    :param active_only: Leave out keys that has been marked as inactive
+    :return: A new KeyBundle with copies of the keys
+    """
+    _kb = KeyBundle(verify_ssl=kb.verify_ssl)
+    for key in kb.keys():
+        if active_only and key.inactive_since:
+            continue
+        _kb.append(copy.copy(key))
+    return _kb
+
+
+def copy_issuer_keys(keyjar, src, dst):
+    """
+    Does the same as keyjar.import_jwks(keyjar.export_jwks(True, src), dst)
+    without serializing and parsing the keys.
+
+    :param keyjar: A KeyJar instance
+    :param src: The issuer whose keys should be copied
+    :param dst: The issuer the copies should belong to
+    """
+    if isinstance(keyjar, SharedKeyJar):
+        keyjar.share_issuer_keys(src, dst)
+        return
+
+    _kb = KeyBundle(verify_ssl=keyjar.verify_ssl)
+    for kb in keyjar.issuer_keys[src]:
+        for key in kb.keys():
+            if key.inactive_since == 0:
+                _kb.append(copy.copy(key))
+    keyjar.add_kb(dst, _kb)
+
+
+def all_active(kb):
+    return all(key.inactive_since == 0 for key in kb.keys())
+
+
+class SharedKeyJar(KeyJar):
+    """
+    Starts out with the KeyBundles of a template KeyJar, which must not be
+    changed. An issuer's bundles are copied before its keys are changed,
+    the keys of other issuers are still shared.
+    """
+
+    def __init__(self, template, issuers=None, **kwargs):
+        """
+        :param template: The KeyJar to share KeyBundles with
+        :param issuers: The issuers whose keys to use, default all
+        :param kwargs: Passed on to KeyJar
+        """
+        KeyJar.__init__(self, **kwargs)
+        self._shared = set()
+        # Keeps the shared bundles alive, they are known by id
+        self.template = template
+        if issuers is None:
+            issuers = list(template.issuer_keys.keys())
+        for issuer in issuers:
+            _kbl = template.issuer_keys.get(issuer, [])
+            self.issuer_keys[issuer] = list(_kbl)
+            self._shared.update(id(kb) for kb in _kbl)
+
+    def is_shared(self, kb):
+        return id(kb) in self._shared
+
+    def writable(self, issuer):
+        """
+        Replace the issuer's shared KeyBundles with copies, must be done
+        before changing any of its keys.
+
+        :return: The issuer's KeyBundles
+        """
+        _kbl = []
+        for kb in self.issuer_keys.get(issuer, []):
+            if self.is_shared(kb):
+                kb = clone_keybundle(kb)
+            _kbl.append(kb)
+        self.issuer_keys[issuer] = _kbl
+        return _kbl
+
+    def share_issuer_keys(self, src, dst):
+        """
+        Like :py:func:`copy_issuer_keys` but shared KeyBundles with only
+        active keys are used as they are.
+        """
+        for kb in self.issuer_keys[src]:
+            if self.is_shared(kb) and all_active(kb):
+                self.add_kb(dst, kb)
+            else:
+                self.add_kb(dst, clone_keybundle(kb, active_only=True))
+
+    def remove_key(self, issuer, key_type, key):
+        self.writable(issuer)
+        KeyJar.remove_key(self, issuer, key_type, key)
+
+    def remove_outdated(self):
+        # Only active keys are ever shared, so nothing to remove there
+        for issuer, _kbl in list(self.issuer_keys.items()):
+            if not all(all_active(kb) for kb in _kbl if self.is_shared(kb)):
+                self.writable(issuer)
+        KeyJar.remove_outdated(self)
@@ -0,0 +1,307 @@
+"""
+Writing the test logs in the background.
+
+Every request to an OP instance appends the events of the request to the
+log file of the test. Rather than opening, writing and closing the file on
+the thread that handles the request, the text is put on a bounded queue. A
+:py:class:`LogWriter` thread takes what is on the queue, writes it file by
+file and keeps the files that are written to often open.
+
+If the queue is full the request thread waits until there is room, so
+nothing is lost. How often, and for how long, that happens is counted.
+A writer that is not started writes on the calling thread as before.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from otest.events import layout
+
+logger = logging.getLogger(__name__)
+
+
+def format_events(events):
+    """
+    :param events: An otest.events.Events instance or a list of events
+    :return: The text that is added to the log file
+    """
+    _elem = [layout(0, ev) for ev in events]
+    return "\n".join(_elem) + "\n\n"
+
+
+def open_log(file_name):
+    try:
+        return open(file_name, "a+")
+    except IOError:
+        try:
+            os.makedirs(os.path.dirname(file_name))
+        except OSError:
+            pass
+
+        try:
+            return open(file_name, "w")
+        except Exception as err:
+            logger.error(
+                "Couldn't dump to log file {} reason: {}".format(
+                    file_name, err))
+            raise
+
+
+def write_file(file_name, text):
+    fp = open_log(file_name)
+    fp.write(text)
+    fp.close()
+
+
+class _Flush(object):
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.done = threading.Event()
+
+
+class LogWriter(object):
+    def __init__(self, max_queue=10000, max_open=64, batch_size=500,
+                 idle_close=60):
+        """
+        :param max_queue: Max number of log entries waiting to be written
+        :param max_open: Max number of log files kept open
+        :param batch_size: Max number of entries written in one go
+        :param idle_close: The files are closed when nothing has been
+            written for this many seconds
+        """
+        self.queue = queue.Queue(max_queue)
+        self.max_open = max_open
+        self.batch_size = batch_size
+        self.idle_close = idle_close
+        self.files = OrderedDict()
+        self.thread = None
+        self.lock = threading.Lock()
+        # Metrics
+        self.entries = 0
+        self.batches = 0
+        self.inline = 0
+        self.blocked = 0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+        self.errors = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run,
+                                           name='LogWriter')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Write what is on the queue and close all files.
+        """
+        with self.lock:
+            _thread = self.thread
+            self.thread = None
+        if _thread is not None:
+            self.queue.put(None)
+            _thread.join()
+
+        # Anything that came in while stopping
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Flush):
+                item.done.set()
+            elif item is not None:
+                self.write(*item)
+
+    def write(self, file_name, text):
+        """
+        :param file_name: The log file
+        :param text: What to append to it
+        """
+        if self.thread is None:
+            with self.lock:
+                self.inline += 1
+            write_file(file_name, text)
+            return
+
+        self._put((os.path.abspath(file_name), text))
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            _start = time.time()
+            self.queue.put(item)
+            with self.lock:
+                self.blocked += 1
+                self.blocked_time += time.time() - _start
+
+        _depth = self.queue.qsize()
+        if _depth > self.max_depth:
+            with self.lock:
+                self.max_depth = max(self.max_depth, _depth)
+
+    def flush(self, prefix='', timeout=10):
+        """
+        Wait until everything queued so far is written. Files under prefix
+        are closed, so they can be read, archived or removed.
+
+        :param prefix: A file or a directory
+        :param timeout: Max number of seconds to wait
+        :return: True if everything was written in time
+        """
+        if self.thread is None:
+            return True
+
+        _flush = _Flush(os.path.abspath(prefix) if prefix else '')
+        self._put(_flush)
+        return _flush.done.wait(timeout)
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_close)
+            except queue.Empty:
+                self.close_files()
+                continue
+
+            items = [item]
+            while item is not None and len(items) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+
+            batch = OrderedDict()
+            for item in items:
+                if item is None:
+                    self._write(batch)
+                    self.close_files()
+                    return
+                elif isinstance(item, _Flush):
+                    self._write(batch)
+                    batch = OrderedDict()
+                    self.close_files(item.prefix)
+                    item.done.set()
+                else:
+                    try:
+                        batch[item[0]].append(item[1])
+                    except KeyError:
+                        batch[item[0]] = [item[1]]
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+
+        for file_name, texts in batch.items():
+            try:
+                fp = self._open(file_name)
+                fp.write(''.join(texts))
+                fp.flush()
+            except Exception as err:
+                logger.error('Could not write to {}: {}'.format(file_name,
+                                                                err))
+                self._close(file_name)
+                with self.lock:
+                    self.errors += len(texts)
+            else:
+                with self.lock:
+                    self.entries += len(texts)
+        with self.lock:
+            self.batches += 1
+
+    def _open(self, file_name):
+        try:
+            fp = self.files.pop(file_name)
+        except KeyError:
+            if len(self.files) >= self.max_open:
+                self._close(next(iter(self.files)))
+            fp = open_log(file_name)
+        # Most recently used last
+        self.files[file_name] = fp
+        return fp
+
+    def _close(self, file_name):
+        try:
+            fp = self.files.pop(file_name)
+        except KeyError:
+            return
+        try:
+            fp.close()
+        except IOError:
+            pass
+
+    def close_files(self, prefix=''):
+        """
+        Close files, all of them if no prefix is given otherwise the ones
+        under prefix. Only to be used by the writer thread.
+        """
+        if prefix:
+            _dir = prefix.rstrip(os.sep) + os.sep
+            _names = [n for n in self.files
+                      if n == prefix or n.startswith(_dir)]
+        else:
+            _names = list(self.files.keys())
+        for _name in _names:
+            self._close(_name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'entries': self.entries,
+                'batches': self.batches,
+                'inline': self.inline,
+                'blocked': self.blocked,
+                'blocked_time': round(self.blocked_time, 3),
+                'open_files': len(self.files),
+                'errors': self.errors
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(max_queue=10000, **kwargs):
+    """
+    Replace the writer used by the module level functions.
+
+    :return: The new :py:class:`LogWriter`
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+        _writer = LogWriter(max_queue, **kwargs)
+        return _writer
+
+
+def default_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+        return _writer
+
+
+def stop():
+    if _writer is not None:
+        _writer.stop()
+
+
+def write(file_name, text):
+    default_writer().write(file_name, text)
+
+
+def flush(prefix='', timeout=10):
+    return default_writer().flush(prefix, timeout)
@@ -7,7 +7,6 @@ import os
 import sys
 import time
 
-from Cryptodome.PublicKey import RSA
 from future.backports.urllib.parse import parse_qs
 from future.backports.urllib.parse import urlencode
 from future.backports.urllib.parse import urlparse
@@ -30,8 +29,6 @@ from oic.utils.authn.client import CLIENT_AUTHN_METHOD
 from oic.utils.http_util import Redirect
 from oic.utils.keyio import KeyBundle
 from oic.utils.keyio import dump_jwks
-from oic.utils.keyio import ec_init
-from oic.utils.keyio import rsa_init
 from otest import RequirementsNotMet
 from otest import Unknown
 from otest.aus.operation import Operation
@@ -56,6 +53,10 @@ from otest.operation import Note
 from otest.operation import Notice
 from otest.prof_util import RESPONSE
 
+from oidctest.keypool import new_ec_key
+from oidctest.keypool import new_rsa_key
+from oidctest.keypool import rsa_key
+
 __author__ = 'roland'
 
 logger = logging.getLogger(__name__)
@@ -472,10 +473,14 @@ class RotateKey(Operation):
         typ = key_spec["type"].upper()
         if typ == "RSA":
             kb = KeyBundle(keytype=typ, keyusage=key_spec["use"])
-            kb.append(RSAKey(use=key_spec["use"][0]).load_key(
-                RSA.generate(key_spec["bits"])))
+            kb.append(new_rsa_key(key_spec["bits"], use=key_spec["use"][0]))
         elif typ == "EC":
-            kb = ec_init(key_spec)
+            # What ec_init does but with keys from the pool
+            kb = KeyBundle(keytype=typ, keyusage=key_spec["use"])
+            for use in key_spec["use"]:
+                _key = new_ec_key(key_spec["crv"], use=use)
+                _key.serialize()
+                kb.append(_key)
         else:
             raise Unknown('keytype: {}'.format(typ))
 
@@ -543,7 +548,20 @@ def _new_rsa_key(spec):
             spec['name'] = tail
         else:
             spec['name'] = spec['key']
-    return rsa_init(spec)
+
+    # What rsa_init does but with keys from the pool
+    _path = spec.get('path', '.')
+    kb = KeyBundle(keytype="RSA", keyusage=spec["use"])
+    for use in spec["use"]:
+        _key = rsa_key(spec.get('size', 2048))
+        os.makedirs(_path, exist_ok=True)
+        with open(os.path.join(_path, spec['name']), 'wb') as f:
+            f.write(_key.exportKey('PEM'))
+        with open(os.path.join(_path, '{}.pub'.format(spec['name'])),
+                  'wb') as f:
+            f.write(_key.publickey().exportKey('PEM'))
+        kb.append(RSAKey(use=use, key=_key))
+    return kb
 
 
 class RotateKeys(Operation):
@@ -0,0 +1,347 @@
+"""
+Hosting many OP test instances in one CherryPy process.
+
+Each (issuer, tag) pair that has been assigned a port is reachable under
+the path that the path2port map binds to that port, exactly as if a
+reverse proxy was sitting in front of a separate op_test_tool.py process.
+Instances are built the first time they are accessed and thrown away when
+they have been idle for too long.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote_plus
+
+import cherrypy
+from cherrypy.lib.static import serve_file
+from oic.oic.message import factory as oic_message_factory
+from otest.aus.client import Factory
+from otest.aus.handling_ph import WebIh
+from otest.conf_setup import construct_app_args
+from otest.flow import FlowState
+from otest.rp.setup import read_path2port_map
+
+from oidctest.op import check
+from oidctest.op import func
+from oidctest.op import oper
+from oidctest.op import profiles
+from oidctest.op.client import Client
+from oidctest.op.profiles import PROFILEMAP
+from oidctest.optt import Main
+from oidctest.prof_util import ProfileHandler
+from oidctest.session import SessionHandler
+from oidctest.tool import WebTester
+from oidctest.tt.rest import NoSuchFile
+
+logger = logging.getLogger(__name__)
+
+
+def pick_grp(name):
+    return name.split('-')[1]
+
+
+def load_flows(flowdir):
+    """
+    Read all the flow descriptions in a directory.
+
+    :param flowdir: The directory
+    :return: Dictionary with test ID as key and the JSON document as value
+    """
+    flows = {}
+    for fname in os.listdir(flowdir):
+        if fname.endswith('.json'):
+            with open(os.path.join(flowdir, fname), 'r') as fp:
+                flows[fname[:-5]] = fp.read()
+    return flows
+
+
+class PreloadedFlowState(FlowState):
+    """
+    A FlowState that gets the flow descriptions from memory instead of
+    reading a file each time one is needed.
+    """
+
+    def __init__(self, flows, fdir, profile_handler, cls_factories,
+                 func_factory, display_order, use=''):
+        FlowState.__init__(self, fdir, profile_handler, cls_factories,
+                           func_factory, display_order, use=use)
+        self.preloaded = flows
+
+    @classmethod
+    def from_flow_state(cls, flows, flow_state):
+        return cls(flows, flow_state.fdir, flow_state.profile_handler,
+                   flow_state.cls_factories, flow_state.func_factory,
+                   flow_state.display_order, use=flow_state.use)
+
+    def __getitem__(self, tid):
+        try:
+            _spec = self.preloaded[tid]
+        except KeyError:
+            return FlowState.__getitem__(self, tid)
+        # Callers modify what they get, so always a fresh copy
+        return json.loads(_spec)
+
+    def keys(self):
+        return iter(list(self.preloaded.keys()))
+
+    def items(self):
+        for tid in self.keys():
+            yield tid, self[tid]
+
+
+def make_webenv(args, config, rest, flows=None):
+    """
+    Construct the application arguments for one test instance.
+
+    :param args: argparse.Namespace with the op_test_tool.py arguments
+    :param config: The test tool configuration module
+    :param rest: A :py:class:`oidctest.tt.rest.REST` instance
+    :param flows: Preloaded flow descriptions, see :py:func:`load_flows`
+    :return: Application arguments
+    """
+    if args.tag:
+        qtag = quote_plus(args.tag)
+    else:
+        qtag = 'default'
+
+    ent_conf = rest.construct_config(quote_plus(args.issuer), qtag)
+
+    logger.info('construct_app_args')
+    _path, app_args = construct_app_args(args, config, oper, func, profiles,
+                                         ent_conf)
+
+    # Application arguments
+    app_args.update(
+        {"msg_factory": oic_message_factory, 'profile_map': PROFILEMAP,
+         'profile_handler': ProfileHandler,
+         'client_factory': Factory(Client)})
+
+    if args.insecure:
+        app_args['client_info']['verify_ssl'] = False
+
+    if flows is not None:
+        app_args['flow_state'] = PreloadedFlowState.from_flow_state(
+            flows, app_args['flow_state'])
+
+    return app_args
+
+
+def make_main(args, config, rest, html, version, flows=None):
+    """
+    Build the CherryPy root object for one test instance.
+
+    :param args: argparse.Namespace with the op_test_tool.py arguments
+    :param config: The test tool configuration module
+    :param rest: A :py:class:`oidctest.tt.rest.REST` instance
+    :param html: FileSystem instance holding the HTML templates
+    :param version: Test tool version
+    :param flows: Preloaded flow descriptions, see :py:func:`load_flows`
+    :return: A :py:class:`oidctest.optt.Main` instance
+    """
+    webenv = make_webenv(args, config, rest, flows)
+
+    session_handler = SessionHandler(args.issuer, args.tag,
+                                     flows=webenv['flow_state'], rest=rest,
+                                     version=version, **webenv)
+    session_handler.iss = args.issuer
+    session_handler.tag = args.tag
+    info = WebIh(session=session_handler, pre_html=html, **webenv)
+    tester = WebTester(info, session_handler, flows=webenv['flow_state'],
+                       check_factory=check.factory, **webenv)
+
+    return Main(tester, webenv['flow_state'], webenv, pick_grp)
+
+
+class Tenant(object):
+    def __init__(self, iss, tag, port, root, rest):
+        self.iss = iss
+        self.tag = tag
+        self.port = port
+        self.root = root
+        self.rest = rest
+        self.conf_mtime = self._conf_mtime()
+        self.since = self.last_access = time.time()
+
+    def _conf_mtime(self):
+        return self.rest.conf_mtime(quote_plus(self.iss), quote_plus(self.tag))
+
+    def is_stale(self):
+        """
+        The instance has to be rebuilt if its configuration has been
+        changed (or touched by a restart) since it was built.
+        """
+        try:
+            return self._conf_mtime() != self.conf_mtime
+        except NoSuchFile:
+            return True
+
+
+class TenantStatic(object):
+    def __init__(self, root):
+        self.root = root
+
+    @cherrypy.expose
+    def index(self, path=''):
+        _path = os.path.normpath(os.path.join(self.root, path))
+        if not _path.startswith(self.root + os.sep):
+            raise cherrypy.NotFound()
+        return serve_file(_path)
+
+    def _cp_dispatch(self, vpath):
+        cherrypy.request.params['path'] = '/'.join(vpath)
+        del vpath[:]
+        return self
+
+
+class MultiTenant(object):
+    """
+    CherryPy root object that dispatches /<path>/... to the test instance
+    whose port the path2port map binds to <path>.
+    """
+
+    def __init__(self, config, rest, html, assigned_ports, path2port,
+                 flowdir, version, staticdir='static', tls=False,
+                 idle_timeout=3600, max_instances=0):
+        self.config = config
+        self.rest = rest
+        self.html = html
+        self.assigned_ports = assigned_ports
+        self.path2port = path2port
+        self.flowdir = flowdir
+        self.version = version
+        self.staticdir = staticdir
+        self.tls = tls
+        self.idle_timeout = idle_timeout
+        self.max_instances = max_instances
+        self.tenants = {}
+        self.lock = threading.RLock()
+        # One per path, held while its test instance is being built
+        self.building = {}
+        self.static = TenantStatic(os.path.abspath(staticdir))
+        self._path2port = {}
+        try:
+            self.flows = load_flows(flowdir or config.FLOWDIR)
+        except (AttributeError, OSError):
+            self.flows = None
+
+    @cherrypy.expose
+    def index(self):
+        raise cherrypy.NotFound()
+
+    def port_for_path(self, path):
+        with self.lock:
+            if path not in self._path2port:
+                # The map may have been extended since last time
+                ppmap = read_path2port_map(self.path2port)
+                self._path2port = dict([(p, int(n)) for n, p in ppmap.items()
+                                        if n.isdigit()])
+            return self._path2port[path]
+
+    def instance_for_port(self, port):
+        """
+        Find the (issuer, tag) that has been assigned a specific port.
+
+        :param port: Port number
+        :return: issuer, tag tuple
+        """
+        # load() isn't safe while others look
+        with self.lock:
+            for _ in range(2):
+                for key, val in self.assigned_ports.items():
+                    if val == port:
+                        return key.split('][', 1)
+                # The config server may have assigned it after we last looked
+                self.assigned_ports.load()
+        raise KeyError(port)
+
+    def build(self, path, port):
+        iss, tag = self.instance_for_port(port)
+
+        args = argparse.Namespace(
+            issuer=iss, tag=tag, port=port, path2port=self.path2port,
+            flowdir=self.flowdir, insecure=False, staticdir=self.staticdir,
+            tls=self.tls)
+        typ, _econf = self.rest.read_conf(quote_plus(iss), quote_plus(tag))
+        try:
+            args.insecure = bool(_econf['tool']['insecure'])
+        except KeyError:
+            pass
+
+        logger.info('Building test instance {} for {}:{}'.format(path, iss,
+                                                                 tag))
+        _root = make_main(args, self.config, self.rest, self.html,
+                          self.version, self.flows)
+        return Tenant(iss, tag, port, _root, self.rest)
+
+    def _fresh(self, path):
+        with self.lock:
+            _tenant = self.tenants.get(path)
+        if _tenant is None or _tenant.is_stale():
+            return None
+        _tenant.last_access = time.time()
+        return _tenant
+
+    def get(self, path):
+        _tenant = self._fresh(path)
+        if _tenant is not None:
+            return _tenant
+
+        with self.lock:
+            _building = self.building.setdefault(path, threading.Lock())
+        # Building takes a while, only requests for the same path wait
+        with _building:
+            # May have been built while waiting
+            _tenant = self._fresh(path)
+            if _tenant is not None:
+                return _tenant
+
+            _tenant = self.build(path, self.port_for_path(path))
+            with self.lock:
+                self.tenants[path] = _tenant
+                if self.max_instances:
+                    self.evict_surplus()
+        return _tenant
+
+    def evict(self, path):
+        with self.lock:
+            try:
+                del self.tenants[path]
+            except KeyError:
+                pass
+            else:
+                logger.info('Evicted test instance {}'.format(path))
+
+    def evict_surplus(self):
+        _lru = sorted(self.tenants.items(), key=lambda x: x[1].last_access)
+        for path, _ in _lru[:len(_lru) - self.max_instances]:
+            self.evict(path)
+
+    def evict_idle(self):
+        """
+        Drop all test instances that has not been accessed within
+        idle_timeout seconds. Meant to be run by a
+        :py:class:`cherrypy.process.plugins.Monitor`.
+        """
+        _limit = time.time() - self.idle_timeout
+        with self.lock:
+            for path, tenant in list(self.tenants.items()):
+                if tenant.last_access < _limit:
+                    self.evict(path)
+
+    def _cp_dispatch(self, vpath):
+        path = vpath.pop(0)
+        try:
+            _tenant = self.get(path)
+        except (KeyError, NoSuchFile) as err:
+            # Let CherryPy (or a static dir tool) deal with it
+            logger.warning('No test instance at {}: {}'.format(path, err))
+            return None
+
+        if vpath and vpath[0] == 'static':
+            vpath.pop(0)
+            return self.static
+
+        return _tenant.root
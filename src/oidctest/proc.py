@@ -0,0 +1,197 @@
+"""
+Finding running test tool instances.
+
+otest.proc walks the whole process table, and parses every command line,
+for each question asked. The ProcessRegistry here does one walk and keeps
+an (iss, tag) index that is brought up to date at most once every ttl
+seconds. Only processes that have appeared since the last walk get their
+command lines parsed.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cmdline(cmd, prog=None):
+    """
+    Pick out the test instance parameters from a command line.
+
+    :param cmd: The command line as a list of strings
+    :param prog: If given the command must be running this program
+    :return: Dictionary with iss, tag and port, None if the command is not
+        a test instance
+    """
+    if len(cmd) < 5:
+        return None
+
+    if prog:
+        if not [c for c in cmd[:2] if os.path.basename(c) == prog]:
+            return None
+
+    info = {}
+    for flag, attr in [('-i', 'iss'), ('-t', 'tag'), ('-p', 'port')]:
+        try:
+            info[attr] = cmd[cmd.index(flag) + 1]
+        except (ValueError, IndexError):
+            if attr == 'port':
+                info[attr] = ''
+            else:
+                return None
+    return info
+
+
+class ProcessRegistry(object):
+    def __init__(self, prog=None, ttl=5):
+        """
+        :param prog: Name of the test tool script, for instance
+            'op_test_tool.py'. If not given any process run with -i and
+            -t arguments is regarded as a test instance.
+        :param ttl: Seconds a process table walk is trusted
+        """
+        if prog:
+            prog = os.path.basename(prog)
+        self.prog = prog
+        self.ttl = ttl
+        self._seen = set()
+        self._by_pid = {}
+        self._by_key = {}
+        self.timestamp = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(iss, tag):
+        return '{}][{}'.format(iss, tag)
+
+    def invalidate(self):
+        """
+        Make the next query walk the process table.
+        """
+        self.timestamp = 0
+
+    def track(self, pid):
+        """
+        Have a process examined on the next query even if it was seen
+        before, for instance one that was just started by us.
+
+        :param pid: Process ID
+        """
+        with self.lock:
+            self._remove(pid)
+        self.invalidate()
+
+    def _add(self, pid):
+        try:
+            proc = psutil.Process(pid)
+            cmd = proc.cmdline()
+            info = parse_cmdline(cmd, self.prog)
+            if info is None:
+                return
+            _created = proc.create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return
+
+        info['pid'] = pid
+        info['created'] = _created
+        info['since'] = datetime.datetime.fromtimestamp(_created).strftime(
+            "%Y-%m-%d %H:%M:%S")
+        self._by_pid[pid] = info
+        self._by_key[self.make_key(info['iss'], info['tag'])] = info
+
+    def _remove(self, pid):
+        self._seen.discard(pid)
+        info = self._by_pid.pop(pid, None)
+        if info:
+            _key = self.make_key(info['iss'], info['tag'])
+            if self._by_key.get(_key) is info:
+                del self._by_key[_key]
+
+    def refresh(self, force=False):
+        """
+        Bring the index up to date if it is older than ttl seconds.
+
+        :param force: Refresh regardless of age
+        """
+        with self.lock:
+            if not force and time.time() - self.timestamp < self.ttl:
+                return
+
+            pids = set(psutil.pids())
+            for pid in self._seen - pids:
+                self._remove(pid)
+
+            # A known instance pid may have been reused by another process
+            for pid, info in list(self._by_pid.items()):
+                try:
+                    _created = psutil.Process(pid).create_time()
+                except psutil.NoSuchProcess:
+                    _created = 0
+                if _created != info['created']:
+                    self._remove(pid)
+
+            for pid in pids - self._seen:
+                self._add(pid)
+            self._seen = pids
+            self.timestamp = time.time()
+
+    def find(self, iss, tag):
+        """
+        :param iss: Issuer ID, not quoted
+        :param tag: Tag, not quoted
+        :return: Information about the instance as a dictionary or None
+        """
+        self.refresh()
+        return self._by_key.get(self.make_key(iss, tag))
+
+    def pid(self, iss, tag):
+        """
+        Same as otest.proc.isrunning
+
+        :return: Process ID or 0 if no such instance is running
+        """
+        info = self.find(iss, tag)
+        if info:
+            return info['pid']
+        return 0
+
+    def running(self, iss, tags):
+        """
+        Bulk version of pid()
+
+        :param iss: Issuer ID, not quoted
+        :param tags: List of tags, not quoted
+        :return: Dictionary with tag as key and process ID (0 if not
+            running) as value
+        """
+        self.refresh()
+        res = {}
+        for tag in tags:
+            try:
+                res[tag] = self._by_key[self.make_key(iss, tag)]['pid']
+            except KeyError:
+                res[tag] = 0
+        return res
+
+    def instances(self, iss=None, tag=None):
+        """
+        Same as otest.proc.find_test_instances but optionally filtered.
+
+        :param iss: Only instances for this issuer
+        :param tag: Only instances with this tag
+        :return: Dictionary with process ID as key and information about
+            the instance as value
+        """
+        self.refresh()
+        res = {}
+        for pid, info in list(self._by_pid.items()):
+            if iss and info['iss'] != iss:
+                continue
+            if tag and info['tag'] != tag:
+                continue
+            res[pid] = info
+        return res
@@ -4,13 +4,10 @@ import logging
 import time
 
 import requests
-from Cryptodome.PublicKey import RSA
 from future.backports.urllib.parse import parse_qs
 from future.backports.urllib.parse import splitquery
 from future.backports.urllib.parse import urlencode
-from jwkest.ecc import P256
-from jwkest.jwk import ECKey
-from jwkest.jwk import RSAKey
+from jwkest.jwe import JWE
 from jwkest.jwk import SYMKey
 from oic import oic
 from oic import rndstr
@@ -27,6 +24,7 @@ from oic.oic.provider import FailedAuthentication
 from oic.oic.provider import InvalidRedirectURIError
 from oic.utils.http_util import Response
 from oic.utils.jwt import JWT
+from oic.utils.keyio import KeyBundle
 from oic.utils.keyio import key_summary
 from oic.utils.keyio import keyjar_init
 from otest.events import EV_EXCEPTION
@@ -35,6 +33,11 @@ from otest.events import EV_HTTP_RESPONSE
 from otest.events import EV_PROTOCOL_REQUEST
 from otest.events import EV_REQUEST
 
+from oidctest import crypto
+from oidctest.keypool import new_ec_key
+from oidctest.keypool import new_rsa_key
+from oidctest.keys import SharedKeyJar
+
 __author__ = 'roland'
 
 logger = logging.getLogger(__name__)
@@ -80,6 +83,21 @@ _jwks = {
 }
 
 
+# Parsed once and used by all Provider instances, these keys are never
+# changed
+_other_kb = None
+
+
+def other_keys():
+    """
+    :return: A KeyBundle with the keys in _jwks
+    """
+    global _other_kb
+    if _other_kb is None:
+        _other_kb = KeyBundle(_jwks['keys'])
+    return _other_kb
+
+
 class TestError(Exception):
     pass
 
@@ -139,6 +157,39 @@ def response_type_cmp(allowed, offered):
     return False
 
 
+class PooledJWT(object):
+    """
+    A message whose to_jwt signs through the crypto pool, otherwise it's
+    the message. What pyoidc's Provider signs is passed through this so
+    the signing is moved but how the keys are chosen is left to pyoidc.
+    """
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __getattr__(self, item):
+        return getattr(self.msg, item)
+
+    def to_jwt(self, key=None, algorithm="", lev=0):
+        return crypto.sign(self.msg.to_json(lev), algorithm, key)
+
+
+class PooledJWE(JWE):
+    """
+    A JWE that is encrypted by the crypto pool.
+    """
+
+    def encrypt(self, keys=None, cek="", iv="", **kwargs):
+        if cek or iv or kwargs.get("context") != "public":
+            return JWE.encrypt(self, keys, cek, iv, **kwargs)
+        return crypto.encrypt(self.msg, keys, **self._dict)
+
+
+# The only JWE pyoidc's Provider makes is in Provider.encrypt, so that is
+# where the encryption is moved to the crypto pool
+provider.JWE = PooledJWE
+
+
 class Server(oic.Server):
     def __init__(self, keyjar=None, ca_certs=None, verify_ssl=True):
         oic.Server.__init__(self, verify_ssl=verify_ssl, keyjar=keyjar, client_cert=ca_certs)
@@ -199,7 +250,8 @@ class Server(oic.Server):
             except KeyError:
                 pass
 
-        return idt
+        # Signed by the crypto pool
+        return PooledJWT(idt)
 
 
 class Provider(provider.Provider):
@@ -232,7 +284,7 @@ class Provider(provider.Provider):
         self.jwx_def = {}
         self.build_jwx_def()
         self.other = 'https://example.com/op'
-        self.keyjar.import_jwks(_jwks, self.other)
+        self.keyjar.add_kb(self.other, other_keys())
 
     def build_jwx_def(self):
         self.jwx_def = {}
@@ -261,6 +313,16 @@ class Provider(provider.Provider):
         return provider.Provider.sign_encrypt_id_token(
             self, sinfo, client_info, areq, code, access_token, user_info)
 
+    def do_key_rollover(self, jwks, kid_template):
+        if isinstance(self.keyjar, SharedKeyJar):
+            # The old keys are marked as inactive
+            self.keyjar.writable('')
+        provider.Provider.do_key_rollover(self, jwks, kid_template)
+        # What is published from now on, the same keys as dump_jwks writes
+        self.jwks = {'keys': [k.serialize() for kb in self.keyjar[''] for k
+                              in kb.keys() if k.kty != 'oct' and
+                              not k.inactive_since]}
+
     def no_kid_keys(self):
         keys = [copy.copy(k) for k in self.keyjar.get_signing_key()]
         for k in keys:
@@ -276,11 +338,11 @@ class Provider(provider.Provider):
         if "rotsig" in self.behavior_type:
             # Rollover signing keys
             if alg == "RS256":
-                key = RSAKey(kid="rotated_rsa_{}".format(time.time()),
-                             use="sig").load_key(RSA.generate(2048))
+                key = new_rsa_key(kid="rotated_rsa_{}".format(time.time()),
+                                  use="sig")
             else:  # alg == "ES256"
-                key = ECKey(kid="rotated_ec_{}".format(time.time()),
-                            use="sig").load_key(P256)
+                key = new_ec_key(kid="rotated_ec_{}".format(time.time()),
+                                 use="sig")
 
             new_keys = {"keys": [key.serialize(private=True)]}
             self.events.store("New signing keys", new_keys)
@@ -315,6 +377,10 @@ class Provider(provider.Provider):
 
         return _jws
 
+    def signed_userinfo(self, client_info, userinfo, session):
+        return provider.Provider.signed_userinfo(
+            self, client_info, PooledJWT(userinfo), session)
+
     def _collect_user_info(self, session, userinfo_claims=None):
         ava = provider.Provider._collect_user_info(self, session,
                                                    userinfo_claims)
@@ -524,10 +590,10 @@ class Provider(provider.Provider):
 
         if "rotenc" in self.behavior_type:
             # Rollover encryption keys
-            rsa_key = RSAKey(kid="rotated_rsa_{}".format(time.time()),
-                             use="enc").load_key(RSA.generate(2048))
-            ec_key = ECKey(kid="rotated_ec_{}".format(time.time()),
-                           use="enc").load_key(P256)
+            rsa_key = new_rsa_key(kid="rotated_rsa_{}".format(time.time()),
+                                  use="enc")
+            ec_key = new_ec_key(kid="rotated_ec_{}".format(time.time()),
+                                use="enc")
 
             keys = [rsa_key.serialize(private=True),
                     ec_key.serialize(private=True)]
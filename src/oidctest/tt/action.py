@@ -1,5 +1,4 @@
 import logging
-import os
 from urllib.parse import unquote_plus
 from html import escape
 
@@ -13,8 +12,6 @@ from otest.prof_util import do_registration
 from otest.prof_util import from_profile
 from otest.prof_util import return_type
 from otest.prof_util import to_profile
-from otest.proc import kill_process
-from otest.proc import isrunning
 
 from oidctest.app_conf import TYPE2CLS
 from oidctest.app_conf import create_model
@@ -747,21 +744,7 @@ class Action(object):
 
     def kill(self, iss, tag, ev):
         uqp, qp = unquote_quote(iss, tag)
-        _key = self.app.assigned_ports.make_key(*uqp)
-
-        try:
-            pid = isrunning(unquote_plus(iss), unquote_plus(tag))
-        except KeyError:
-            pass
-        else:
-            if pid:
-                # logger.info('kill {}'.format(pid))
-                # subprocess.call(['kill', str(pid)])
-                kill_process(pid)
-                try:
-                    del self.app.running_processes[_key]
-                except KeyError:
-                    pass
+        self.app.stop_test_instance(*uqp)
 
     @cherrypy.expose
     def stop(self, iss, tag, ev):
@@ -786,10 +769,8 @@ class Action(object):
         uqp, qp = unquote_quote(iss, tag)
         _key = self.app.assigned_ports.make_key(*uqp)
 
-        os.unlink(os.path.join(self.entpath, *qp))
-        # Remove issuer if out of tags
-        if not os.listdir(os.path.join(self.entpath, qp[0])):
-            os.rmdir(os.path.join(self.entpath, qp[0]))
+        # The issuer goes too if out of tags
+        self.rest.backend.delete(*qp)
 
         try:
             del self.app.assigned_ports[_key]
@@ -857,12 +838,16 @@ class Action(object):
             # need to create a redirect_uri, means I need to register a port
             _port = self.app.assigned_ports.register_port(kwargs['iss'],
                                                           kwargs['tag'])
-            if self.app.test_tool_base.endswith('/'):
-                _base = self.app.test_tool_base[:-1]
+            if self.app.multi_tenant:
+                _base = self.app.instance_url(_port)
+                if _base.endswith('/'):
+                    _base = _base[:-1]
+            elif self.app.test_tool_base.endswith('/'):
+                _base = '{}:{}'.format(self.app.test_tool_base[:-1], _port)
             else:
-                _base = self.app.test_tool_base
+                _base = '{}:{}'.format(self.app.test_tool_base, _port)
             _ent_conf['client']['registration_response'][
-                'redirect_uris'] = '[ "{}:{}/authz_cb", "{}:{}/authz_post" ]'.format(_base, _port, _base, _port)
+                'redirect_uris'] = '[ "{}/authz_cb", "{}/authz_post" ]'.format(_base, _base)
 
         _ent_conf['tool']['issuer'] = uqp[0]
         _ent_conf['tool']['tag'] = uqp[1]
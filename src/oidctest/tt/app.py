@@ -1,22 +1,37 @@
 import logging
-import os
-import subprocess
-import time
-import shlex
 from urllib.parse import unquote_plus
 
 from oic.utils.http_util import ServiceError
-from otest.proc import isrunning
 from otest.rp.setup import read_path2port_map
 
+from oidctest.proc import ProcessRegistry
+from oidctest.tt.control import CONTROL_DIR
+from oidctest.tt.control import control_path
+from oidctest.tt.control import ping
+from oidctest.tt.rest import NoSuchFile
+from oidctest.tt.supervisor import StartFailed
+from oidctest.tt.supervisor import Supervisor
+from oidctest.tt.supervisor import kill_pid
+from oidctest.tt.zygote import zygote_path
+
 logger = logging.getLogger(__name__)
 
+ZYGOTE_KEY = 'zygote'
+
 
 class Application(object):
     def __init__(self, test_script, flowdir, rest, assigned_ports,
-                 test_tool_base, test_tool_conf, prehtml, path2port=None):
+                 test_tool_base, test_tool_conf, prehtml, path2port=None,
+                 multi_tenant=False, ready_timeout=10, ctldir=CONTROL_DIR,
+                 zygote=None):
         self.assigned_ports = assigned_ports
-        self.running_processes = self.assigned_ports.sync(test_script)
+        self.multi_tenant = multi_tenant
+        self.registry = ProcessRegistry(test_script)
+        if multi_tenant:
+            self.running_processes = {}
+        else:
+            self.running_processes = self.assigned_ports.sync(
+                test_script, self.registry)
         self.test_script = test_script
         self.flowdir = flowdir
         self.path2port = path2port
@@ -24,33 +39,90 @@ class Application(object):
         self.test_tool_conf = test_tool_conf
         self.rest = rest
         self.prehtml = prehtml
+        self.supervisor = Supervisor(ready_timeout=ready_timeout)
+        self.ctldir = ctldir
+        # Set to a oidctest.tt.hibernate.Hibernator instance if idle
+        # instances should be put to sleep
+        self.hibernator = None
+        # Script for the warm parent that forks test instances
+        self.zygote = zygote
 
     def key(self, iss, tag):
         return self.assigned_ports.make_key(iss, tag)
 
-    def run_test_instance(self, iss, tag):
-        _port = self.assigned_ports.register_port(iss, tag)
-        
+    def instance_url(self, port):
+        """
+        The URL where the test instance listening on a specific port can be
+        reached.
+
+        :param port: The port assigned to the test instance
+        :return: URL
+        """
+        if self.path2port:
+            ppmap = read_path2port_map(self.path2port)
+            return '{}{}'.format(self.test_tool_base, ppmap[str(port)])
+        else:
+            return '{}:{}'.format(self.test_tool_base, port)
+
+    def instance_status(self, iss, tag):
+        """
+        Ask a test instance, over its control channel, how it is doing.
+
+        :param iss: Issuer ID, not quoted
+        :param tag: Tag, not quoted
+        :return: Status as a dictionary or None if the instance does not
+            answer
+        """
+        try:
+            _port = self.assigned_ports[self.key(iss, tag)]
+        except KeyError:
+            return None
+        return ping(control_path(_port, self.ctldir))
+
+    def is_active(self, iss, tag):
+        """
+        :param iss: Issuer ID, not quoted
+        :param tag: Tag, not quoted
+        :return: True if the test instance can be reached
+        """
+        if self.multi_tenant:
+            # Built on demand by the multi-tenant test tool
+            return self.key(iss, tag) in self.assigned_ports
+
+        if self.instance_status(iss, tag) is not None:
+            return True
+
+        # Instances started before there was a control channel
+        return self.registry.pid(iss, tag) != 0
+
+    def is_hibernated(self, iss, tag):
+        if self.hibernator is None:
+            return False
+        return self.hibernator.is_hibernated(iss, tag)
+
+    def test_instance_args(self, iss, tag, port):
+        """
+        The test tool command line for a test instance.
+
+        :param iss: Issuer ID, quoted
+        :param tag: Tag, quoted
+        :param port: The port assigned to the test instance
+        :return: list of strings
+        """
         args = [self.test_script]
-        args.extend(["-i", shlex.quote(unquote_plus(iss))])
-        args.extend(["-t", shlex.quote(unquote_plus(tag))])        
-        args.extend(["-p", str(_port)])
+        args.extend(["-i", unquote_plus(iss)])
+        args.extend(["-t", unquote_plus(tag)])
+        args.extend(["-p", str(port)])
         args.extend(["-f", self.flowdir])
         args.append("-s")
-        
+
         if self.path2port:
             args.extend(["-m", self.path2port])
-            ppmap = read_path2port_map(self.path2port)
-            try:
-                _path = ppmap[str(_port)]
-            except KeyError:
-                _errtxt = 'Port not in path2port map file {}'.format(
-                    self.path2port)
-                logger.error(_errtxt)
-                return ServiceError(_errtxt)
-            url = '{}{}'.format(self.test_tool_base, _path)
-        else:
-            url = '{}:{}'.format(self.test_tool_base, _port)
+
+        try:
+            args.extend(["-e", self.rest.backend.db_name])
+        except AttributeError:  # Kept as files
+            pass
 
         typ, _econf = self.rest.read_conf(iss, tag)
         try:
@@ -63,35 +135,111 @@ class Application(object):
 
         args.append(self.test_tool_conf)
 
-        # If already running - kill
+        return args
+
+    def run_test_instance(self, iss, tag, listen_sock=None):
+        """
+        Start a test instance, stopping it first if it is already running.
+
+        :param iss: Issuer ID, quoted
+        :param tag: Tag, quoted
+        :param listen_sock: Listening socket the instance should use instead
+            of binding its port
+        :return: The URL of the instance or None if it could not be started
+        """
+        _port = self.assigned_ports.register_port(iss, tag)
+
         try:
-            pid = isrunning(unquote_plus(iss), unquote_plus(tag))
+            url = self.instance_url(_port)
         except KeyError:
-            pass
-        else:
-            if pid:
-                logger.info('kill {}'.format(pid))
-                subprocess.call(['kill', str(pid)])
+            _errtxt = 'Port not in path2port map file {}'.format(
+                self.path2port)
+            logger.error(_errtxt)
+            return ServiceError(_errtxt)
+
+        if self.multi_tenant:
+            # Touching the configuration makes the multi-tenant test tool
+            # throw away its current instance and build a fresh one.
+            try:
+                self.rest.touch(iss, tag)
+            except NoSuchFile:
+                logger.error('No configuration for {} {}'.format(iss, tag))
+                return None
+            return url
+
+        args = self.test_instance_args(iss, tag, _port)
+
+        # If already running - kill
+        self.stop_test_instance(iss, tag)
 
         # Now get it running
-        args.append('&')
-        cmd = " ".join(args)
-        logger.info("Test tool command: {}".format(cmd))
+        logger.info("Test tool command: {}".format(" ".join(args)))
+        _key = self.key(iss, tag)
+        try:
+            child = self.supervisor.start(_key, args, _port,
+                                          listen_sock=listen_sock)
+        except StartFailed as err:
+            logger.error('Failed to start the test tool: {}'.format(err))
+            return None
+
+        logger.info("{} {} - process id: {}, started in {:.3f}s".format(
+            iss, tag, child.pid, child.latency))
+        self.running_processes[_key] = child.pid
+        self.registry.track(child.pid)
+        return url
+
+    def stop_test_instance(self, iss, tag):
+        """
+        Stop a running test instance, whether it was started by this
+        application or found running when the application started.
+
+        :param iss: Issuer ID, quoted or not
+        :param tag: Tag, quoted or not
+        :return: True if there was something to stop
+        """
+        _key = self.key(iss, tag)
+        pid = self.running_processes.pop(_key, 0)
+
+        if self.hibernator and self.hibernator.release(iss, tag):
+            return True
+
+        if self.supervisor.stop(_key):
+            self.registry.invalidate()
+            return True
 
-        # spawn independent process, leaping blindly here
-        os.system(cmd)
+        if not pid:
+            pid = self.registry.pid(unquote_plus(iss), unquote_plus(tag))
 
-        pid = 0
-        for i in range(0, 10):
-            time.sleep(1)
-            pid = isrunning(unquote_plus(iss), unquote_plus(tag))
-            if pid:
-                break
+        if not pid:
+            # Forked by a zygote, the command line doesn't tell
+            _status = self.instance_status(unquote_plus(iss),
+                                           unquote_plus(tag))
+            if _status:
+                pid = _status['pid']
 
         if pid:
-            logger.info("{} {} - process id: {}".format(iss, tag, pid))
-            self.running_processes['{}:{}'.format(iss, tag)] = pid
-            return url
-        else:
-            logger.error('Failed to start the test tool')
-            return None
+            logger.info('kill {}'.format(pid))
+            kill_pid(pid)
+            self.registry.invalidate()
+            return True
+        return False
+
+    def start_zygote(self):
+        """
+        Start the warm parent process that will fork the test instances.
+        If it fails or later dies, test instances are started from scratch.
+        """
+        # Next to the test instances' control sockets
+        args = [self.zygote, "-f", self.flowdir, "-z",
+                zygote_path(self.ctldir), self.test_tool_conf]
+        try:
+            child = self.supervisor.start(ZYGOTE_KEY, args, 0)
+        except StartFailed as err:
+            logger.error('Could not start the zygote: {}'.format(err))
+            return False
+        self.supervisor.zygote = child.info['zygote']
+        return True
+
+    def stop_zygote(self):
+        self.supervisor.zygote = None
+        self.supervisor.stop(ZYGOTE_KEY)
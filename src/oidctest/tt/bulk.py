@@ -0,0 +1,305 @@
+"""
+Restarting, stopping or starting many test instances at once.
+
+Each worker handles one instance at a time from start to finish, so with
+N workers at most N instances are down at any moment. The instances are
+ordered so that the tags of one issuer are spread out over the run rather
+than all being restarted together.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+from urllib.parse import unquote_plus
+
+import cherrypy
+from jwkest import as_bytes
+
+from oidctest.tt.store import FileStore
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ['restart', 'stop', 'start']
+
+# Not a real test instance
+EXAMPLE_ISS = 'https://example.com'
+
+
+class UnknownAction(Exception):
+    pass
+
+
+class BulkBusy(Exception):
+    pass
+
+
+def configured_instances(entpath, iss=None, tag=None):
+    """
+    All the test instances that have a configuration.
+
+    :param entpath: Directory where the configurations are kept or a
+        store, see :py:mod:`oidctest.tt.store`
+    :param iss: Only instances for this issuer, not quoted
+    :param tag: Only instances with this tag, not quoted
+    :return: List of (issuer, tag) tuples, not quoted
+    """
+    if isinstance(entpath, str):
+        entpath = FileStore(entpath)
+    res = []
+    for qiss, qtags in sorted(entpath.items().items()):
+        _iss = unquote_plus(qiss)
+        if _iss == EXAMPLE_ISS or (iss and _iss != iss):
+            continue
+        for qtag in qtags:
+            _tag = unquote_plus(qtag)
+            if tag and _tag != tag:
+                continue
+            res.append((_iss, _tag))
+    return res
+
+
+def rolling_order(instances):
+    """
+    Interleave the instances so that consecutive ones belong to different
+    issuers where possible.
+
+    :param instances: List of (issuer, tag) tuples
+    :return: The same tuples reordered
+    """
+    by_iss = {}
+    _order = []
+    for iss, tag in instances:
+        if iss not in by_iss:
+            by_iss[iss] = []
+            _order.append(iss)
+        by_iss[iss].append((iss, tag))
+
+    res = []
+    while by_iss:
+        for iss in list(_order):
+            res.append(by_iss[iss].pop(0))
+            if not by_iss[iss]:
+                del by_iss[iss]
+                _order.remove(iss)
+    return res
+
+
+class Result(object):
+    def __init__(self, iss, tag):
+        self.iss = iss
+        self.tag = tag
+        self.ok = False
+        self.attempts = 0
+        self.error = ''
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        return {'iss': self.iss, 'tag': self.tag, 'ok': self.ok,
+                'attempts': self.attempts, 'error': self.error,
+                'elapsed': round(self.elapsed, 3)}
+
+
+class BulkOperation(object):
+    def __init__(self, app, action, instances, workers=4, retries=1,
+                 retry_delay=2, progress=None):
+        """
+        :param app: A :py:class:`oidctest.tt.app.Application` instance
+        :param action: One of ACTIONS
+        :param instances: List of (issuer, tag) tuples, not quoted
+        :param workers: Max number of instances handled concurrently
+        :param retries: How many more times to try if an instance fails
+        :param retry_delay: Seconds to wait before the first retry, doubled
+            for every following
+        :param progress: Function called with a :py:class:`Result`, the
+            number of instances done and the total number when an instance
+            is done
+        """
+        if action not in ACTIONS:
+            raise UnknownAction(action)
+
+        self.app = app
+        self.action = action
+        self.instances = rolling_order(instances)
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress = progress
+        self.results = []
+        self.started = 0
+        self.finished = 0
+        self.lock = threading.Lock()
+
+    def _once(self, iss, tag):
+        if self.action == 'stop':
+            self.app.stop_test_instance(iss, tag)
+            return True
+
+        url = self.app.run_test_instance(quote_plus(iss), quote_plus(tag))
+        # Could also be a ServiceError
+        return isinstance(url, str)
+
+    def do(self, iss, tag):
+        """
+        Perform the action on one instance, retrying if it fails.
+
+        :return: A :py:class:`Result` instance
+        """
+        res = Result(iss, tag)
+        _start = time.time()
+        _delay = self.retry_delay
+        while res.attempts <= self.retries:
+            if res.attempts:
+                time.sleep(_delay)
+                _delay *= 2
+            res.attempts += 1
+            try:
+                res.ok = self._once(iss, tag)
+            except Exception as err:
+                logger.exception('{} {} {}'.format(self.action, iss, tag))
+                res.error = str(err)
+            else:
+                if res.ok:
+                    res.error = ''
+                    break
+                res.error = 'Could not {}'.format(self.action)
+        res.elapsed = time.time() - _start
+
+        with self.lock:
+            self.results.append(res)
+            _done = len(self.results)
+        logger.info('{} {} {}: {} ({}/{})'.format(
+            self.action, iss, tag, 'ok' if res.ok else res.error, _done,
+            len(self.instances)))
+        if self.progress:
+            self.progress(res, _done, len(self.instances))
+        return res
+
+    def run(self):
+        """
+        Handle all the instances.
+
+        :return: The summary, see :py:meth:`summary`
+        """
+        self.started = time.time()
+        if self.action != 'stop':
+            # AssignedPorts isn't thread safe, new instances get their
+            # ports here
+            for iss, tag in self.instances:
+                self.app.assigned_ports.register_port(quote_plus(iss),
+                                                      quote_plus(tag))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for iss, tag in self.instances:
+                pool.submit(self.do, iss, tag)
+
+        self.finished = time.time()
+        return self.summary()
+
+    def is_done(self):
+        return self.finished != 0
+
+    def summary(self):
+        with self.lock:
+            _results = list(self.results)
+        _failed = [r.to_dict() for r in _results if not r.ok]
+        if self.finished:
+            _elapsed = self.finished - self.started
+        elif self.started:
+            _elapsed = time.time() - self.started
+        else:
+            _elapsed = 0
+        return {
+            'action': self.action,
+            'total': len(self.instances),
+            'done': len(_results),
+            'ok': len(_results) - len(_failed),
+            'failed': _failed,
+            'retried': len([r for r in _results if r.attempts > 1]),
+            'elapsed': round(_elapsed, 3),
+            'finished': self.is_done()
+        }
+
+
+def select_instances(app, entpath, action, iss=None, tag=None):
+    """
+    The configured instances an action applies to. Only running ones are
+    restarted or stopped and only those not running are started.
+
+    :param app: A :py:class:`oidctest.tt.app.Application` instance
+    :param entpath: Directory where the configurations are kept or a
+        store, see :py:mod:`oidctest.tt.store`
+    :param action: One of ACTIONS
+    :param iss: Only instances for this issuer, not quoted
+    :param tag: Only instances with this tag, not quoted
+    :return: List of (issuer, tag) tuples, not quoted
+    """
+    res = []
+    for _iss, _tag in configured_instances(entpath, iss, tag):
+        if app.is_active(_iss, _tag) == (action != 'start'):
+            res.append((_iss, _tag))
+    return res
+
+
+class Bulk(object):
+    """
+    Config server endpoint for bulk operations. One operation at a time is
+    run in the background, its progress can be followed at /bulk/status.
+    """
+
+    def __init__(self, app, entpath, workers=4, retries=1):
+        self.app = app
+        self.entpath = entpath
+        self.workers = workers
+        self.retries = retries
+        self.current = None
+        self.lock = threading.Lock()
+
+    def start_operation(self, action, iss=None, tag=None, workers=None):
+        """
+        :param workers: Max number of instances handled at the same time,
+            never more than the configured number
+        """
+        if workers:
+            workers = min(max(1, workers), self.workers)
+        _instances = select_instances(self.app, self.entpath, action, iss,
+                                      tag)
+        with self.lock:
+            if self.current and not self.current.is_done():
+                raise BulkBusy('A {} is already running'.format(
+                    self.current.action))
+            self.current = BulkOperation(self.app, action, _instances,
+                                         workers=workers or self.workers,
+                                         retries=self.retries)
+        _thread = threading.Thread(target=self.current.run,
+                                   name='Bulk {}'.format(action))
+        _thread.daemon = True
+        _thread.start()
+        return self.current
+
+    def _json(self, info):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return as_bytes(json.dumps(info))
+
+    @cherrypy.expose
+    def run(self, action, iss=None, tag=None, workers=None):
+        if cherrypy.request.method != 'POST':
+            raise cherrypy.HTTPError(405, 'Use POST')
+        try:
+            # Anything but a number is a bad request, not a server error
+            _workers = int(workers) if workers else None
+            _op = self.start_operation(action, iss, tag, _workers)
+        except (UnknownAction, ValueError) as err:
+            raise cherrypy.HTTPError(400, 'Bad request: {}'.format(err))
+        except BulkBusy as err:
+            raise cherrypy.HTTPError(409, str(err))
+        return self._json(_op.summary())
+
+    @cherrypy.expose
+    def status(self):
+        if self.current is None:
+            return self._json({})
+        return self._json(self.current.summary())
+
+    index = status
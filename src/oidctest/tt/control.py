@@ -0,0 +1,146 @@
+"""
+Local control channel between the config server and the test tool
+instances.
+
+Every test tool instance listens on a unix socket named after its port in
+a directory shared with the config server. A client connects, sends one
+command line and gets one JSON line back. The only command so far is
+'ping' which returns the status of the instance.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+logger = logging.getLogger(__name__)
+
+CONTROL_DIR = 'ctl'
+
+
+def control_path(port, ctldir=CONTROL_DIR):
+    return os.path.join(ctldir, '{}.sock'.format(port))
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        cmd = self.rfile.readline().decode('utf-8').strip()
+        if cmd == 'ping':
+            resp = self.server.channel.status()
+        else:
+            resp = {'error': 'Unknown command: {}'.format(cmd)}
+        self.wfile.write('{}\n'.format(json.dumps(resp)).encode('utf-8'))
+
+
+class ControlServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlChannel(SimplePlugin):
+    """
+    Serves the control socket for as long as the CherryPy engine is
+    running.
+    """
+
+    def __init__(self, bus, path, **info):
+        """
+        :param bus: The CherryPy engine
+        :param path: Path of the unix socket
+        :param info: Static information about the instance (iss, tag, port,
+            flows ...) returned on ping
+        """
+        SimplePlugin.__init__(self, bus)
+        self.path = path
+        self.info = info
+        self.info['pid'] = os.getpid()
+        self.since = self.last_access = time.time()
+        self.server = None
+
+    def touch(self):
+        """
+        Record that the instance has been used. Meant to be hooked into
+        the request processing.
+        """
+        self.last_access = time.time()
+
+    def status(self):
+        _now = time.time()
+        _status = dict(self.info)
+        _status['uptime'] = int(_now - self.since)
+        _status['idle'] = int(_now - self.last_access)
+        return _status
+
+    def start(self):
+        _dir = os.path.dirname(self.path)
+        if _dir and not os.path.isdir(_dir):
+            os.makedirs(_dir)
+        try:  # left behind by an instance that died
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        self.server = ControlServer(self.path, ControlHandler)
+        self.server.channel = self
+        _thread = threading.Thread(target=self.server.serve_forever,
+                                   name='ControlChannel')
+        _thread.daemon = True
+        _thread.start()
+        self.bus.log('Control channel listening on {}'.format(self.path))
+
+    # Start after the HTTP server so a successful ping means we are listening
+    start.priority = 80
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def send(path, cmd, timeout=1.0):
+    """
+    Send a command over a control channel.
+
+    :param path: Path of the unix socket
+    :param cmd: The command
+    :param timeout: Seconds to wait for an answer
+    :return: The response as a dictionary or None if nothing is listening.
+    """
+    if not os.path.exists(path):
+        return None
+
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    _sock.settimeout(timeout)
+    try:
+        _sock.connect(path)
+        _sock.sendall('{}\n'.format(cmd).encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            _chunk = _sock.recv(4096)
+            if not _chunk:
+                break
+            data += _chunk
+    except (OSError, socket.timeout) as err:
+        logger.debug('No answer on {}: {}'.format(path, err))
+        return None
+    finally:
+        _sock.close()
+
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def ping(path, timeout=1.0):
+    return send(path, 'ping', timeout)
@@ -5,14 +5,19 @@ from urllib.parse import unquote_plus
 
 import cherrypy
 from jwkest import as_bytes
-from otest.proc import find_test_instance
-from otest.proc import isrunning
 
 from oidctest.cp import init_events
+from oidctest.dir_index import page_links
+from oidctest.dir_index import page_of
+from oidctest.proc import ProcessRegistry
 from oidctest.tt import unquote_quote
+from oidctest.tt.history import ConfigHistory
 
 logger = logging.getLogger(__name__)
 
+# Instance state, in addition to True (running) and False (stopped)
+HIBERNATED = 'hibernated'
+
 
 def iss_table(base, issuers):
     issuers.sort()
@@ -26,7 +31,8 @@ def iss_table(base, issuers):
     return '\n'.join(line)
 
 
-def item_table(qiss, items, active, assigned_ports, test_tool_base):
+def item_table(qiss, items, active, assigned_ports, test_tool_base,
+               instance_url=None):
     line = ["<table class=\"table table-hover table-bordered\">", "<tr class=\"info\"><th>Tag</th><th>Status</th><th>Actions</th></tr>"]
     _del = '<button class="btn btn-default" name="action" type="submit" value="delete"><span class="glyphicon glyphicon-remove"></span>&nbsp;Delete</button>'
     _rst = '<button class="btn btn-default" name="action" type="submit" value="restart"><span class="glyphicon glyphicon-refresh"></span>&nbsp;Restart</button>'
@@ -41,13 +47,19 @@ def item_table(qiss, items, active, assigned_ports, test_tool_base):
             logger.error('{} has no assigned port'.format(eid))
             continue
 
-        _instance = '{}:{}'.format(test_tool_base, _port)
+        if instance_url:
+            _instance = instance_url(_port)
+        else:
+            _instance = '{}:{}'.format(test_tool_base, _port)
 
         _url = "/action/{}/{}".format(qiss, item)
         _action = '\n'.join([
             '<form class="col-md-10" action="{}" method="get">'.format(_url), _rst, _stop,
             _cnf, _del])
-        if active[item]:
+        if active[item] == HIBERNATED:
+            _ball = '<button type="button" class="btn btn-info" alt="Blue"><span class="glyphicon glyphicon-pause"></span></button>'
+            inst = "<a href=\"{}\">{}</a>".format(_instance, item)
+        elif active[item]:
             _ball = '<button type="button" class="btn btn-success" alt="Green"><span class="glyphicon glyphicon-ok-sign"></span></button>'
             inst = "<a href=\"{}\">{}</a>".format(_instance, item)
         else:
@@ -61,28 +73,58 @@ def item_table(qiss, items, active, assigned_ports, test_tool_base):
     return '\n'.join(line)
 
 
+def status_text(status):
+    """
+    :param status: Status as reported over the control channel
+    :return: Short human readable version of it
+    """
+    try:
+        return '(pid {pid}, port {port}, {flows} flows, up {uptime}s)'.format(
+            **status)
+    except KeyError:
+        return ''
+
+
 class Entity(object):
-    def __init__(self, entpath, prehtml, rest, assigned_ports, test_tool_base, version, backuppath='backup'):
+    def __init__(self, entpath, prehtml, rest, assigned_ports, test_tool_base, version, backuppath='backup',
+                 app=None, history=None):
         self.entpath = entpath
         self.prehtml = prehtml
         self.rest = rest
         self.assigned_ports = assigned_ports
         self.test_tool_base = test_tool_base
         self.backup = backuppath
+        self.history = history or ConfigHistory(backuppath)
         self.version = version
+        self.app = app
+        if app:
+            self.registry = app.registry
+        else:
+            self.registry = ProcessRegistry()
 
-    @cherrypy.expose
-    def index(self):
-        fils = os.listdir(self.entpath)
+    def is_active(self, iss, tag):
+        if self.app:
+            return self.app.is_active(iss, tag)
+        return self.registry.pid(iss, tag) != 0
 
+    def status(self, iss, tag):
+        if self.app:
+            return self.app.instance_status(iss, tag)
+        return None
+
+    @cherrypy.expose
+    def index(self, page='1'):
         # Remove examples
+        fils = [f for f in self.rest.backend.issuers()
+                if f != 'https%3A%2F%2Fexample.com']
         try:
-            fils.remove('https%3A%2F%2Fexample.com')
+            fils, page, pages = page_of(fils, int(page))
         except ValueError:
-            pass
+            raise cherrypy.HTTPError(400, 'page must be a number')
 
         _msg = self.prehtml['list_iss.html'].format(
-            iss_table=iss_table('', fils),
+            iss_table=iss_table('', fils) + page_links(cherrypy.url(), page,
+                                                       pages),
             version=self.version
         )
         return as_bytes(_msg)
@@ -94,23 +136,28 @@ class Entity(object):
         iss = uqp[0]
         qiss = qp[0]
         try:
-            fils = os.listdir(os.path.join(self.entpath, qiss))
-        except FileNotFoundError:
+            fils = self.rest.backend.tags(qiss)
+        except KeyError:
             logger.warning('No such Issuer exists')
             return b"No such Issuer exists"
 
-        active = dict()
-        tags = []
-        for fil in fils:
-            tag = unquote_plus(fil)
-            active[tag] = isrunning(iss, tag)
-            tags.append(tag)
+        tags = [unquote_plus(fil) for fil in fils]
+        if self.app:
+            active = {}
+            for tag in tags:
+                if self.app.is_hibernated(iss, tag):
+                    active[tag] = HIBERNATED
+                else:
+                    active[tag] = self.is_active(iss, tag)
+        else:
+            active = self.registry.running(iss, tags)
 
         logger.info('tags: {}'.format(tags))
 
         self.assigned_ports.load()
         _msg = self.prehtml['list_tag.html'].format(
-            item_table=item_table(qiss, tags, active, self.assigned_ports, self.test_tool_base),
+            item_table=item_table(qiss, tags, active, self.assigned_ports, self.test_tool_base,
+                                  self.app.instance_url if self.app else None),
             iss=iss,
             version=self.version
         )
@@ -121,12 +168,18 @@ class Entity(object):
         uqp, qp = unquote_quote(iiss, itag)
         logger.info('Show info on iss="{}", tag="{}"'.format(*uqp))
 
-        if find_test_instance(*uqp):
+        _status = self.status(*uqp)
+        if self.app and self.app.is_hibernated(*uqp):
+            active = '<div class="active"> Hibernated </div>'
+        elif _status:
+            active = '<div class="active"> Running {} </div>'.format(
+                status_text(_status))
+        elif self.is_active(*uqp):
             active = '<div class="active"> Running </div>'
         else:
             active = '<div class="inactive"> Inactive </div>'
 
-        info = open(os.path.join(self.entpath, *qp), 'r').read()
+        info = self.rest.backend.read(*qp)
 
         _msg = self.prehtml['action.html'].format(path=qp[-1], active=active,
                                                   display_info=info)
@@ -152,33 +205,72 @@ class Entity(object):
         uqp, qp = unquote_quote(iiss, itag)
         logger.info('Do backup of iss="{}", tag="{}"'.format(*uqp))
 
-        info = open(os.path.join(self.entpath, *qp), 'r').read()
-        bname = '{}.{}.{}'.format(qp[0], qp[1], time.time())
-        fp = open(os.path.join(self.backup, bname), 'w')
-        fp.write(info)
-        fp.close()
-        return ''
+        info = self.rest.backend.read(*qp)
+        return str(self.history.save(qp[0], qp[1], info))
 
     @cherrypy.expose
-    def restore(self, iiss, itag):
+    def versions(self, iiss, itag):
+        uqp, qp = unquote_quote(iiss, itag)
+        cherrypy.response.headers['Content-Type'] = 'text/plain'
+        return '\n'.join(
+            '{} {} {}'.format(e['version'], time.ctime(e['time']), e['digest'])
+            for e in self.history.versions(*qp))
+
+    @cherrypy.expose
+    def diff(self, iiss, itag, old, new='0'):
+        uqp, qp = unquote_quote(iiss, itag)
+        try:
+            res = self.history.diff(qp[0], qp[1], int(old), int(new))
+        except (KeyError, ValueError):
+            raise cherrypy.HTTPError(404, 'No such version')
+        cherrypy.response.headers['Content-Type'] = 'text/plain'
+        return res
+
+    @cherrypy.expose
+    def restore(self, iiss, itag, version='0'):
         uqp, qp = unquote_quote(iiss, itag)
         logger.info('Restore iss="{}", tag="{}"'.format(*uqp))
-        bname = '{}.{}'.format(qp[0], qp[1])
+        try:
+            version = int(version)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'Bad version')
+        try:
+            info = self.history.read(qp[0], qp[1], version)
+        except KeyError:
+            info = None if version else self._legacy_backup(qp)
+        if info is None:
+            raise cherrypy.HTTPError(404, 'No backup')
+        return self.rest.store(qp[0], qp[1], info)
+
+    def _legacy_backup(self, qp):
+        """
+        Backups made before there was a history, files named
+        <issuer>.<tag>.<time> in the backup directory.
+
+        :return: The latest one, None if there is none
+        """
+        bname = '{}.{}.'.format(qp[0], qp[1])
         last = 0.0
         last_backup = None
-        for item in os.listdir(self.backup):
-            if item.startswith("."):
-                continue
-            if not itag.startswith(bname):
+        try:
+            items = os.listdir(self.backup)
+        except FileNotFoundError:
+            return None
+        for item in items:
+            if not item.startswith(bname):
                 continue
 
-            # Should be 3 parts, only interested in the last
-            p = item.split('.')[-1]
-            if float(p) > last:
-                last = float(p)
+            # The time, which has a '.' of its own
+            try:
+                p = float(item[len(bname):])
+            except ValueError:
+                continue
+            if p > last:
+                last = p
                 last_backup = item
 
         if last_backup:
             fn = os.path.join(self.backup, last_backup)
-            info = open(fn, 'r').read()
-            return self.rest.store(qp[0], qp[1], info)
+            with open(fn, 'r') as fp:
+                return fp.read()
+        return None
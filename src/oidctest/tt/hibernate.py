@@ -0,0 +1,167 @@
+"""
+Putting idle test instances to sleep and waking them up again.
+
+A test instance that has not handled a request for idle_timeout seconds
+is stopped. The config server then binds and listens on the instance's
+port itself. When a connection comes in the instance is started again
+and the listening socket, with the connection still waiting in its
+backlog, is handed over to it.
+
+Hibernated instances are only remembered by the running config server.
+If it is restarted they show up as stopped.
+"""
+import logging
+import os
+import select
+import socket
+import threading
+from urllib.parse import quote_plus
+
+from cherrypy.process.plugins import SimplePlugin
+
+from oidctest.tt.control import control_path
+from oidctest.tt.control import ping
+
+logger = logging.getLogger(__name__)
+
+
+class Sleeper(object):
+    def __init__(self, iss, tag, port, sock):
+        self.iss = iss
+        self.tag = tag
+        self.port = port
+        self.sock = sock
+
+
+class Hibernator(SimplePlugin):
+    def __init__(self, bus, app, idle_timeout, host='0.0.0.0', backlog=16):
+        """
+        :param bus: The CherryPy engine
+        :param app: A :py:class:`oidctest.tt.app.Application` instance
+        :param idle_timeout: Seconds without requests before an instance
+            is put to sleep
+        :param host: Address to listen on for sleeping instances
+        :param backlog: Listen queue length
+        """
+        SimplePlugin.__init__(self, bus)
+        self.app = app
+        self.idle_timeout = idle_timeout
+        self.host = host
+        self.backlog = backlog
+        self.sleeping = {}
+        self.lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        _thread = threading.Thread(target=self.watch, name='Hibernator')
+        _thread.daemon = True
+        _thread.start()
+
+    def stop(self):
+        self._running = False
+        self._poke()
+
+    def _poke(self):
+        """Make the watcher look at the set of sockets again."""
+        os.write(self._wakeup_w, b'x')
+
+    def is_hibernated(self, iss, tag):
+        with self.lock:
+            return self.app.key(iss, tag) in self.sleeping
+
+    def hibernate(self, iss, tag):
+        """
+        Stop a test instance and start listening on its port.
+
+        :param iss: Issuer ID, not quoted
+        :param tag: Tag, not quoted
+        """
+        _key = self.app.key(iss, tag)
+        _port = self.app.assigned_ports[_key]
+
+        self.app.stop_test_instance(iss, tag)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((self.host, _port))
+        except OSError as err:
+            sock.close()
+            logger.error('Could not hibernate {}: {}'.format(_key, err))
+            return False
+        sock.listen(self.backlog)
+
+        with self.lock:
+            self.sleeping[_key] = Sleeper(iss, tag, _port, sock)
+        self._poke()
+        logger.info('{} hibernated, port {} held'.format(_key, _port))
+        return True
+
+    def release(self, iss, tag):
+        """
+        Stop listening for a hibernated test instance, for instance because
+        it has been stopped, restarted or deleted.
+
+        :return: True if it was hibernated
+        """
+        with self.lock:
+            _sleeper = self.sleeping.pop(self.app.key(iss, tag), None)
+        if _sleeper is None:
+            return False
+        _sleeper.sock.close()
+        self._poke()
+        return True
+
+    def wake(self, sleeper):
+        logger.info('Waking up {}][{}'.format(sleeper.iss, sleeper.tag))
+        try:
+            self.app.run_test_instance(quote_plus(sleeper.iss),
+                                       quote_plus(sleeper.tag),
+                                       listen_sock=sleeper.sock)
+        finally:
+            # The instance has its own copy now
+            sleeper.sock.close()
+
+    def watch(self):
+        """
+        Waits for connections on the ports of the hibernated instances.
+        """
+        while self._running:
+            # poll() rather than select() as there may be more than
+            # FD_SETSIZE ports
+            _poll = select.poll()
+            _poll.register(self._wakeup_r, select.POLLIN)
+            with self.lock:
+                _socks = {}
+                for key, _sleeper in self.sleeping.items():
+                    _socks[_sleeper.sock.fileno()] = key
+                    _poll.register(_sleeper.sock, select.POLLIN)
+
+            for fd, _ in _poll.poll():
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 1024)
+                    continue
+
+                with self.lock:
+                    _sleeper = self.sleeping.pop(_socks[fd], None)
+                if _sleeper is None:  # released meanwhile
+                    continue
+                _thread = threading.Thread(target=self.wake, args=(_sleeper,))
+                _thread.daemon = True
+                _thread.start()
+
+    def check(self):
+        """
+        Put instances that has been idle for too long to sleep. Meant to be
+        run by a :py:class:`cherrypy.process.plugins.Monitor`.
+        """
+        for key, port in list(self.app.assigned_ports.items()):
+            with self.lock:
+                if key in self.sleeping:
+                    continue
+            _status = ping(control_path(port, self.app.ctldir))
+            if _status and _status.get('idle', 0) >= self.idle_timeout:
+                iss, tag = key.split('][', 1)
+                self.hibernate(iss, tag)
@@ -0,0 +1,253 @@
+"""
+Earlier versions of the test instance configurations.
+
+A version is stored once however many times it is saved, as a blob
+named by the SHA-256 digest of its content, blobs/<digest[:2]>/<digest>.
+Each instance has an index, index/<quoted issuer>/<quoted tag>, with one
+JSON line per version: its number, when it was saved and its digest. The
+latest version is the last line, so finding it doesn't depend on how many
+versions there are.
+
+Old versions are dropped according to the retention settings when a new
+one is saved, blobs no longer used by any version are removed by
+:py:meth:`ConfigHistory.collect`.
+"""
+import difflib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from urllib.parse import quote_plus
+
+from oidctest.tt.store import issuer_key
+
+logger = logging.getLogger(__name__)
+
+# Blobs younger than this are not collected, they may be about to be
+# added to an index
+GRACE = 3600
+
+
+def _last_line(fname, block=4096):
+    """
+    :return: The last line of a file, None if it is empty
+    """
+    with open(fname, 'rb') as fp:
+        fp.seek(0, 2)
+        _end = fp.tell()
+        _data = b''
+        _pos = _end
+        while _pos > 0:
+            _pos = max(0, _pos - block)
+            fp.seek(_pos)
+            _data = fp.read(_end - _pos)
+            # A newline before the last line
+            if _data.rstrip(b'\n').rfind(b'\n') >= 0:
+                break
+        _lines = _data.rstrip(b'\n').rsplit(b'\n', 1)
+        if not _lines[-1]:
+            return None
+        return _lines[-1].decode('utf-8')
+
+
+def _write_atomic(fname, data):
+    _dir = os.path.dirname(fname)
+    if not os.path.isdir(_dir):
+        os.makedirs(_dir, exist_ok=True)
+    _tmp = os.path.join(_dir, '.{}.{}'.format(os.path.basename(fname),
+                                              uuid.uuid4().hex))
+    with open(_tmp, 'wb') as fp:
+        fp.write(data)
+    os.replace(_tmp, fname)
+
+
+def pretty(conf):
+    """
+    :param conf: A configuration as a JSON document
+    :return: The same, one item per line with sorted keys, for comparing
+    """
+    try:
+        return json.dumps(json.loads(conf), indent=2, sort_keys=True)
+    except ValueError:
+        return conf
+
+
+class ConfigHistory(object):
+    def __init__(self, directory, keep=0, max_age=0):
+        """
+        :param directory: Where the history is kept
+        :param keep: Number of versions per instance that are always kept,
+            0 means all
+        :param max_age: Seconds older versions are kept, 0 means forever.
+            The latest version is always kept.
+        """
+        self.directory = directory
+        self.keep = keep
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+    def _blob_name(self, digest):
+        return os.path.join(self.directory, 'blobs', digest[:2], digest)
+
+    def _index_name(self, qiss, qtag):
+        # The same issuer with or without a trailing '/'
+        return os.path.join(self.directory, 'index',
+                            quote_plus(issuer_key(qiss)), qtag)
+
+    def save(self, qiss, qtag, conf):
+        """
+        :param qiss: Issuer ID, quote_plus converted
+        :param qtag: Tag, quote_plus converted
+        :param conf: The configuration as a JSON document
+        :return: The version number, the latest one if the configuration
+            hasn't changed since it was saved
+        """
+        _data = conf.encode('utf-8')
+        _digest = hashlib.sha256(_data).hexdigest()
+        _blob = self._blob_name(_digest)
+        _index = self._index_name(qiss, qtag)
+        # collect() can't remove the blob before the index refers to it
+        with self.lock:
+            try:
+                # Young again, in case it's about to be collected
+                os.utime(_blob, None)
+            except FileNotFoundError:
+                _write_atomic(_blob, _data)
+
+            _latest = self.latest(qiss, qtag)
+            if _latest and _latest['digest'] == _digest:
+                return _latest['version']
+
+            _entry = {'version': _latest['version'] + 1 if _latest else 1,
+                      'time': time.time(), 'digest': _digest}
+            if not os.path.isdir(os.path.dirname(_index)):
+                os.makedirs(os.path.dirname(_index), exist_ok=True)
+            with open(_index, 'a') as fp:
+                fp.write(json.dumps(_entry) + '\n')
+            self._apply_retention(_index)
+        return _entry['version']
+
+    def latest(self, qiss, qtag):
+        """
+        :return: The entry of the latest version, None if there is none
+        """
+        try:
+            _line = _last_line(self._index_name(qiss, qtag))
+        except FileNotFoundError:
+            return None
+        if _line is None:
+            return None
+        return json.loads(_line)
+
+    def versions(self, qiss, qtag):
+        """
+        :return: List of entries, dictionaries with version, time and
+            digest, oldest first
+        """
+        try:
+            with open(self._index_name(qiss, qtag), 'r') as fp:
+                return [json.loads(_line) for _line in fp if _line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read(self, qiss, qtag, version=0):
+        """
+        :param version: Version number, 0 means the latest
+        :return: The configuration
+        :raises KeyError: If there is no such version or its contents are
+            gone
+        """
+        if version:
+            _entries = [e for e in self.versions(qiss, qtag)
+                        if e['version'] == version]
+            _entry = _entries[0] if _entries else None
+        else:
+            _entry = self.latest(qiss, qtag)
+        if _entry is None:
+            raise KeyError((qiss, qtag, version))
+        try:
+            with open(self._blob_name(_entry['digest']), 'rb') as fp:
+                return fp.read().decode('utf-8')
+        except FileNotFoundError:
+            logger.warning('Contents of version {} of {} {} missing'.format(
+                _entry['version'], qiss, qtag))
+            raise KeyError((qiss, qtag, version))
+
+    def diff(self, qiss, qtag, old, new=0):
+        """
+        :param old: Version number
+        :param new: Version number, 0 means the latest
+        :return: Unified diff between the versions
+        """
+        _old = pretty(self.read(qiss, qtag, old)).splitlines(True)
+        _new = pretty(self.read(qiss, qtag, new)).splitlines(True)
+        return ''.join(difflib.unified_diff(
+            _old, _new, 'version {}'.format(old),
+            'version {}'.format(new or 'latest')))
+
+    def _apply_retention(self, index, now=None):
+        if not self.keep and not self.max_age:
+            return
+        with open(index, 'r') as fp:
+            _entries = [json.loads(_line) for _line in fp if _line.strip()]
+
+        _limit = (now or time.time()) - self.max_age
+        _kept = []
+        for n, _entry in enumerate(_entries):
+            # Counted from the latest
+            _rank = len(_entries) - n
+            if _rank == 1:
+                _kept.append(_entry)
+            elif self.keep and _rank <= self.keep:
+                _kept.append(_entry)
+            elif self.max_age and _entry['time'] > _limit:
+                _kept.append(_entry)
+
+        if len(_kept) != len(_entries):
+            _write_atomic(index, ''.join(
+                json.dumps(e) + '\n' for e in _kept).encode('utf-8'))
+
+    def collect(self, now=None):
+        """
+        Apply the retention settings to all instances and remove the blobs
+        no version uses.
+
+        :return: Number of blobs removed
+        """
+        _index_dir = os.path.join(self.directory, 'index')
+        _blob_dir = os.path.join(self.directory, 'blobs')
+        if not os.path.isdir(_blob_dir):
+            return 0
+
+        _now = now or time.time()
+        _used = set()
+        with self.lock:
+            for _root, _dirs, _files in os.walk(_index_dir):
+                for _name in _files:
+                    if _name.startswith('.'):
+                        continue
+                    _index = os.path.join(_root, _name)
+                    self._apply_retention(_index, _now)
+                    with open(_index, 'r') as fp:
+                        for _line in fp:
+                            if _line.strip():
+                                _used.add(json.loads(_line)['digest'])
+
+            n = 0
+            for _root, _dirs, _files in os.walk(_blob_dir):
+                for _name in _files:
+                    if _name in _used:
+                        continue
+                    fn = os.path.join(_root, _name)
+                    try:
+                        if os.stat(fn).st_mtime > _now - GRACE:
+                            continue
+                        os.unlink(fn)
+                        n += 1
+                    except OSError:
+                        pass
+        logger.info('Removed {} unused configuration versions'.format(n))
+        return n
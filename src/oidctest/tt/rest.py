@@ -1,7 +1,7 @@
 import json
 import logging
 import os
-import sys
+import time
 from urllib.parse import quote_plus
 from urllib.parse import unquote_plus
 
@@ -10,7 +10,12 @@ from jwkest import as_bytes
 from otest.prof_util import do_discovery
 from otest.prof_util import do_registration
 
+from oidctest.cache import LRUCache
+from oidctest.dir_index import RACY_NS
+from oidctest.file_system import FileSystem
 from oidctest.tt import unquote_quote
+from oidctest.tt.store import FileStore
+from oidctest.tt.store import issuer_key
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +24,92 @@ class NoSuchFile(Exception):
     pass
 
 
+def _readonly(*args, **kwargs):
+    raise TypeError('Shared configuration, use thaw() for a copy to change')
+
+
+class FrozenDict(dict):
+    """
+    A dictionary that can't be changed.
+    """
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        # Copied and pickled without going through __setitem__
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """
+    A list that can't be changed.
+    """
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = _readonly
+    clear = _readonly
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(obj):
+    """
+    :param obj: A parsed JSON document
+    :return: The same document, made of dictionaries and lists that can't
+        be changed, so it can be shared
+    """
+    if isinstance(obj, (FrozenDict, FrozenList)):
+        return obj
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """
+    :param obj: A parsed JSON document, frozen or not
+    :return: A copy that can be changed
+    """
+    if isinstance(obj, dict):
+        return dict((k, thaw(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+FROZEN_JSON = {'to': json.dumps, 'from': lambda s: freeze(json.loads(s))}
+
+
 class REST(object):
-    def __init__(self, base_url, entpath='entities', entinfo='entity_info'):
+    def __init__(self, base_url, entpath='entities', entinfo='entity_info',
+                 assigned_ports=None, backend=None):
+        """
+        :param backend: A store, see :py:mod:`oidctest.tt.store`, where
+            the configurations are kept, by default files in entpath
+        """
         self.base_url = base_url
         self.entpath = entpath
         self.entinfo = entinfo
+        self.assigned_ports = assigned_ports
+        self.backend = backend or FileStore(entpath)
+        # (modification time, configuration) per instance
+        self.confs = LRUCache(max_entries=1000, name='entity_conf')
+        # (modification time, template generation, configuration)
+        self.constructed = LRUCache(max_entries=1000,
+                                    name='constructed_conf')
+        self._templates = None
+
+    @property
+    def templates(self):
+        """
+        The files in entinfo, parsed and kept until they change.
+        """
+        if self._templates is None:
+            self._templates = FileSystem(self.entinfo,
+                                         value_conv=FROZEN_JSON)
+        return self._templates
 
     def _cp_dispatch(self, vpath):
         # Only get here if vpath != None
@@ -65,25 +151,74 @@ class REST(object):
     def entity_dir(self, iss):
         return os.path.join(self.entpath, iss)
 
+    def entity_file(self, qiss, qtag):
+        """
+        Find the file where an instance configuration is kept. The issuer
+        ID may have been stored with or without a trailing '/'. Only if the
+        configurations are kept as files.
+
+        :param qiss: OP issuer quote_plus converted
+        :param qtag: test instance tag quote_plus converted
+        :return: file name
+        """
+        uqp, qp = unquote_quote(qiss, qtag)
+        try:
+            return self.backend.file_name(*qp)
+        except KeyError:
+            logger.error('No such file')
+            raise NoSuchFile(self.entity_file_name(*qp))
+
+    def conf_mtime(self, qiss, qtag):
+        """
+        :return: When the configuration was last written or touched, in ns
+        """
+        uqp, qp = unquote_quote(qiss, qtag)
+        try:
+            return self.backend.mtime(*qp)
+        except KeyError:
+            raise NoSuchFile(self.entity_file_name(*qp))
+
+    def touch(self, qiss, qtag):
+        """
+        Mark the configuration as changed without changing it.
+        """
+        uqp, qp = unquote_quote(qiss, qtag)
+        try:
+            self.backend.touch(*qp)
+        except KeyError:
+            raise NoSuchFile(self.entity_file_name(*qp))
+
     def construct_config(self, qiss, qtag):
+        """
+        The test tool configuration of an instance, made from its
+        configuration and the files in entinfo. Made again only when one of
+        them has changed.
+
+        :return: A configuration that the caller may change
+        """
         uqp, qp = unquote_quote(qiss, qtag)
 
         logger.info('construct config iss="{}", tag="{}"'.format(*uqp))
         if not qtag:
             raise Exception('Missing "tag" value')
 
-        _conf = json.loads(
-            open('{}/common.json'.format(self.entinfo), 'r').read())
+        _key = (issuer_key(qp[0]), qp[1])
+        # Before reading, so a change while building is noticed next time
+        _generation = self.templates.generation
+        _mtime = self.conf_mtime(*qp)
+        _cached = self.constructed.get(_key)
+        if _cached and _cached[:2] == (_mtime, _generation):
+            return thaw(_cached[2])
 
-        typ, _econf = self.read_conf(*qp)
+        _conf = thaw(self.templates['common.json'])
+
+        typ, _econf = self._shared_conf(*qp)
 
         if _econf is None:
             raise Exception('No configuration for {}:{}'.format(*uqp))
 
         if do_registration(_econf['tool']['profile']):
-            reg_info = json.loads(
-                open('{}/registration_info.json'.format(
-                    self.entinfo), 'r').read())
+            reg_info = self.templates['registration_info.json']
             _conf['client']['registration_info'] = reg_info['registration_info']
         else:
             try:
@@ -98,23 +233,29 @@ class REST(object):
 
         _conf['tool'] = _econf['tool']
         logger.info("Constructed config: {}".format(_conf))
-        return _conf
+        if not self._racy(_mtime):
+            self.constructed[_key] = (_mtime, _generation, freeze(_conf))
+        return thaw(_conf)
+
+    @staticmethod
+    def _racy(mtime):
+        """
+        Whether the configuration may be changed again without its
+        modification time changing.
+        """
+        return time.time_ns() - mtime < RACY_NS
 
     def list_dir(self, dirname, qiss):
         uqp, qp = unquote_quote(qiss)
         logger.info('List directory: iss="{}"'.format(uqp[0]))
 
-        if not os.path.isdir(dirname):
-            if qp[0].endswith('%2F'):  # try to remove
-                qp[0] = qp[0][:-3]
-            else:  # else add
-                qp[0] += '%2F'
-            dirname = self.entity_file_name(qp[0], '')
-            if not os.path.isdir(dirname):
-                raise ValueError(dirname)
+        try:
+            _tags = self.backend.tags(qp[0])
+        except KeyError:
+            raise ValueError(dirname)
 
         res = ['<p>']
-        for file in os.listdir(dirname):
+        for file in _tags:
             _url = '{}{}/{}'.format(self.base_url, qp[0], quote_plus(file))
             res.append('<a href="{}">{}</a><br>'.format(_url, file))
         res.append('</p')
@@ -134,42 +275,43 @@ class REST(object):
         :param qtag: test instance tag quote_plus converted
         :return: Returns the instance configuration as a dictionary
         """
+        res = self._shared_conf(qiss, qtag)
+        if res is None:
+            return None
+        # A copy the caller may change
+        return res[0], thaw(res[1])
+
+    def _shared_conf(self, qiss, qtag):
+        """
+        As :py:meth:`read_conf` but the configuration is the one that is
+        kept, it can't be changed.
+        """
         uqp, qp = unquote_quote(qiss, qtag)
         logger.info('Read config: iss="{}", tag="{}"'.format(*uqp))
 
-        fname = self.entity_file_name(*qp)
-        if fname:
-            if not os.path.isfile(fname):
-                if qp[0].endswith('%2F'):  # try to remove
-                    qp[0] = qp[0][:-3]
-                else:  # else add
-                    qp[0] += '%2F'
-                fname = self.entity_file_name(qp[0], qp[1])
-                if not os.path.isfile(fname):
-                    logger.error('No such file')
-                    raise NoSuchFile(fname)
-                    # return self.list_dir(fname, qiss)
-
-            try:
-                _data = open(fname, 'r').read()
-            except Exception as err:
-                if sys.version[0] == '2':
-                    if isinstance(err, IOError):
-                        return None
-                    else:
-                        raise NoSuchFile(fname)
-                elif isinstance(err, FileNotFoundError):
-                    return None
-                else:
-                    logger.error('Unable to read from file: {}'.format(fname))
-                    raise NoSuchFile(fname)
-            try:
-                return 'json', json.loads(_data)
-            except Exception as err:
-                logger.error(err)
-                return None
-        else:
+        if not qp[0]:
+            return None
+        _key = (issuer_key(qp[0]), qp[1])
+        try:
+            _mtime = self.backend.mtime(*qp)
+            _cached = self.confs.get(_key)
+            if _cached and _cached[0] == _mtime:
+                return 'json', _cached[1]
+            _data = self.backend.read(*qp)
+        except KeyError:
+            logger.error('No such file')
+            raise NoSuchFile(self.entity_file_name(*qp))
+        except Exception as err:
+            logger.error('Unable to read configuration: {}'.format(err))
+            raise NoSuchFile(self.entity_file_name(*qp))
+        try:
+            _conf = freeze(json.loads(_data))
+        except Exception as err:
+            logger.error(err)
             return None
+        if not self._racy(_mtime):
+            self.confs[_key] = (_mtime, _conf)
+        return 'json', _conf
 
     def read(self, qiss, qtag, path=''):
         """
@@ -180,7 +322,7 @@ class REST(object):
         :return: A HTTP response
         """
         try:
-            typ, info = self.read_conf(qiss, qtag)
+            typ, info = self._shared_conf(qiss, qtag)
         except (TypeError, NoSuchFile):
             if not path:
                 path = '{}/{}'.format(qiss, qtag)
@@ -214,17 +356,13 @@ class REST(object):
             logger.error(_desc)
             return cherrypy.HTTPError(404, _desc)
 
+        # Only written if changed
         try:
-            _js0 = self.read_conf(qiss, qtag)
-        except (TypeError, NoSuchFile):
+            self.backend.replace(qp[0], qp[1], json.dumps(_js))
+        except KeyError:
             path = '{}/{}'.format(qiss, qtag)
             return cherrypy.HTTPError(404, 'Could not find {}'.format(path))
 
-        if _js == _js0:  # don't bother
-            pass
-        else:
-            self.write(qiss, qtag, json.dumps(_js))
-
         return b'OK'
 
     def store(self, qiss, qtag, info):
@@ -263,10 +401,14 @@ class REST(object):
         :param qtag: test instance tag quote_plus converted
         :return: 
         """
-        fname = self.entity_file_name(qiss, qtag)
-        logger.info('Delete configuration file: {}'.format(fname))
-        if os.path.isfile(fname):
-            os.unlink(fname)
+        uqp, qp = unquote_quote(qiss, qtag)
+        logger.info('Delete configuration: {} {}'.format(*uqp))
+        self.backend.delete(*qp)
+        if self.assigned_ports is not None:
+            # The port may have been assigned with or without a trailing '/'
+            _iss = issuer_key(qp[0])
+            for _spelling in [_iss, _iss + '/']:
+                self.assigned_ports.release(quote_plus(_spelling), qp[1])
         # If it doesn't exit don't tell because it leaks information.
         return b'OK'
 
@@ -278,15 +420,13 @@ class REST(object):
         :param qtag: test instance tag quote_plus converted
         :param ent_conf: Test instance configuration
         """
-        fdir = self.entity_dir(qiss)
-        if os.path.isdir(fdir) is False:
-            os.makedirs(fdir)
-
-        fname = os.path.join(fdir, qtag)
-        logger.info('Write configuration file: {}'.format(fname))
-        fp = open(fname, 'w')
         if isinstance(ent_conf, dict):
             ent_conf = json.dumps(ent_conf)
+        self.backend.write(qiss, qtag, ent_conf)
 
-        fp.write(ent_conf)
-        fp.close()
+    def items(self):
+        """
+        :return: dictionary with issuer IDs as keys and lists of tags as
+            values, quote_plus converted
+        """
+        return self.backend.items()
@@ -0,0 +1,290 @@
+"""
+Where the test instance configurations are kept.
+
+Configurations are JSON documents, one per issuer and tag. They are kept
+either as files, entities/<quoted issuer>/<quoted tag>, by a
+:py:class:`FileStore` or in an SQLite database by a
+:py:class:`SQLiteStore`. Both take and return the issuer and tag
+quote_plus converted, the way they appear in URLs and file names.
+
+An issuer may have been given with or without a trailing '/'. The file
+store has to look in two places, the database only keeps the issuer
+without it as its key.
+
+What a store does, a configuration that isn't there is reported by
+raising KeyError:
+
+- read(qiss, qtag): The configuration as a JSON document
+- write(qiss, qtag, conf): Add a configuration or replace one
+- replace(qiss, qtag, conf): Replace an existing configuration, returns
+  True if it changed
+- delete(qiss, qtag)
+- mtime(qiss, qtag): When the configuration was last written or touched,
+  in ns
+- touch(qiss, qtag)
+- issuers(): Sorted list of the issuers with configurations
+- tags(qiss): Sorted list of the tags of an issuer
+- items(): Dictionary with issuers as keys and lists of their tags as
+  values
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote_plus
+from urllib.parse import unquote_plus
+
+from oidctest import dir_index
+
+logger = logging.getLogger(__name__)
+
+
+def issuer_key(qiss):
+    """
+    :param qiss: Issuer ID, quote_plus converted
+    :return: The issuer ID as it is looked up by, not quoted and without
+        trailing '/'
+    """
+    return unquote_plus(qiss).rstrip('/')
+
+
+class FileStore(object):
+    def __init__(self, entpath='entities'):
+        """
+        :param entpath: The directory the configurations are kept in
+        """
+        self.entpath = entpath
+
+    def _dir(self, qiss):
+        _dir = os.path.join(self.entpath, qiss)
+        if os.path.isdir(_dir):
+            return _dir
+
+        # Stored with or without a trailing '/'
+        if qiss.endswith('%2F'):
+            _dir = os.path.join(self.entpath, qiss[:-3])
+        else:
+            _dir = os.path.join(self.entpath, qiss + '%2F')
+        if os.path.isdir(_dir):
+            return _dir
+        raise KeyError(qiss)
+
+    def file_name(self, qiss, qtag):
+        """
+        :return: Name of the file holding the configuration
+        """
+        fname = os.path.join(self._dir(qiss), qtag)
+        if not os.path.isfile(fname):
+            raise KeyError((qiss, qtag))
+        return fname
+
+    def read(self, qiss, qtag):
+        try:
+            with open(self.file_name(qiss, qtag), 'r') as fp:
+                return fp.read()
+        except FileNotFoundError:
+            raise KeyError((qiss, qtag))
+
+    def write(self, qiss, qtag, conf):
+        try:
+            fdir = self._dir(qiss)
+        except KeyError:
+            fdir = os.path.join(self.entpath, qiss)
+            os.makedirs(fdir)
+
+        fname = os.path.join(fdir, qtag)
+        logger.info('Write configuration file: {}'.format(fname))
+        # Never half written
+        _tmp = os.path.join(fdir, '.{}.tmp'.format(qtag))
+        with open(_tmp, 'w') as fp:
+            fp.write(conf)
+        os.replace(_tmp, fname)
+
+    def replace(self, qiss, qtag, conf):
+        if self.read(qiss, qtag) == conf:
+            return False
+        self.write(qiss, qtag, conf)
+        return True
+
+    def delete(self, qiss, qtag):
+        try:
+            fname = self.file_name(qiss, qtag)
+        except KeyError:
+            return
+        os.unlink(fname)
+        # Remove the issuer if out of tags
+        try:
+            os.rmdir(os.path.dirname(fname))
+        except OSError:
+            pass
+
+    def mtime(self, qiss, qtag):
+        try:
+            return os.stat(self.file_name(qiss, qtag)).st_mtime_ns
+        except FileNotFoundError:
+            raise KeyError((qiss, qtag))
+
+    def touch(self, qiss, qtag):
+        os.utime(self.file_name(qiss, qtag), None)
+
+    def issuers(self):
+        return dir_index.listing(self.entpath).dirs
+
+    def tags(self, qiss):
+        return sorted(f for f in os.listdir(self._dir(qiss))
+                      if not f.startswith('.'))
+
+    def items(self):
+        res = {}
+        for qiss in self.issuers():
+            _tags = self.tags(qiss)
+            if _tags:
+                res[qiss] = _tags
+        return res
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entity (
+    iss_key TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    iss TEXT NOT NULL,
+    conf TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (iss_key, tag)
+);
+CREATE INDEX IF NOT EXISTS entity_tag ON entity (tag);
+"""
+
+
+class SQLiteStore(object):
+    def __init__(self, db_name):
+        """
+        :param db_name: The database file, created if it doesn't exist
+        """
+        self.db_name = os.path.abspath(db_name)
+        # One connection per thread
+        self.local = threading.local()
+        self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        try:
+            return self.local.conn
+        except AttributeError:
+            _conn = sqlite3.connect(self.db_name, timeout=30)
+            # Readers don't wait for writers
+            _conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = _conn
+            return _conn
+
+    @staticmethod
+    def _key(qiss, qtag):
+        return issuer_key(qiss), unquote_plus(qtag)
+
+    def _get(self, column, qiss, qtag):
+        _row = self.conn().execute(
+            'SELECT {} FROM entity WHERE iss_key=? AND tag=?'.format(column),
+            self._key(qiss, qtag)).fetchone()
+        if _row is None:
+            raise KeyError((qiss, qtag))
+        return _row[0]
+
+    def read(self, qiss, qtag):
+        return self._get('conf', qiss, qtag)
+
+    def write(self, qiss, qtag, conf):
+        _key = self._key(qiss, qtag)
+        with self.conn() as _conn:
+            # The issuer is shown as it was first given
+            _row = _conn.execute(
+                'SELECT iss FROM entity WHERE iss_key=? LIMIT 1',
+                (_key[0],)).fetchone()
+            _iss = _row[0] if _row else unquote_plus(qiss)
+            _conn.execute(
+                'INSERT OR REPLACE INTO entity (iss_key, tag, iss, conf, '
+                'mtime) VALUES (?, ?, ?, ?, ?)',
+                _key + (_iss, conf, time.time_ns()))
+
+    def replace(self, qiss, qtag, conf):
+        with self.conn() as _conn:
+            _cur = _conn.execute(
+                'UPDATE entity SET conf=?, mtime=? WHERE iss_key=? AND tag=? '
+                'AND conf!=?',
+                (conf, time.time_ns()) + self._key(qiss, qtag) + (conf,))
+            if _cur.rowcount:
+                return True
+        # Either not there or not changed
+        self.read(qiss, qtag)
+        return False
+
+    def delete(self, qiss, qtag):
+        with self.conn() as _conn:
+            _conn.execute('DELETE FROM entity WHERE iss_key=? AND tag=?',
+                          self._key(qiss, qtag))
+
+    def mtime(self, qiss, qtag):
+        return self._get('mtime', qiss, qtag)
+
+    def touch(self, qiss, qtag):
+        with self.conn() as _conn:
+            _cur = _conn.execute(
+                'UPDATE entity SET mtime=? WHERE iss_key=? AND tag=?',
+                (time.time_ns(),) + self._key(qiss, qtag))
+            if not _cur.rowcount:
+                raise KeyError((qiss, qtag))
+
+    def issuers(self):
+        return sorted(quote_plus(_iss) for _iss, in self.conn().execute(
+            'SELECT DISTINCT iss FROM entity'))
+
+    def tags(self, qiss):
+        res = [quote_plus(_tag) for _tag, in self.conn().execute(
+            'SELECT tag FROM entity WHERE iss_key=? ORDER BY tag',
+            (issuer_key(qiss),))]
+        if not res:
+            raise KeyError(qiss)
+        return res
+
+    def items(self):
+        res = {}
+        for _iss, _tag in self.conn().execute(
+                'SELECT iss, tag FROM entity ORDER BY iss_key, tag'):
+            res.setdefault(quote_plus(_iss), []).append(quote_plus(_tag))
+        return res
+
+
+def make_store(entpath='entities', db_name=''):
+    """
+    :param entpath: Directory for the configurations kept as files
+    :param db_name: If given, the configurations are kept in this SQLite
+        database instead
+    :return: A configuration store
+    """
+    if db_name:
+        return SQLiteStore(db_name)
+    return FileStore(entpath)
+
+
+def migrate(src, dst):
+    """
+    Copy all configurations from one store to another.
+
+    :param src: The store to copy from
+    :param dst: The store to copy to
+    :return: Number of configurations copied, list of (issuer, tag) that
+        were left out because they are not JSON documents
+    """
+    n = 0
+    bad = []
+    for qiss, qtags in src.items().items():
+        for qtag in qtags:
+            _conf = src.read(qiss, qtag)
+            try:
+                json.loads(_conf)
+            except ValueError:
+                bad.append((qiss, qtag))
+                continue
+            dst.write(qiss, qtag, _conf)
+            n += 1
+    return n, bad
@@ -0,0 +1,461 @@
+"""
+Starting, keeping track of and stopping test tool instances.
+
+A child is spawned directly (no shell) with the write end of a pipe whose
+file descriptor is given in the environment variable named by READY_FD.
+Once the child is listening it writes one JSON line to that pipe and
+closes it, which is what the supervisor waits for.
+
+A listening socket can also be handed over to the child. As with systemd
+socket activation it is placed at file descriptor 3 and LISTEN_FDS is
+set. The child then calls socket_activated() to make CherryPy use it
+rather than binding the port itself.
+
+If a zygote (see :py:mod:`oidctest.tt.zygote`) is running the children
+are forked by it instead, the readiness notification then arrives on the
+connection to the zygote. If the zygote can not be reached the child is
+spawned as usual.
+"""
+import array
+import fcntl
+import json
+import logging
+import os
+import select
+import socket
+import subprocess
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+READY_FD = 'OIDCTEST_READY_FD'
+LISTEN_FDS_START = 3
+MAX_REQUEST = 65536
+
+
+class StartFailed(Exception):
+    pass
+
+
+def notify_ready(**info):
+    """
+    To be called by a child process when it is ready to serve requests.
+    A no-op if the process was not started by a Supervisor.
+
+    :param info: Information about the child passed back to the supervisor
+    """
+    try:
+        fd = int(os.environ.pop(READY_FD))
+    except (KeyError, ValueError):
+        return
+
+    info['pid'] = os.getpid()
+    try:
+        os.write(fd, '{}\n'.format(json.dumps(info)).encode('utf-8'))
+    except OSError as err:
+        logger.error('Could not notify supervisor: {}'.format(err))
+    finally:
+        os.close(fd)
+
+
+def socket_activated():
+    """
+    To be called by a child process before the CherryPy engine is started.
+
+    :return: True if a listening socket was handed over to us
+    """
+    if os.environ.get('LISTEN_FDS') != '1':
+        return False
+    # What CherryPy looks for, it will then use file descriptor 3
+    os.environ['LISTEN_PID'] = str(os.getpid())
+    return True
+
+
+def _hand_over(fd, keep):
+    """
+    Returns a function that, run in the child between fork and exec,
+    places fd at LISTEN_FDS_START and lets keep survive the exec.
+    Everything else opened by Python is closed on exec anyway.
+    """
+
+    def _preexec():
+        if fd == LISTEN_FDS_START:
+            os.set_inheritable(fd, True)
+        else:
+            os.dup2(fd, LISTEN_FDS_START)
+        os.set_inheritable(keep, True)
+
+    return _preexec
+
+
+class ZygoteUnavailable(Exception):
+    pass
+
+
+def send_request(sock, info, fds=None):
+    """
+    :param sock: Connected unix socket
+    :param info: Dictionary to send
+    :param fds: File descriptors to pass along
+    """
+    data = '{}\n'.format(json.dumps(info)).encode('utf-8')
+    if fds:
+        sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                               array.array('i', fds))])
+    else:
+        sock.sendall(data)
+
+
+def recv_request(sock, maxfds=1):
+    """
+    :param sock: Connected unix socket
+    :param maxfds: Max number of file descriptors expected
+    :return: Tuple of received dictionary and list of file descriptors
+    """
+    fds = array.array('i')
+    msg, ancdata, flags, addr = sock.recvmsg(
+        MAX_REQUEST, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, typ, data in ancdata:
+        if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return json.loads(msg.decode('utf-8')), list(fds)
+
+
+class ForkedProcess(object):
+    """
+    Enough of subprocess.Popen for the supervisor to handle a process that
+    was forked by the zygote and thus is not our child.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        try:
+            self._proc = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            # Already gone, the zygote reaps its children at once
+            self._proc = None
+            self.returncode = 0
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                if self._proc.status() != psutil.STATUS_ZOMBIE:
+                    return None
+            except psutil.NoSuchProcess:
+                pass
+            # The real exit status is only known to the zygote
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self._proc is None:
+            return self.returncode
+        try:
+            self._proc.wait(timeout)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(self.pid, timeout)
+        return self.poll()
+
+    def terminate(self):
+        if self.poll() is None:
+            try:
+                self._proc.terminate()
+            except psutil.NoSuchProcess:
+                pass
+
+    def kill(self):
+        if self.poll() is None:
+            try:
+                self._proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+
+def fork_instance(path, argv, env=None, listen_sock=None, timeout=10):
+    """
+    Ask the zygote for a new test instance.
+
+    :param path: Path of the zygote's unix socket
+    :param argv: The test tool command line
+    :param env: Extra environment variables
+    :param listen_sock: A listening socket to hand over to the instance
+    :param timeout: Seconds to wait for the zygote to answer
+    :return: Tuple of a :py:class:`ForkedProcess` and the file descriptor
+        on which the readiness notification will arrive
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path)
+        if listen_sock is None:
+            send_request(conn, {'argv': argv, 'env': env or {}})
+        else:
+            send_request(conn, {'argv': argv, 'env': env or {}},
+                         [listen_sock.fileno()])
+        # Unbuffered, what follows the first line is for read_ready()
+        data = b''
+        while not data.endswith(b'\n'):
+            _byte = conn.recv(1)
+            if not _byte:
+                break
+            data += _byte
+        resp = json.loads(data.decode('utf-8'))
+        proc = ForkedProcess(resp['pid'])
+    except (OSError, ValueError, KeyError) as err:
+        conn.close()
+        raise ZygoteUnavailable('{}: {}'.format(path, err))
+    return proc, conn.detach()
+
+
+class Child(object):
+    def __init__(self, key, proc, port):
+        self.key = key
+        self.proc = proc
+        self.port = port
+        self.started = time.time()
+        self.ready_at = 0
+        self.info = {}
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    @property
+    def latency(self):
+        """Seconds from spawn until the child reported it was ready."""
+        if self.ready_at:
+            return self.ready_at - self.started
+        return None
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+
+def read_ready(fd, timeout):
+    """
+    Wait for the readiness message on the read end of the pipe.
+
+    :param fd: File descriptor
+    :param timeout: Max seconds to wait
+    :return: The message as a dictionary, None if the child closed the pipe
+        without writing anything.
+    """
+    _deadline = time.time() + timeout
+    data = b''
+    while not data.endswith(b'\n'):
+        _left = _deadline - time.time()
+        if _left <= 0:
+            raise StartFailed('No readiness notification within {} '
+                              'seconds'.format(timeout))
+        readable, _, _ = select.select([fd], [], [], _left)
+        if not readable:
+            continue
+        _chunk = os.read(fd, 4096)
+        if not _chunk:  # EOF
+            break
+        data += _chunk
+
+    if not data:
+        return None
+    try:
+        info = json.loads(data.decode('utf-8'))
+    except ValueError as err:
+        raise StartFailed('Bad readiness notification {!r}: {}'.format(
+            data[:200], err))
+    if not isinstance(info, dict):
+        raise StartFailed('Bad readiness notification {!r}'.format(
+            data[:200]))
+    return info
+
+
+class Supervisor(object):
+    """
+    Keeps a table of the running children keyed by instance identifier.
+    """
+
+    def __init__(self, ready_timeout=10, stop_timeout=5, zygote=None):
+        """
+        :param ready_timeout: Seconds to wait for a child to become ready
+        :param stop_timeout: Seconds to wait for a child to terminate
+        :param zygote: Path of the socket of a zygote that should be asked
+            to fork the children, see :py:mod:`oidctest.tt.zygote`.
+        """
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.zygote = zygote
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def spawn(self, args, env=None, listen_sock=None):
+        """
+        Start a new interpreter running the command line.
+
+        :return: Tuple of a subprocess.Popen instance and the file
+            descriptor on which the readiness notification will arrive
+        """
+        rfd, _wfd = os.pipe()
+        # Keep clear of the file descriptor a handed over socket goes to
+        wfd = fcntl.fcntl(_wfd, fcntl.F_DUPFD_CLOEXEC, LISTEN_FDS_START + 1)
+        os.close(_wfd)
+
+        _env = dict(os.environ)
+        if env:
+            _env.update(env)
+        _env[READY_FD] = str(wfd)
+
+        if listen_sock is None:
+            kwargs = {'pass_fds': (wfd,), 'close_fds': True}
+        else:
+            _env['LISTEN_FDS'] = '1'
+            kwargs = {'preexec_fn': _hand_over(listen_sock.fileno(), wfd),
+                      'close_fds': False}
+
+        try:
+            proc = subprocess.Popen(args, env=_env, start_new_session=True,
+                                    **kwargs)
+        except OSError as err:
+            os.close(rfd)
+            raise StartFailed('Could not spawn {}: {}'.format(args[0], err))
+        finally:
+            os.close(wfd)
+        return proc, rfd
+
+    def start(self, key, args, port, env=None, listen_sock=None):
+        """
+        Spawn a child, or have the zygote fork one, and wait for it to
+        become ready.
+
+        :param key: Instance identifier
+        :param args: Command line, a list of strings
+        :param port: The port the child will listen on
+        :param env: Extra environment variables
+        :param listen_sock: A listening socket to hand over to the child
+        :return: A :py:class:`Child` instance
+        """
+        _started = time.time()
+        proc = None
+        if self.zygote:
+            try:
+                proc, rfd = fork_instance(self.zygote, args, env, listen_sock,
+                                          self.ready_timeout)
+            except ZygoteUnavailable as err:
+                logger.warning('Starting {} from scratch: {}'.format(key,
+                                                                     err))
+        if proc is None:
+            proc, rfd = self.spawn(args, env, listen_sock)
+
+        child = Child(key, proc, port)
+        child.started = _started
+        with self.lock:
+            self.children[key] = child
+
+        try:
+            info = read_ready(rfd, self.ready_timeout)
+        except StartFailed:
+            # Don't leave it running, holding the port
+            self._discard(child)
+            raise
+        finally:
+            os.close(rfd)
+
+        if info is None:
+            # The pipe is closed when the child exits
+            try:
+                proc.wait(self.stop_timeout)
+            except subprocess.TimeoutExpired:
+                pass
+            self.reap()
+            raise StartFailed('{} exited with {} before it was ready'.format(
+                key, proc.returncode))
+
+        child.info = info
+        child.ready_at = time.time()
+        logger.info('{} ready, pid: {}, start latency: {:.3f}s'.format(
+            key, child.pid, child.latency))
+        return child
+
+    def _discard(self, child):
+        with self.lock:
+            if self.children.get(child.key) is child:
+                del self.children[child.key]
+        self._terminate(child)
+
+    def _terminate(self, child):
+        if child.is_alive():
+            child.proc.terminate()
+        try:
+            child.proc.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning('{} did not terminate, killing it'.format(
+                child.key))
+            child.proc.kill()
+            child.proc.wait()
+
+    def stop(self, key):
+        """
+        Stop a child started by this supervisor.
+
+        :param key: Instance identifier
+        :return: True if there was such a child
+        """
+        with self.lock:
+            child = self.children.pop(key, None)
+
+        if child is None:
+            return False
+
+        if child.is_alive():
+            self._terminate(child)
+        return True
+
+    def reap(self):
+        """
+        Forget about children that has exited.
+        """
+        with self.lock:
+            for key, child in list(self.children.items()):
+                if not child.is_alive():
+                    logger.info('{} (pid {}) exited with {}'.format(
+                        key, child.pid, child.proc.returncode))
+                    del self.children[key]
+
+    def pids(self):
+        """
+        :return: Dictionary with instance identifier as key and process ID
+            as value for all the running children
+        """
+        self.reap()
+        with self.lock:
+            return dict([(k, c.pid) for k, c in self.children.items()])
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.children
+
+    def stop_all(self):
+        for key in list(self.children.keys()):
+            self.stop(key)
+
+
+def kill_pid(pid, timeout=5):
+    """
+    Stop a process this supervisor did not start, for instance one that
+    was running before the config server was restarted.
+
+    :param pid: Process ID
+    :param timeout: Seconds to wait before resorting to SIGKILL
+    """
+    try:
+        proc = psutil.Process(pid)
+        proc.terminate()
+        proc.wait(timeout)
+    except psutil.NoSuchProcess:
+        pass
+    except psutil.TimeoutExpired:
+        proc.kill()
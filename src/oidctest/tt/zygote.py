@@ -0,0 +1,127 @@
+"""
+A warm parent process that forks test instances.
+
+Starting a test instance from scratch means starting a new interpreter,
+importing oic, otest, Cryptodome, mako and CherryPy and reading all the
+flow descriptions. The zygote does all that once and then forks a child
+per test instance, which only has to apply the instance configuration.
+
+The zygote listens on a unix socket. A request is one JSON line with the
+test tool command line (argv) and extra environment variables (env),
+possibly accompanied by a listening socket passed as SCM_RIGHTS. The
+zygote answers with a line holding the pid of the forked child. The
+child then sends its readiness notification on the same connection, see
+:py:func:`oidctest.tt.supervisor.notify_ready`.
+"""
+import logging
+import os
+import signal
+import socket
+
+from oidctest.tt.control import CONTROL_DIR
+from oidctest.tt.supervisor import LISTEN_FDS_START
+from oidctest.tt.supervisor import READY_FD
+from oidctest.tt.supervisor import notify_ready
+from oidctest.tt.supervisor import recv_request
+from oidctest.tt.supervisor import send_request
+
+logger = logging.getLogger(__name__)
+
+ZYGOTE_PATH = os.path.join(CONTROL_DIR, 'zygote.sock')
+
+
+def zygote_path(ctldir=CONTROL_DIR):
+    return os.path.join(ctldir, 'zygote.sock')
+
+
+class Zygote(object):
+    def __init__(self, path, run, listen_fd=None):
+        """
+        :param path: Path of the unix socket to listen on
+        :param run: Function run in the forked child with the command line
+            as argument
+        :param listen_fd: A file descriptor held at LISTEN_FDS_START for
+            sockets handed over to children. If not given, requests that
+            come with a socket are refused.
+        """
+        self.path = path
+        self.run = run
+        self.listen_fd = listen_fd
+        self.listener = None
+
+    def serve_forever(self):
+        # Forked children are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+        _dir = os.path.dirname(self.path)
+        if _dir and not os.path.isdir(_dir):
+            os.makedirs(_dir)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(16)
+        logger.info('Zygote listening on {}'.format(self.path))
+        notify_ready(zygote=self.path)
+
+        while True:
+            conn, _ = self.listener.accept()
+            try:
+                self.handle(conn)
+            except Exception as err:
+                logger.exception('Zygote request failed: {}'.format(err))
+            finally:
+                conn.close()
+
+    def handle(self, conn):
+        request, fds = recv_request(conn)
+        try:
+            if fds and self.listen_fd != LISTEN_FDS_START:
+                send_request(conn, {'error': 'Can not hand over sockets'})
+                return
+
+            # The child waits for the pid to be sent before it can say
+            # it is ready on the same connection
+            gate_r, gate_w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(gate_w)
+                self.child(conn, gate_r, request, fds)
+
+            os.close(gate_r)
+            send_request(conn, {'pid': pid})
+            os.close(gate_w)
+            logger.info('Forked {}: {}'.format(pid, ' '.join(
+                request['argv'])))
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def child(self, conn, gate_r, request, fds):
+        code = 1
+        try:
+            os.setsid()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self.listener.close()
+            os.read(gate_r, 1)
+            os.close(gate_r)
+
+            os.environ.update(request.get('env', {}))
+            if fds:
+                os.dup2(fds[0], LISTEN_FDS_START)
+                os.close(fds[0])
+                os.environ['LISTEN_FDS'] = '1'
+            os.environ[READY_FD] = str(conn.detach())
+
+            self.run(request['argv'])
+            code = 0
+        except SystemExit as err:
+            if isinstance(err.code, int):
+                code = err.code
+        except Exception as err:
+            logger.exception('Test instance failed: {}'.format(err))
+        finally:
+            os._exit(code)
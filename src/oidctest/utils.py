@@ -1,10 +1,8 @@
 from future.backports.urllib.parse import quote_plus
 
-import gzip
 import logging
 import os
 import pkgutil
-import shutil
 import tarfile
 import time
 
@@ -14,6 +12,9 @@ from otest import check as o_check
 # from urllib.parse import quote_plus
 from otest.prof_util import from_profile
 
+from oidctest.archive import dir_members
+from oidctest.archive import tar_stream
+from oidctest.archive import write_archive
 from oidctest.op import check as op_check
 
 __author__ = 'roland'
@@ -72,50 +73,21 @@ def create_tar_archive(issuer, test_profile):
 
 
 def create_rp_tar_archive(userid, backup=False):
-    # links all the logfiles in log/<tester_id>/<test_id> to
-    # tar/<tester_id>/<test_id>
-    # mk_tardir('backup', userid)
+    # archives all the logfiles in log/<tester_id>, a backup is written to
+    # backup/<tester_id>/
 
     wd = os.getcwd()
+    _stream = tar_stream(dir_members(os.path.join(wd, 'log', userid),
+                                     '{}/'.format(userid)),
+                         compress=True)
     if backup:
-        _dir = os.path.join(wd, "backup", userid)
-        tname = "{}.{}.tar".format(userid, time.time())
-        #tpath = '{}/{}'.format('backup', tname)
-    else:
-        _dir = os.path.join(wd, "tar")
-        tname = "{}.tar".format(userid)
-        #tpath = '{}/{}'.format('tar', tname)
-
-    if not os.path.isdir(_dir):
-        os.makedirs(_dir)
-
-    os.chdir(_dir)
-
-    # if not os.path.isdir(userid):
-    #     return None
-
-    tar = tarfile.open(tname, "w")
-
-    os.chdir(os.path.join(wd, 'log'))
-    for item in os.listdir(userid):
-        if item.startswith("."):
-            continue
-
-        fn = os.path.join(userid, item)
-
-        if os.path.isfile(fn):
-            tar.add(fn)
-    tar.close()
-
-    os.chdir(_dir)
-    with open(tname, 'rb') as f_in:
-        with gzip.open('{}.gz'.format(tname), 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-    _zipped = open('{}.gz'.format(tname), 'rb').read()
-    os.chdir(wd)
+        tname = "{}.{}.tar.gz".format(userid, time.time())
+        return write_archive(os.path.join(wd, "backup", userid, tname),
+                             _stream)
 
-    resp = Response(_zipped, content='application/x-gzip')
+    # Sent as it is made
+    resp = Response(_stream, content='application/x-gzip',
+                    response=lambda message, **kwargs: message)
     return resp
 
 
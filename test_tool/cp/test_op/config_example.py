@@ -17,7 +17,36 @@ BASE_URL = 'http://localhost'
 ENT_PATH = 'entities'
 ENT_INFO = 'entity_info'
 
+# Keep the test instance configurations in this SQLite database instead of
+# as files in ENT_PATH. tool/migrate_entities.py copies them over.
+# ENT_DB = 'entities.db'
+
+# Earlier versions of the configurations, kept in the backup directory.
+# At least BACKUP_KEEP versions per test instance are kept and older ones
+# for BACKUP_MAX_AGE seconds, 0 means no limit.
+# BACKUP_KEEP = 20
+# BACKUP_MAX_AGE = 90 * 86400
+
 FLOWDIR = 'flows'
 
 PATH2PORT = 'path2port.csv'
 TEST_SCRIPT = './op_test_tool.py'
+
+# If True all test instances are run by one op_test_multi.py process and
+# reached through the paths in PATH2PORT instead of one process per port.
+MULTI_TENANT = False
+
+# Test instances that has not been used for this many seconds are stopped.
+# The config server listens on their ports and starts them again on the
+# next connection. 0 means never.
+IDLE_TIMEOUT = 0
+
+# A script that imports the test tool and reads the flows once and then
+# forks test instances on request, which is a lot faster than starting
+# them from scratch. '' means start every instance from scratch.
+ZYGOTE = ''
+# ZYGOTE = './op_test_zygote.py'
+
+# How many test instances /bulk/run and tool/bulk.py handle at the same
+# time, that is how many may be down at once during a bulk restart.
+BULK_WORKERS = 4
@@ -5,6 +5,7 @@ import os
 import sys
 
 import cherrypy
+from cherrypy.process.plugins import Monitor
 
 from oidctest.cp import dump_log
 from oidctest.cp.log_handler import OPLog
@@ -12,9 +13,13 @@ from oidctest.cp.log_handler import OPTar
 from oidctest.file_system import FileSystem
 from oidctest.tt.action import Action
 from oidctest.tt.app import Application
+from oidctest.tt.bulk import Bulk
 from oidctest.tt.entity import Entity
+from oidctest.tt.hibernate import Hibernator
+from oidctest.tt.history import ConfigHistory
 from oidctest.tt.instance import Instance
 from oidctest.tt.rest import REST
+from oidctest.tt.store import make_store
 from oidctest.ass_port import AssignedPorts
 
 logger = logging.getLogger("")
@@ -113,25 +118,87 @@ if __name__ == '__main__':
     else:
         _base_url = _conf.BASE_URL
 
-    rest = REST(_base_url)
-
     _assigned_ports = AssignedPorts('assigned_ports.json', _conf.PORT_MIN,
                                     _conf.PORT_MAX)
     _assigned_ports.load()
 
+    try:
+        _ent_db = _conf.ENT_DB
+    except AttributeError:
+        _ent_db = ''
+    rest = REST(_base_url, assigned_ports=_assigned_ports,
+                backend=make_store(_conf.ENT_PATH, _ent_db))
+
     _vers = get_version()
 
-    cherrypy.tree.mount(
-        Entity(_conf.ENT_PATH, _html, rest, _assigned_ports, _ttc.BASE,
-               version=_vers), '/entity')
+    # All test instances hosted by one op_test_multi.py process
+    try:
+        _multi_tenant = _conf.MULTI_TENANT
+    except AttributeError:
+        _multi_tenant = False
+
+    if _multi_tenant:
+        _path2port = _conf.PATH2PORT
+    else:
+        _path2port = None
+
+    # Warm process that forks the test instances
+    try:
+        _zygote = _conf.ZYGOTE
+    except AttributeError:
+        _zygote = ''
+
     _app = Application(_conf.TEST_SCRIPT, _conf.FLOWDIR, rest,
                        _assigned_ports, _ttc.BASE, args.test_tool_conf,
-                       args.htmldir)
+                       args.htmldir, path2port=_path2port,
+                       multi_tenant=_multi_tenant, zygote=_zygote)
+
+    if _zygote and not _multi_tenant:
+        _app.start_zygote()
+        cherrypy.engine.subscribe('stop', _app.stop_zygote)
+
+    # Seconds without requests before a test instance is put to sleep
+    try:
+        _idle_timeout = _conf.IDLE_TIMEOUT
+    except AttributeError:
+        _idle_timeout = 0
+
+    if _idle_timeout and not _multi_tenant:
+        _app.hibernator = Hibernator(cherrypy.engine, _app, _idle_timeout)
+        _app.hibernator.subscribe()
+        Monitor(cherrypy.engine, _app.hibernator.check, frequency=60,
+                name='Hibernation').subscribe()
+    # How many earlier versions of a configuration are kept and for how
+    # long, 0 means no limit
+    try:
+        _backup_keep = _conf.BACKUP_KEEP
+    except AttributeError:
+        _backup_keep = 0
+    try:
+        _backup_max_age = _conf.BACKUP_MAX_AGE
+    except AttributeError:
+        _backup_max_age = 0
+
+    _history = ConfigHistory('backup', keep=_backup_keep,
+                             max_age=_backup_max_age)
+    Monitor(cherrypy.engine, _history.collect, frequency=86400,
+            name='HistoryCollect').subscribe()
+    cherrypy.tree.mount(
+        Entity(_conf.ENT_PATH, _html, rest, _assigned_ports, _ttc.BASE,
+               version=_vers, app=_app, history=_history), '/entity')
     cherrypy.tree.mount(
         Action(rest, _ttc, _html, _conf.ENT_PATH, _conf.ENT_INFO, tool_params,
                _app, version=_vers),
         '/action')
 
+    # Max number of test instances restarted at the same time
+    try:
+        _bulk_workers = _conf.BULK_WORKERS
+    except AttributeError:
+        _bulk_workers = 4
+    cherrypy.tree.mount(Bulk(_app, rest.backend, workers=_bulk_workers),
+                        '/bulk')
+
     log_root = os.path.join(folder, 'log')
     _tar = OPTar(log_root)
     cherrypy.tree.mount(_tar, '/mktar')
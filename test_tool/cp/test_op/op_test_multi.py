@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Runs all the OP test instances in one process. Every instance is
+reachable under the path the path2port map binds to its assigned port.
+"""
+import importlib
+import logging
+import os
+import sys
+
+import cherrypy
+from cherrypy.process.plugins import Monitor
+
+from oidctest.ass_port import AssignedPorts
+from oidctest.cp import dump_log
+from oidctest.cp.log_handler import OPLog
+from oidctest.cp.log_handler import OPTar
+from oidctest.file_system import FileSystem
+from oidctest.optt.tenant import MultiTenant
+from oidctest.tt.rest import REST
+from oidctest.tt.store import make_store
+
+logger = logging.getLogger("")
+LOGFILE_NAME = 'op_test.log'
+hdlr = logging.FileHandler(LOGFILE_NAME)
+base_formatter = logging.Formatter(
+    "%(asctime)s %(name)s:%(levelname)s %(message)s")
+
+hdlr.setFormatter(base_formatter)
+logger.addHandler(hdlr)
+logger.setLevel(logging.DEBUG)
+
+
+def get_version():
+    sys.path.insert(0, ".")
+    vers = importlib.import_module('version')
+    return vers.VERSION
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-f', dest='flowdir',
+        help="A directory that contains the flow definitions for all the tests")
+    parser.add_argument('-p', dest='port', type=int, default=443,
+                        help="Which port the server should listen on")
+    parser.add_argument('-H', dest='htmldir',
+                        help="Root directory for the HTML template files")
+    parser.add_argument('-S', dest='staticdir', default='static',
+                        help="Directory where static files are kept")
+    parser.add_argument('-s', dest='tls', action='store_true',
+                        help="Whether the server should support incoming HTTPS")
+    parser.add_argument(
+        '-m', dest='path2port', required=True,
+        help="CSV file containing the path-to-port mapping. The path is "
+             "where a test instance is to be found.")
+    parser.add_argument('-c', dest='server_conf', required=True,
+                        help="The config server configuration, used to find "
+                             "the assigned ports")
+    parser.add_argument('-I', dest='idle', type=int, default=3600,
+                        help="Seconds before an idle test instance is evicted")
+    parser.add_argument('-N', dest='max_instances', type=int, default=0,
+                        help="Max number of test instances kept in memory")
+    parser.add_argument(dest="config")
+    args = parser.parse_args()
+
+    _vers = get_version()
+
+    cherrypy.tools.dumplog = cherrypy.Tool('before_finalize', dump_log)
+
+    cherrypy.config.update(
+        {'environment': 'production',
+         'log.error_file': 'site.log',
+         'tools.trailing_slash.on': False,
+         'log.screen': True,
+         'tools.sessions.on': True,
+         'tools.encode.on': True,
+         'tools.encode.encoding': 'utf-8',
+         'tools.dumplog.on': True,
+         'server.socket_host': '0.0.0.0',  # listen on all interfaces
+         'server.socket_port': args.port
+         })
+
+    folder = os.path.abspath(os.curdir)
+
+    provider_config = {
+        '/': {
+            'root_path': 'localhost',
+            'tools.staticdir.root': folder,
+        },
+        '/static': {
+            'tools.staticdir.dir': args.staticdir,
+            'tools.staticdir.on': True,
+        },
+        '/favicon.ico':
+        {
+            'tools.staticfile.on': True,
+            'tools.staticfile.filename': os.path.join(folder, 'static/favicon.ico')
+        },
+        '/robots.txt':
+        {
+            'tools.staticfile.on': True,
+            'tools.staticfile.filename': os.path.join(folder, 'static/robots.txt')
+        }
+    }
+
+    _conf = importlib.import_module(args.config)
+    _srv_conf = importlib.import_module(args.server_conf)
+
+    if args.htmldir:
+        _html = FileSystem(args.htmldir)
+    else:
+        _html = FileSystem(_conf.PRE_HTML)
+    _html.sync()
+
+    _assigned_ports = AssignedPorts('assigned_ports.json', _srv_conf.PORT_MIN,
+                                    _srv_conf.PORT_MAX)
+    _assigned_ports.load()
+
+    try:
+        _ent_db = _srv_conf.ENT_DB
+    except AttributeError:
+        _ent_db = ''
+    rest = REST('', _srv_conf.ENT_PATH, _srv_conf.ENT_INFO,
+                backend=make_store(_srv_conf.ENT_PATH, _ent_db))
+
+    tenants = MultiTenant(_conf, rest, _html, _assigned_ports, args.path2port,
+                          args.flowdir, _vers, staticdir=args.staticdir,
+                          tls=args.tls, idle_timeout=args.idle,
+                          max_instances=args.max_instances)
+    Monitor(cherrypy.engine, tenants.evict_idle, frequency=60,
+            name='TenantEviction').subscribe()
+
+    log_root = os.path.join(folder, 'log')
+    _tar = OPTar(folder)
+    cherrypy.tree.mount(_tar, '/mktar')
+    cherrypy.tree.mount(_tar, '/backup')
+    cherrypy.tree.mount(OPLog(log_root, _html, version=_vers), '/log')
+
+    cherrypy.tree.mount(tenants, '/', provider_config)
+
+    # If HTTPS
+    if args.tls:
+        cherrypy.config.update({'cherrypy.server.ssl_module': 'builtin'})
+        cherrypy.server.ssl_certificate = _conf.SERVER_CERT
+        cherrypy.server.ssl_private_key = _conf.SERVER_KEY
+        if _conf.CA_BUNDLE:
+            cherrypy.server.ssl_certificate_chain = _conf.CA_BUNDLE
+
+    cherrypy.engine.start()
+    cherrypy.engine.block()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import importlib
 import logging
 import os
@@ -7,28 +8,20 @@ import traceback
 from urllib.parse import quote_plus
 
 import cherrypy
-#from oic.oic import Client
-from oic.oic.message import factory as oic_message_factory
-from otest.aus.client import Factory
-from otest.aus.handling_ph import WebIh
-from otest.conf_setup import construct_app_args
 from otest.utils import SERVER_LOG_FOLDER
 from otest.utils import setup_logging
 
 from oidctest.cp import dump_log
 from oidctest.cp.log_handler import OPLog
 from oidctest.cp.log_handler import OPTar
-from oidctest.op import check
-from oidctest.op import func
-from oidctest.op import oper
-from oidctest.op import profiles
-from oidctest.op.client import Client
-from oidctest.op.profiles import PROFILEMAP
-from oidctest.optt import Main
-from oidctest.prof_util import ProfileHandler
-from oidctest.session import SessionHandler
-from oidctest.tool import WebTester
+from oidctest.optt.tenant import make_main
+from oidctest.tt.control import CONTROL_DIR
+from oidctest.tt.control import ControlChannel
+from oidctest.tt.control import control_path
 from oidctest.tt.rest import REST
+from oidctest.tt.store import make_store
+from oidctest.tt.supervisor import notify_ready
+from oidctest.tt.supervisor import socket_activated
 from oidctest.file_system import FileSystem
 
 logger = logging.getLogger("")
@@ -42,52 +35,30 @@ logger.addHandler(hdlr)
 logger.setLevel(logging.DEBUG)
 
 
-def pick_grp(name):
-    return name.split('-')[1]
-
-
 def get_version():
     sys.path.insert(0, ".")
     vers = importlib.import_module('version')
     return vers.VERSION
 
 
-def make_webenv(config, rest):
+def make_root(args, config, rest, html, version, flows=None):
     if args.tag:
         qtag = quote_plus(args.tag)
     else:
         qtag = 'default'
 
-    ent_conf = None
+    setup_logging("%s/rp_%s.log" % (SERVER_LOG_FOLDER, args.port), logger)
+
     try:
-        ent_conf = rest.construct_config(quote_plus(args.issuer), qtag)
+        return make_main(args, config, rest, html, version, flows)
     except Exception as err:
         print('iss:{}, tag:{}'.format(quote_plus(args.issuer), qtag))
         for m in traceback.format_exception(*sys.exc_info()):
             print(m)
         exit()
 
-    setup_logging("%s/rp_%s.log" % (SERVER_LOG_FOLDER, args.port), logger)
-    logger.info('construct_app_args')
-
-    _path, app_args = construct_app_args(args, config, oper, func, profiles,
-                                         ent_conf)
-
-    # Application arguments
-    app_args.update(
-        {"msg_factory": oic_message_factory, 'profile_map': PROFILEMAP,
-         'profile_handler': ProfileHandler,
-         'client_factory': Factory(Client)})
-
-    if args.insecure:
-        app_args['client_info']['verify_ssl'] = False
-
-    return app_args
-
-
-if __name__ == '__main__':
-    import argparse
 
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '-k', dest='insecure', action='store_true',
@@ -118,10 +89,28 @@ if __name__ == '__main__':
         '-m', dest='path2port',
         help="CSV file containing the path-to-port mapping that the reverse "
              "proxy (if used) is using")
+    parser.add_argument(
+        '-C', dest='ctldir', default=CONTROL_DIR,
+        help="Directory where the control channel socket is placed")
+    parser.add_argument(
+        '-e', dest='entdb', default='',
+        help="SQLite database with the test instance configurations, if "
+             "they are not kept as files")
 
     parser.add_argument(dest="config")
-    args = parser.parse_args()
+    return parser
 
+
+def run(args, html=None, flows=None):
+    """
+    Run a test instance until it is stopped.
+
+    :param args: The parsed command line arguments
+    :param html: FileSystem instance holding the HTML templates, read from
+        disc if not given
+    :param flows: Preloaded flow descriptions, see
+        :py:func:`oidctest.optt.tenant.load_flows`
+    """
     _vers = get_version()
 
     cherrypy.tools.dumplog = cherrypy.Tool('before_finalize', dump_log)
@@ -184,23 +173,17 @@ if __name__ == '__main__':
     }
 
     _conf = importlib.import_module(args.config)
-    if args.htmldir:
+    if html:
+        _html = html
+    elif args.htmldir:
         _html = FileSystem(args.htmldir)
+        _html.sync()
     else:
         _html = FileSystem(_conf.PRE_HTML)
-    _html.sync()
-
-    rest = REST('')
-    webenv = make_webenv(_conf, rest)
+        _html.sync()
 
-    session_handler = SessionHandler(args.issuer, args.tag,
-                                     flows=webenv['flow_state'], rest=rest,
-                                     version=_vers, **webenv)
-    session_handler.iss = args.issuer
-    session_handler.tag = args.tag
-    info = WebIh(session=session_handler, pre_html=_html, **webenv)
-    tester = WebTester(info, session_handler, flows=webenv['flow_state'],
-                       check_factory=check.factory, **webenv)
+    rest = REST('', backend=make_store(db_name=args.entdb))
+    main = make_root(args, _conf, rest, _html, _vers, flows)
 
     log_root = os.path.join(folder, 'log')
     _tar = OPTar(folder)
@@ -209,9 +192,7 @@ if __name__ == '__main__':
     cherrypy.tree.mount(OPLog(log_root, _html, version=_vers,
                               iss=args.issuer, tag=args.tag), '/log')
 
-    cherrypy.tree.mount(
-        Main(tester, webenv['flow_state'], webenv, pick_grp), '/',
-        provider_config)
+    cherrypy.tree.mount(main, '/', provider_config)
 
     # If HTTPS
     if args.tls:
@@ -221,5 +202,24 @@ if __name__ == '__main__':
         if _conf.CA_BUNDLE:
             cherrypy.server.ssl_certificate_chain = _conf.CA_BUNDLE
 
+    _ctl = ControlChannel(cherrypy.engine,
+                          control_path(args.port, args.ctldir),
+                          port=args.port, iss=args.issuer, tag=args.tag,
+                          flows=len(list(main.flows.keys())))
+    _ctl.subscribe()
+    # So the config server can tell how long we have been idle
+    cherrypy.tools.touch = cherrypy.Tool('on_start_resource', _ctl.touch)
+    cherrypy.config.update({'tools.touch.on': True})
+
+    # Woken up from hibernation, the port is already bound
+    if socket_activated():
+        logger.info('Using listening socket handed over by the config server')
+
     cherrypy.engine.start()
+    # Tell the config server, if it started us, that we are listening
+    notify_ready(**_ctl.status())
     cherrypy.engine.block()
+
+
+if __name__ == '__main__':
+    run(make_parser().parse_args())
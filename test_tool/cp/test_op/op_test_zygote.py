@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Imports the test tool and reads the flow definitions and HTML templates
+once and then forks test instances when the config server asks for them.
+"""
+import os
+
+# Must come before anything else opens a file. A listening socket handed
+# over to a test instance has to end up at file descriptor 3.
+_fd3 = os.open(os.devnull, os.O_RDONLY)
+
+import argparse
+import importlib
+import sys
+
+sys.path.insert(0, '.')
+
+import op_test_tool
+from oidctest.file_system import FileSystem
+from oidctest.optt.tenant import load_flows
+from oidctest.tt.zygote import ZYGOTE_PATH
+from oidctest.tt.zygote import Zygote
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '-f', dest='flowdir',
+    help="A directory that contains the flow definitions for all the tests")
+parser.add_argument('-H', dest='htmldir',
+                    help="Root directory for the HTML template files")
+parser.add_argument('-z', dest='path', default=ZYGOTE_PATH,
+                    help="Path of the unix socket to listen on")
+parser.add_argument(dest="config")
+args = parser.parse_args()
+
+_conf = importlib.import_module(args.config)
+
+_htmldir = args.htmldir or _conf.PRE_HTML
+_html = FileSystem(_htmldir)
+_html.sync()
+
+_flowdir = args.flowdir or _conf.FLOWDIR
+_flows = load_flows(_flowdir)
+
+_parser = op_test_tool.make_parser()
+
+
+def run(argv):
+    _args = _parser.parse_args(argv[1:])
+
+    # Only use what was read here if the instance is set up the same way
+    if (_args.htmldir or _conf.PRE_HTML) == _htmldir:
+        html = _html
+    else:
+        html = None
+
+    if _args.flowdir == _flowdir:
+        flows = _flows
+    else:
+        flows = None
+
+    op_test_tool.run(_args, html=html, flows=flows)
+
+
+if __name__ == '__main__':
+    Zygote(args.path, run, listen_fd=_fd3).serve_forever()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Compares how long it takes before a test instance is ready when it is
+started from scratch and when it is forked by the zygote.
+
+Run from the test_op directory with the config server stopped, the
+instance uses its ordinary port.
+"""
+import argparse
+import importlib
+import statistics
+import time
+from urllib.parse import quote_plus
+
+from oidctest.ass_port import AssignedPorts
+from oidctest.tt.app import Application
+from oidctest.tt.rest import REST
+from oidctest.tt.store import make_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-c', dest='test_tool_conf')
+parser.add_argument('-i', dest='iss')
+parser.add_argument('-t', dest='tag', default='default')
+parser.add_argument('-n', dest='runs', type=int, default=10)
+parser.add_argument('-z', dest='zygote', default='./op_test_zygote.py')
+parser.add_argument(dest="config")
+args = parser.parse_args()
+
+_conf = importlib.import_module(args.config)
+_ttc = importlib.import_module(args.test_tool_conf)
+
+try:
+    _ent_db = _conf.ENT_DB
+except AttributeError:
+    _ent_db = ''
+rest = REST(_conf.BASE_URL,  # Base URL just place holder
+            backend=make_store(_conf.ENT_PATH, _ent_db))
+
+_assigned_ports = AssignedPorts('assigned_ports.json', _conf.PORT_MIN,
+                                _conf.PORT_MAX)
+_assigned_ports.load()
+
+_app = Application(_conf.TEST_SCRIPT, _conf.FLOWDIR, rest, _assigned_ports,
+                   _ttc.BASE, args.test_tool_conf, '', ready_timeout=60,
+                   zygote=args.zygote)
+
+_iss = quote_plus(args.iss)
+_tag = quote_plus(args.tag)
+_key = _app.key(_iss, _tag)
+_port = _assigned_ports.register_port(_iss, _tag)
+_cmd = _app.test_instance_args(_iss, _tag, _port)
+
+# Not to have anything else running on the port
+_app.stop_test_instance(_iss, _tag)
+
+
+def measure(runs):
+    latencies = []
+    for i in range(runs):
+        child = _app.supervisor.start(_key, _cmd, _port)
+        latencies.append(child.latency)
+        _app.supervisor.stop(_key)
+        # Let the port be released
+        time.sleep(0.5)
+    return latencies
+
+
+def report(name, latencies):
+    print('{:8} min {:.3f}s  median {:.3f}s  mean {:.3f}s  ({} runs)'.format(
+        name, min(latencies), statistics.median(latencies),
+        statistics.mean(latencies), len(latencies)))
+
+
+_cold = measure(args.runs)
+
+_t0 = time.time()
+if not _app.start_zygote():
+    raise SystemExit('Could not start the zygote')
+print('Zygote ready in {:.3f}s'.format(time.time() - _t0))
+try:
+    _warm = measure(args.runs)
+finally:
+    _app.stop_zygote()
+
+report('cold', _cold)
+report('zygote', _warm)
+print('speedup  {:.1f}x'.format(
+    statistics.median(_cold) / statistics.median(_warm)))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Restart, stop or start many test instances in parallel.
+
+Meant to be used when the config server is not running, for instance
+after a deploy. With the config server running use its /bulk/run
+endpoint instead.
+"""
+import argparse
+import importlib
+import sys
+
+from oidctest.ass_port import AssignedPorts
+from oidctest.tt.app import Application
+from oidctest.tt.bulk import ACTIONS
+from oidctest.tt.bulk import BulkOperation
+from oidctest.tt.bulk import select_instances
+from oidctest.tt.rest import REST
+from oidctest.tt.store import make_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', dest='action', choices=ACTIONS, default='restart')
+parser.add_argument('-c', dest='test_tool_conf')
+parser.add_argument('-i', dest='iss', help='Only instances for this issuer')
+parser.add_argument('-t', dest='tag', help='Only instances with this tag')
+parser.add_argument('-w', dest='workers', type=int, default=4,
+                    help='Max number of instances handled at the same time')
+parser.add_argument('-r', dest='retries', type=int, default=1,
+                    help='How many more times to try a failed instance')
+parser.add_argument('-n', dest='dry_run', action='store_true',
+                    help='Only list the instances that would be affected')
+parser.add_argument(dest="config")
+args = parser.parse_args()
+
+_conf = importlib.import_module(args.config)
+_ttc = importlib.import_module(args.test_tool_conf)
+
+try:
+    _ent_db = _conf.ENT_DB
+except AttributeError:
+    _ent_db = ''
+rest = REST(_conf.BASE_URL,  # Base URL just place holder
+            backend=make_store(_conf.ENT_PATH, _ent_db))
+
+_assigned_ports = AssignedPorts('assigned_ports.json', _conf.PORT_MIN,
+                                _conf.PORT_MAX)
+_assigned_ports.load()
+
+_app = Application(_conf.TEST_SCRIPT, _conf.FLOWDIR, rest, _assigned_ports,
+                   _ttc.BASE, args.test_tool_conf, '')
+
+_instances = select_instances(_app, rest.backend, args.action, args.iss,
+                              args.tag)
+if args.dry_run:
+    for iss, tag in _instances:
+        print('{} {}'.format(iss, tag))
+    sys.exit(0)
+
+
+def progress(res, done, total):
+    if res.ok:
+        _status = 'ok'
+    else:
+        _status = 'FAILED: {}'.format(res.error)
+    print('[{}/{}] {} {} {} ({:.1f}s, {} attempt(s))'.format(
+        done, total, args.action, res.iss, res.tag, _status, res.elapsed,
+        res.attempts))
+
+
+_op = BulkOperation(_app, args.action, _instances, workers=args.workers,
+                    retries=args.retries, progress=progress)
+summary = _op.run()
+
+print('{action}: {ok}/{total} ok, {retried} retried, {elapsed}s'.format(
+    **summary))
+for res in summary['failed']:
+    print('Failed: {iss} {tag}: {error}'.format(**res))
+
+if summary['failed']:
+    sys.exit(1)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Copy the test instance configurations kept as files, one per issuer and
+tag under ENT_PATH, to the SQLite database named by ENT_DB.
+
+Run it with the config server stopped, then set ENT_DB in the config. The
+files are left as they are.
+"""
+import argparse
+import importlib
+import sys
+
+from oidctest.tt.store import FileStore
+from oidctest.tt.store import SQLiteStore
+from oidctest.tt.store import migrate
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-e', dest='entpath',
+                    help='Directory with the configurations, by default '
+                         'ENT_PATH')
+parser.add_argument('-d', dest='db_name',
+                    help='The database, by default ENT_DB')
+parser.add_argument(dest="config")
+args = parser.parse_args()
+
+_conf = importlib.import_module(args.config)
+
+_entpath = args.entpath or _conf.ENT_PATH
+_db_name = args.db_name
+if not _db_name:
+    try:
+        _db_name = _conf.ENT_DB
+    except AttributeError:
+        print('No database given and no ENT_DB in {}'.format(args.config))
+        sys.exit(1)
+
+n, bad = migrate(FileStore(_entpath), SQLiteStore(_db_name))
+for qiss, qtag in bad:
+    print('Not JSON, left out: {} {}'.format(qiss, qtag))
+print('Copied {} configurations from {} to {}'.format(n, _entpath, _db_name))
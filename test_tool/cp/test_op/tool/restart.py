@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 import importlib
-import psutil
 
 from oidctest.tt.app import Application
-from oidctest.tt.rest import NoSuchFile
+from oidctest.tt.bulk import BulkOperation
 from oidctest.tt.rest import REST
-from otest.proc import find_test_instances
+from oidctest.tt.store import make_store
 
 from oidctest.ass_port import AssignedPorts
 
@@ -15,13 +14,20 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-c', dest='test_tool_conf')
 parser.add_argument('-i', dest='iss')
 parser.add_argument('-t', dest='tag')
+parser.add_argument('-w', dest='workers', type=int, default=4,
+                    help='Max number of instances restarted at the same time')
 parser.add_argument(dest="config")
 args = parser.parse_args()
 
 _conf = importlib.import_module(args.config)
 _ttc = importlib.import_module(args.test_tool_conf)
 
-rest = REST(_conf.BASE_URL)  # Base URL just place holder
+try:
+    _ent_db = _conf.ENT_DB
+except AttributeError:
+    _ent_db = ''
+rest = REST(_conf.BASE_URL,  # Base URL just place holder
+            backend=make_store(_conf.ENT_PATH, _ent_db))
 
 _assigned_ports = AssignedPorts('assigned_ports.json', _conf.PORT_MIN, _conf.PORT_MAX)
 _assigned_ports.load()
@@ -29,20 +35,14 @@ _assigned_ports.load()
 _app = Application(_conf.TEST_SCRIPT, _conf.FLOWDIR, rest, _assigned_ports,
                    _ttc.BASE, args.test_tool_conf, '')
 
-for pid, proc_info in find_test_instances('op_test_tool.py').items():
-    if args.iss:
-        if proc_info['iss'] != args.iss:
-            continue
+_instances = [(info['iss'], info['tag']) for info in
+              _app.registry.instances(args.iss, args.tag).values()]
 
-        if args.tag:
-            if proc_info['tag'] != args.tag:
-                continue
 
-    print('Restarting: {iss} {tag}'.format(**proc_info))
-    ps = psutil.Process(pid)
-    ps.kill()
+def progress(res, done, total):
+    print('[{}/{}] Restarted: {} {} {}'.format(
+        done, total, res.iss, res.tag, 'ok' if res.ok else res.error))
 
-    try:
-        _app.run_test_instance(proc_info['iss'], proc_info['tag'])
-    except NoSuchFile as err:
-        print(err)
+
+BulkOperation(_app, 'restart', _instances, workers=args.workers,
+              progress=progress).run()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Measures token endpoint throughput with a varying number of crypto
+workers, see oidctest.crypto. Several threads send token requests to the
+same OP instance as CherryPy's worker threads would.
+
+Run from this directory, e.g. ./bench_crypto.py -f flows -k -w 0,1,2,4 config
+"""
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+from jwkest.jwk import RSAKey
+from otest.events import Events
+from otest.flow import Flow
+from otest.prof_util import SimpleProfileHandler
+
+from oidctest import crypto
+from oidctest.cp.op_handler import OPHandler
+from oidctest.cp.setup import cb_setup
+from oidctest.keypool import rsa_key
+from oidctest.rp import provider
+
+REDIRECT_URI = 'https://rp.example.com/cb'
+
+
+def register(op, encrypt=False):
+    _reg = {'redirect_uris': [REDIRECT_URI], 'response_types': ['code'],
+            'contacts': ['ops@example.com']}
+    if encrypt:
+        _key = RSAKey(use='enc', kid='enc').load_key(rsa_key(2048))
+        _reg['jwks'] = {'keys': [_key.serialize()]}
+        _reg['id_token_encrypted_response_alg'] = 'RSA1_5'
+        _reg['id_token_encrypted_response_enc'] = 'A128CBC-HS256'
+    return json.loads(op.registration_endpoint(json.dumps(_reg)).message)
+
+
+def get_code(op, client, n):
+    _resp = op.authorization_endpoint(urlencode({
+        'response_type': 'code', 'client_id': client['client_id'],
+        'redirect_uri': REDIRECT_URI, 'scope': 'openid',
+        'state': 'state{}'.format(n), 'nonce': 'nonce{}'.format(n)}))
+    return parse_qs(urlparse(_resp.message).query)['code'][0]
+
+
+def token_requests(op, client, codes, failed):
+    _authn = 'Basic {}'.format(base64.b64encode('{}:{}'.format(
+        client['client_id'], client['client_secret']).encode()).decode())
+    while True:
+        try:
+            code = codes.pop()
+        except IndexError:
+            return
+        _resp = op.token_endpoint(urlencode({
+            'grant_type': 'authorization_code', 'code': code,
+            'redirect_uri': REDIRECT_URI}), authn=_authn)
+        if 'id_token' not in json.loads(_resp.message):
+            failed.append(_resp.message)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='threads', type=int, default=8,
+                        help='Number of concurrent requests')
+    parser.add_argument('-d', dest='debug', action='store_true')
+    parser.add_argument('-e', dest='encrypt', action='store_true',
+                        help='Also encrypt the ID Token')
+    parser.add_argument('-f', dest='flowsdir', required=True)
+    parser.add_argument('-k', dest='insecure', action='store_true')
+    parser.add_argument('-n', dest='requests', type=int, default=200)
+    parser.add_argument('-p', dest='port', default=80, type=int)
+    parser.add_argument('-P', dest='path')
+    parser.add_argument('-t', dest='test_id', default='rp-id_token-sig-es256')
+    parser.add_argument('-w', dest='workers', default='0,1,2,4',
+                        help='Comma separated numbers of workers to try')
+    parser.add_argument(dest="config")
+    args = parser.parse_args()
+
+    sys.path.insert(0, '.')
+    _com_args, _op_arg, config = cb_setup(args)
+    _flows = Flow(args.flowsdir, profile_handler=SimpleProfileHandler)
+    op_handler = OPHandler(provider.Provider, _op_arg, _com_args, _flows, '.')
+    op = op_handler.get('bench', args.test_id, Events(), 'registration')[0]
+    client = register(op, args.encrypt)
+
+    print('{} tokens from {} threads, {}'.format(args.requests, args.threads,
+                                                 args.test_id))
+    for workers in [int(w) for w in args.workers.split(',')]:
+        _pool = crypto.configure(workers)
+        _pool.start()
+
+        codes = [get_code(op, client, n) for n in range(args.requests)]
+        failed = []
+        _threads = [threading.Thread(target=token_requests,
+                                     args=(op, client, codes, failed))
+                    for _ in range(args.threads)]
+        _start = time.time()
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+        _time = time.time() - _start
+
+        print('{} workers: {:7.1f} requests/s {}'.format(
+            workers, args.requests / _time, _pool.stats()))
+        if failed:
+            print('{} failed, e.g. {}'.format(len(failed), failed[0]))
+
+    crypto.stop()
+
+
+# The crypto workers import this module
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Measures how long the first request for an RP library and a test takes,
+that is how long it takes to build the OP instance for it.
+
+Run from this directory, e.g. ./bench_setup_op.py -f flows -k config
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from otest.events import Events
+from otest.flow import Flow
+from otest.prof_util import SimpleProfileHandler
+
+from oidctest.cp.op_handler import OPHandler
+from oidctest.cp.setup import cb_setup
+from oidctest.rp import provider
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', dest='debug', action='store_true')
+parser.add_argument('-f', dest='flowsdir', required=True)
+parser.add_argument('-k', dest='insecure', action='store_true')
+parser.add_argument('-n', dest='runs', type=int, default=5,
+                    help='Number of RP libraries per test')
+parser.add_argument('-p', dest='port', default=80, type=int)
+parser.add_argument('-P', dest='path')
+parser.add_argument('-T', dest='tests', nargs='*',
+                    help='Only these tests, default all')
+parser.add_argument(dest="config")
+args = parser.parse_args()
+
+sys.path.insert(0, '.')
+_com_args, _op_arg, config = cb_setup(args)
+
+folder = os.path.abspath(os.curdir)
+_flows = Flow(os.path.join(folder, args.flowsdir),
+              profile_handler=SimpleProfileHandler)
+op_handler = OPHandler(provider.Provider, _op_arg, _com_args, _flows, folder)
+
+_tests = args.tests or sorted(_flows.keys())
+_all = []
+for test_id in _tests:
+    _times = []
+    for n in range(args.runs):
+        _start = time.time()
+        try:
+            op_handler.get('bench{}'.format(n), test_id, Events(),
+                           'authorization')
+        except Exception as err:
+            print('{}: {}'.format(test_id, err))
+            break
+        _times.append(time.time() - _start)
+    if _times:
+        _all.extend(_times)
+        print('{:55} first {:7.4f}s  median {:7.4f}s'.format(
+            test_id, _times[0], statistics.median(_times)))
+
+print('{} OP instances, median {:.4f}s, mean {:.4f}s, total {:.2f}s'.format(
+    len(_all), statistics.median(_all), statistics.mean(_all), sum(_all)))
+print('{} JWKS documents'.format(len(op_handler.jwks_store)))
@@ -55,6 +55,34 @@ COOKIE = {
 
 SSO_TTL = 2*60
 
+# One OP instance is built per RP and test. These limit how many are kept
+# in memory, least recently used are thrown away first and are built again
+# if needed.
+OP_CACHE_SIZE = 1000
+# Seconds an OP instance may go unused
+OP_CACHE_TTL = 24*60*60
+# Max resident memory in bytes, 0 means no limit
+OP_CACHE_MEMORY = 0
+
+# Number of RSA and EC keys of each kind generated in advance for the key
+# rotation tests. 0 means they are generated when needed.
+KEY_POOL_DEPTH = 4
+
+# Number of processes doing the signing and encryption of ID Tokens and
+# UserInfo responses. 0 means it's done by the thread handling the request.
+CRYPTO_WORKERS = 0
+
+# Max number of test log entries waiting to be written by the log writer
+# thread. 0 means they are written by the thread handling the request.
+LOG_QUEUE_SIZE = 10000
+
+# The OP instances' JWKS documents are served from memory. If set, they are
+# also written to files in this directory.
+JWKS_DIR = ''
+# JWKS files in static/ written by earlier versions are removed at start
+# if older than this many seconds
+JWKS_MAX_AGE = 24*60*60
+
 SYM_KEY = "SoLittleTime,Got"
 SEED = b"abcdefghijklmnop"
 
@@ -5,12 +5,19 @@ import os
 
 import cherrypy
 import sys
+from cherrypy.process.plugins import Monitor
 
 from oic.utils import webfinger
 from otest.flow import Flow
 from otest.prof_util import SimpleProfileHandler
 
+from oidctest import crypto
+from oidctest import keypool
+from oidctest import logwriter
 from oidctest.cp import dump_log
+from oidctest.cp.jwks import JWKS
+from oidctest.cp.jwks import JWKSStore
+from oidctest.cp.jwks import remove_stale_files
 from oidctest.cp.log_handler import ClearLog
 from oidctest.cp.log_handler import Log
 from oidctest.cp.log_handler import Tar
@@ -58,14 +65,72 @@ if __name__ == '__main__':
     folder = os.path.abspath(os.curdir)
     _flowsdir = os.path.normpath(os.path.join(folder, args.flowsdir))
     _flows = Flow(_flowsdir, profile_handler=SimpleProfileHandler)
+
+    try:
+        _jwks_store = JWKSStore(directory=config.JWKS_DIR)
+    except AttributeError:
+        _jwks_store = JWKSStore()
+    try:
+        _max_age = config.JWKS_MAX_AGE
+    except AttributeError:
+        _max_age = 86400
+    _count = remove_stale_files(os.path.join(folder, 'static'), _max_age)
+    if _count:
+        logger.info('Removed {} stale JWKS files'.format(_count))
+
+    # Limits on the number of OP instances kept in memory
+    _cache_args = {}
+    for param, attr in [('max_entries', 'OP_CACHE_SIZE'),
+                        ('ttl', 'OP_CACHE_TTL'),
+                        ('max_memory', 'OP_CACHE_MEMORY')]:
+        try:
+            _cache_args[param] = getattr(config, attr)
+        except AttributeError:
+            pass
+
     try:
         csi = config.CHECK_SESSION_IFRAME
     except AttributeError:
         op_handler = OPHandler(provider.Provider, _op_arg, _com_args, _flows,
-                               folder)
+                               folder, jwks_store=_jwks_store, **_cache_args)
     else:
         op_handler = OPHandler(provider.Provider, _op_arg, _com_args, _flows,
-                               folder, csi.format(args.port))
+                               folder, csi.format(args.port),
+                               jwks_store=_jwks_store, **_cache_args)
+
+    # Fresh keys for the key rotation tests, made in the background
+    try:
+        _key_pool = keypool.configure(config.KEY_POOL_DEPTH)
+    except AttributeError:
+        _key_pool = keypool.default_pool()
+    _key_pool.start()
+    cherrypy.engine.subscribe('stop', _key_pool.stop)
+
+    # Signing and encryption in worker processes
+    try:
+        _crypto_pool = crypto.configure(config.CRYPTO_WORKERS)
+    except AttributeError:
+        _crypto_pool = crypto.default_pool()
+    _crypto_pool.start()
+    cherrypy.engine.subscribe('stop', _crypto_pool.stop)
+
+    # Test logs written by a thread of their own
+    try:
+        _log_writer = logwriter.configure(config.LOG_QUEUE_SIZE)
+    except AttributeError:
+        _log_writer = logwriter.default_writer()
+    if _log_writer.queue.maxsize:
+        _log_writer.start()
+    cherrypy.engine.subscribe('stop', _log_writer.stop)
+
+    def log_stats():
+        logger.info('OP cache: {}'.format(op_handler.stats()))
+        logger.info('Key pool: {}'.format(_key_pool.stats()))
+        logger.info('Crypto pool: {}'.format(_crypto_pool.stats()))
+        logger.info('Log writer: {}'.format(_log_writer.stats()))
+
+    Monitor(cherrypy.engine, log_stats, frequency=600,
+            name='Stats').subscribe()
 
     cherrypy.tools.dumplog = cherrypy.Tool('before_finalize', dump_log)
 
@@ -128,6 +193,9 @@ if __name__ == '__main__':
 
     cherrypy.tree.mount(RelyingParty(op_handler, version=_version), '/rp')
 
+    cherrypy.tree.mount(JWKS(_jwks_store), '/jwks',
+                        {'/': {'cors.expose_public.on': True}})
+
     # OIDC Providers
     cherrypy.tree.mount(Provider(op_handler, _flows, version=_version),
                         '/', provider_config)
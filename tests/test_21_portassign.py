@@ -2,7 +2,7 @@ import json
 
 from future.backports.urllib.parse import quote_plus
 
-from oidctest.ass_port import AssignedPorts, OutOfRange
+from oidctest.ass_port import AssignedPorts, OutOfRange, PortInUse
 
 PORT_INFO = {
   "https://idam-dev.metrosystems.net][default": 60016,
@@ -90,4 +90,80 @@ def test_port_ass():
                 ap.register_port(*iss.split(']['))
 
     dup = find_duplicates(fname)
-    assert dup == {}
\ No newline at end of file
+    assert dup == {}
+
+
+def test_lowest_free_first(tmpdir):
+    ap = AssignedPorts(str(tmpdir.join('ap.json')), 60000, 60009)
+    ports = [ap.register_port('https://example.com', str(i)) for i in range(5)]
+    assert ports == [60000, 60001, 60002, 60003, 60004]
+
+    del ap[ap.make_key('https://example.com', '3')]
+    assert ap.release('https://example.com', '1') == 60001
+    assert ap.release('https://example.com', '1') == 0
+    assert ap.next_free_port() == 60001
+    assert ap.next_free_port(60002) == 60003
+
+    assert ap.register_port('https://example.com', 'a') == 60001
+    assert ap.register_port('https://example.com', 'b') == 60003
+    assert ap.register_port('https://example.com', 'c') == 60005
+
+
+def test_refuse_duplicate(tmpdir):
+    ap = AssignedPorts(str(tmpdir.join('ap.json')), 60000, 60009)
+    ap.register_port('https://example.com', 'one')
+    try:
+        ap['https://example.com][two'] = 60000
+    except PortInUse:
+        pass
+    else:
+        assert False
+    assert 'https://example.com][two' not in ap
+
+
+def test_journal(tmpdir):
+    fname = str(tmpdir.join('ap.json'))
+    ap = AssignedPorts(fname, 60000, 60099, compact_after=5)
+    for i in range(7):
+        ap.register_port('https://example.com', str(i))
+    del ap['https://example.com][2']
+
+    # compacted once, three entries in the journal
+    assert len(json.loads(open(fname).read())) == 5
+    assert len(open(fname + '.journal').readlines()) == 3
+
+    ap2 = AssignedPorts(fname, 60000, 60099)
+    ap2.load()
+    assert dict(ap2.items()) == dict(ap.items())
+    assert ap2.register_port('https://example.com', 'new') == 60002
+
+    # A line cut short by a crash is skipped
+    open(fname + '.journal', 'a').write('{"set": ["https://exa')
+    ap3 = AssignedPorts(fname, 60000, 60099)
+    ap3.load()
+    assert dict(ap3.items()) == dict(ap2.items())
+
+
+def test_compact_keeps_others(tmpdir):
+    fname = str(tmpdir.join('ap.json'))
+    ap = AssignedPorts(fname, 60000, 60099)
+    ap2 = AssignedPorts(fname, 60000, 60099, compact_after=2)
+    ap['https://example.com][one'] = 60000
+    # Doesn't know about the first, compacts after its second
+    ap2['https://example.com][two'] = 60001
+    ap2['https://example.com][three'] = 60002
+    assert open(fname + '.journal').read() == ''
+
+    ap3 = AssignedPorts(fname, 60000, 60099)
+    ap3.load()
+    assert sorted(ap3.values()) == [60000, 60001, 60002]
+
+
+def test_load_drops_duplicates(tmpdir):
+    fname = str(tmpdir.join('ap.json'))
+    open(fname, 'w').write(json.dumps({'a][x': 60000, 'b][y': 60000,
+                                       'c][z': 60001}))
+    ap = AssignedPorts(fname, 60000, 60009)
+    ap.load()
+    assert dict(ap.items()) == {'a][x': 60000, 'c][z': 60001}
+    assert ap.register_port('b', 'y') == 60002
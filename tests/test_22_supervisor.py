@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+from oidctest.tt.supervisor import READY_FD
+from oidctest.tt.supervisor import StartFailed
+from oidctest.tt.supervisor import Supervisor
+
+READY = "from oidctest.tt.supervisor import notify_ready; " \
+        "notify_ready(port=60000); import time; time.sleep(60)"
+
+ENV = {'PYTHONPATH': os.pathsep.join(sys.path)}
+
+
+def test_start_stop():
+    sup = Supervisor(ready_timeout=20)
+    child = sup.start('iss][tag', [sys.executable, '-c', READY], 60000,
+                      env=ENV)
+
+    assert child.is_alive()
+    assert child.info['port'] == 60000
+    assert child.info['pid'] == child.pid
+    assert child.latency > 0
+    assert sup.pids() == {'iss][tag': child.pid}
+
+    assert sup.stop('iss][tag')
+    assert not child.is_alive()
+    assert sup.pids() == {}
+    assert sup.stop('iss][tag') is False
+
+
+def test_exit_before_ready():
+    sup = Supervisor(ready_timeout=20)
+    with pytest.raises(StartFailed):
+        sup.start('iss][tag', [sys.executable, '-c', 'import sys; sys.exit(2)'],
+                  60000)
+    assert 'iss][tag' not in sup
+
+
+def test_no_such_program():
+    sup = Supervisor()
+    with pytest.raises(StartFailed):
+        sup.start('iss][tag', ['./no_such_test_tool.py'], 60000)
+
+
+def test_ready_timeout():
+    sup = Supervisor(ready_timeout=0.5)
+    with pytest.raises(StartFailed):
+        sup.start('iss][tag', [sys.executable, '-c', 'import time; '
+                                                     'time.sleep(60)'], 60000)
+    # Stopped and forgotten without being told to
+    assert sup.pids() == {}
+    assert sup.children == {}
+
+
+def test_bad_notification():
+    sup = Supervisor(ready_timeout=20)
+    _bad = "import os, time; os.write(int(os.environ['{}']), b'{{\\n'); " \
+           "time.sleep(60)".format(READY_FD)
+    with pytest.raises(StartFailed):
+        sup.start('iss][tag', [sys.executable, '-c', _bad], 60000)
+    # Not left running
+    assert sup.pids() == {}
@@ -0,0 +1,39 @@
+import os
+
+import cherrypy
+
+from oidctest.tt.control import ControlChannel
+from oidctest.tt.control import control_path
+from oidctest.tt.control import ping
+from oidctest.tt.control import send
+
+
+def test_ping(tmpdir):
+    path = control_path(60001, str(tmpdir.join('ctl')))
+    ctl = ControlChannel(cherrypy.engine, path, port=60001, iss='https://op',
+                         tag='default', flows=10)
+    ctl.start()
+    try:
+        status = ping(path)
+        assert status['port'] == 60001
+        assert status['iss'] == 'https://op'
+        assert status['flows'] == 10
+        assert status['pid'] == os.getpid()
+        assert 'uptime' in status
+        assert status['idle'] >= 0
+
+        assert 'error' in send(path, 'shutdown')
+    finally:
+        ctl.stop()
+
+    assert not os.path.exists(path)
+    assert ping(path) is None
+
+
+def test_ping_nobody_listening(tmpdir):
+    assert ping(str(tmpdir.join('60002.sock'))) is None
+
+    # Left behind by an instance that was killed
+    path = str(tmpdir.join('60003.sock'))
+    open(path, 'w').close()
+    assert ping(path) is None
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from oidctest.proc import ProcessRegistry
+from oidctest.proc import parse_cmdline
+
+CMD = ['python3', './op_test_tool.py', '-i', 'https://op.example.com', '-t',
+       'default', '-p', '60001', '-f', 'flows', '-s', 'config']
+
+
+def test_parse_cmdline():
+    info = parse_cmdline(CMD, 'op_test_tool.py')
+    assert info == {'iss': 'https://op.example.com', 'tag': 'default',
+                    'port': '60001'}
+
+    assert parse_cmdline(CMD, 'rp_test_tool.py') is None
+    assert parse_cmdline(CMD[:4], 'op_test_tool.py') is None
+    assert parse_cmdline(['python3', './op_test_tool.py', '-p', '60001', '-f',
+                          'flows', 'config'], 'op_test_tool.py') is None
+
+
+def test_registry():
+    proc = subprocess.Popen(
+        [sys.executable, '-c', 'import time; time.sleep(60)', '-i',
+         'https://op.example.com', '-t', 'registry', '-p', '60002'])
+    try:
+        reg = ProcessRegistry(ttl=60)
+        info = reg.find('https://op.example.com', 'registry')
+        assert info['pid'] == proc.pid
+        assert info['port'] == '60002'
+        assert reg.pid('https://op.example.com', 'other') == 0
+        assert reg.running('https://op.example.com', ['registry', 'other']) == {
+            'registry': proc.pid, 'other': 0}
+        assert list(reg.instances(tag='registry').keys()) == [proc.pid]
+    finally:
+        proc.kill()
+        proc.wait()
+
+    # Still cached
+    assert reg.pid('https://op.example.com', 'registry') == proc.pid
+
+    reg.invalidate()
+    assert reg.pid('https://op.example.com', 'registry') == 0
@@ -0,0 +1,105 @@
+import os
+import socket
+import sys
+import threading
+
+import cherrypy
+
+from oidctest.tt.hibernate import Hibernator
+from oidctest.tt.supervisor import Supervisor
+
+# Accepts one connection on the handed over socket and says hello
+CHILD = """
+import os, socket
+from oidctest.tt.supervisor import notify_ready, socket_activated
+assert socket_activated()
+sock = socket.fromfd(3, socket.AF_INET, socket.SOCK_STREAM)
+notify_ready()
+conn, _ = sock.accept()
+conn.sendall(b'hello')
+conn.close()
+"""
+
+ENV = {'PYTHONPATH': os.pathsep.join(sys.path)}
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_hand_over_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+
+    # Connect before anyone is accepting
+    client = socket.create_connection(sock.getsockname())
+
+    sup = Supervisor(ready_timeout=20)
+    child = sup.start('iss][tag', [sys.executable, '-c', CHILD], 0, env=ENV,
+                      listen_sock=sock)
+    sock.close()
+
+    assert client.recv(5) == b'hello'
+    client.close()
+    child.proc.wait(10)
+
+
+class App(object):
+    """The parts of oidctest.tt.app.Application a Hibernator uses."""
+
+    def __init__(self, port):
+        self.assigned_ports = {'https://op][default': port}
+        self.ctldir = 'ctl'
+        self.supervisor = Supervisor(ready_timeout=20)
+        self.started = threading.Event()
+
+    def key(self, iss, tag):
+        return '{}][{}'.format(iss, tag)
+
+    def stop_test_instance(self, iss, tag):
+        return self.supervisor.stop(self.key(iss, tag))
+
+    def run_test_instance(self, iss, tag, listen_sock=None):
+        self.supervisor.start('https://op][default',
+                              [sys.executable, '-c', CHILD], 0, env=ENV,
+                              listen_sock=listen_sock)
+        self.started.set()
+
+
+def test_hibernate_and_wake():
+    app = App(free_port())
+    hib = Hibernator(cherrypy.engine, app, 60, host='127.0.0.1')
+    hib.start()
+    try:
+        assert hib.hibernate('https://op', 'default')
+        assert hib.is_hibernated('https://op', 'default')
+
+        client = socket.create_connection(('127.0.0.1',
+                                           app.assigned_ports[
+                                               'https://op][default']))
+        assert app.started.wait(20)
+        assert client.recv(5) == b'hello'
+        client.close()
+        assert not hib.is_hibernated('https://op', 'default')
+    finally:
+        hib.stop()
+        app.supervisor.stop_all()
+
+
+def test_release():
+    app = App(free_port())
+    hib = Hibernator(cherrypy.engine, app, 60, host='127.0.0.1')
+    assert hib.hibernate('https://op', 'default')
+    assert hib.release('https://op', 'default')
+    assert hib.release('https://op', 'default') is False
+
+    # The port is free again
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', app.assigned_ports['https://op][default']))
+    sock.close()
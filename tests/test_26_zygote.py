@@ -0,0 +1,139 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from oidctest.tt.app import Application
+from oidctest.tt.supervisor import Supervisor
+from oidctest.tt.supervisor import ZygoteUnavailable
+from oidctest.tt.supervisor import fork_instance
+from oidctest.tt.supervisor import read_ready
+
+# A zygote whose children report their command line and, if they were
+# handed a socket, accept one connection on it and say hello
+ZYGOTE = """
+import os, socket, sys
+fd3 = os.open(os.devnull, os.O_RDONLY)
+from oidctest.tt.supervisor import notify_ready, socket_activated
+from oidctest.tt.zygote import Zygote
+
+def run(argv):
+    if argv[0] == 'fail':
+        sys.exit(3)
+    activated = socket_activated()
+    notify_ready(argv=argv, activated=activated)
+    if activated:
+        sock = socket.fromfd(3, socket.AF_INET, socket.SOCK_STREAM)
+        conn, _ = sock.accept()
+        conn.sendall(b'hello')
+        conn.close()
+    else:
+        import time
+        time.sleep(60)
+
+Zygote(sys.argv[1], run, listen_fd=fd3).serve_forever()
+"""
+
+ENV = {'PYTHONPATH': os.pathsep.join(sys.path)}
+
+
+@pytest.fixture
+def zygote(tmpdir):
+    path = str(tmpdir.join('zygote.sock'))
+    sup = Supervisor(ready_timeout=20)
+    child = sup.start('zygote', [sys.executable, '-c', ZYGOTE, path], 0,
+                      env=ENV)
+    assert child.info['zygote'] == path
+    yield path
+    sup.stop_all()
+
+
+def test_fork_instance(zygote):
+    proc, rfd = fork_instance(zygote, ['op_test_tool.py', '-i', 'x'])
+    try:
+        info = read_ready(rfd, 10)
+    finally:
+        os.close(rfd)
+    assert info['pid'] == proc.pid
+    assert info['argv'] == ['op_test_tool.py', '-i', 'x']
+    assert info['activated'] is False
+
+    proc.terminate()
+    proc.wait(10)
+    assert proc.poll() is not None
+
+
+def test_supervisor_uses_zygote(zygote):
+    sup = Supervisor(ready_timeout=20, zygote=zygote)
+    child = sup.start('iss][tag', ['op_test_tool.py'], 0)
+    assert child.info['argv'] == ['op_test_tool.py']
+    assert child.latency is not None
+    assert sup.pids() == {'iss][tag': child.pid}
+
+    assert sup.stop('iss][tag')
+    assert sup.pids() == {}
+
+
+def test_hand_over_socket(zygote):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+    client = socket.create_connection(sock.getsockname())
+
+    sup = Supervisor(ready_timeout=20, zygote=zygote)
+    child = sup.start('iss][tag', ['op_test_tool.py'], 0, listen_sock=sock)
+    sock.close()
+    assert child.info['activated'] is True
+
+    assert client.recv(5) == b'hello'
+    client.close()
+    sup.stop_all()
+
+
+def test_child_exits(zygote):
+    proc, rfd = fork_instance(zygote, ['fail'])
+    try:
+        assert read_ready(rfd, 10) is None
+    finally:
+        os.close(rfd)
+
+
+def test_no_zygote(tmpdir):
+    with pytest.raises(ZygoteUnavailable):
+        fork_instance(str(tmpdir.join('missing.sock')), ['x'])
+
+    # Falls back on starting from scratch
+    sup = Supervisor(ready_timeout=20,
+                     zygote=str(tmpdir.join('missing.sock')))
+    child = sup.start(
+        'iss][tag',
+        [sys.executable, '-c',
+         'from oidctest.tt.supervisor import notify_ready; notify_ready()'],
+        0, env=ENV)
+    assert isinstance(child.proc, subprocess.Popen)
+    child.proc.wait(10)
+
+
+class Started(object):
+    def __init__(self, args):
+        self.info = {'zygote': args[args.index('-z') + 1]}
+
+
+class Recorder(object):
+    zygote = None
+
+    def start(self, key, args, port):
+        return Started(args)
+
+
+def test_zygote_in_ctldir(tmpdir):
+    _ctldir = str(tmpdir.join('ctl'))
+    app = Application('op_test_tool.py', 'flows', None, None, '', 'conf',
+                      None, multi_tenant=True, ctldir=_ctldir,
+                      zygote='op_test_zygote.py')
+    app.supervisor = Recorder()
+    assert app.start_zygote()
+    assert app.supervisor.zygote == os.path.join(_ctldir, 'zygote.sock')
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from urllib.parse import quote_plus
+from urllib.parse import unquote_plus
+
+import cherrypy
+import pytest
+
+from oidctest.tt.bulk import Bulk
+from oidctest.tt.bulk import BulkOperation
+from oidctest.tt.bulk import UnknownAction
+from oidctest.tt.bulk import configured_instances
+from oidctest.tt.bulk import rolling_order
+from oidctest.tt.bulk import select_instances
+
+
+class Ports(object):
+    def __init__(self):
+        self.registered = []
+
+    def register_port(self, iss, tag):
+        self.registered.append((unquote_plus(iss), unquote_plus(tag)))
+        return 60000 + len(self.registered)
+
+
+class App(object):
+    """The parts of oidctest.tt.app.Application a BulkOperation uses."""
+
+    def __init__(self, fail=None, active=None):
+        self.assigned_ports = Ports()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+        self.fail = fail or {}
+        self.active = active or []
+
+    def run_test_instance(self, iss, tag):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.calls.append((unquote_plus(iss), unquote_plus(tag)))
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+            _key = (unquote_plus(iss), unquote_plus(tag))
+            if self.fail.get(_key, 0):
+                self.fail[_key] -= 1
+                return None
+        return 'https://localhost:60001'
+
+    def stop_test_instance(self, iss, tag):
+        self.calls.append((iss, tag))
+
+    def is_active(self, iss, tag):
+        return (iss, tag) in self.active
+
+
+def test_rolling_order():
+    _instances = [('a', '1'), ('a', '2'), ('a', '3'), ('b', '1'), ('c', '1'),
+                  ('c', '2')]
+    assert rolling_order(_instances) == [('a', '1'), ('b', '1'), ('c', '1'),
+                                         ('a', '2'), ('c', '2'), ('a', '3')]
+
+
+def test_bounded_workers():
+    app = App()
+    _instances = [('https://op{}'.format(i), 'default') for i in range(12)]
+    op = BulkOperation(app, 'restart', _instances, workers=3)
+    summary = op.run()
+
+    assert summary['total'] == 12
+    assert summary['ok'] == 12
+    assert summary['failed'] == []
+    assert summary['finished']
+    assert app.max_running <= 3
+    assert sorted(app.calls) == sorted(_instances)
+    assert sorted(app.assigned_ports.registered) == sorted(_instances)
+
+
+def test_retry():
+    app = App(fail={('https://op', 'one'): 1, ('https://op', 'two'): 5})
+    progress = []
+    op = BulkOperation(app, 'start', [('https://op', 'one'),
+                                      ('https://op', 'two')],
+                       workers=2, retries=2, retry_delay=0.01,
+                       progress=lambda r, d, t: progress.append((d, t)))
+    summary = op.run()
+
+    assert summary['ok'] == 1
+    assert summary['retried'] == 2
+    assert len(summary['failed']) == 1
+    assert summary['failed'][0]['tag'] == 'two'
+    assert summary['failed'][0]['attempts'] == 3
+    assert sorted(progress) == [(1, 2), (2, 2)]
+
+
+def test_stop():
+    app = App()
+    summary = BulkOperation(app, 'stop', [('https://op', 'default')]).run()
+    assert summary['ok'] == 1
+    assert app.calls == [('https://op', 'default')]
+    # Stopping doesn't need ports
+    assert app.assigned_ports.registered == []
+
+
+def test_unknown_action():
+    with pytest.raises(UnknownAction):
+        BulkOperation(App(), 'reboot', [])
+
+
+def test_select_instances(tmpdir):
+    for iss, tag in [('https://example.com', 'default'),
+                     ('https://op', 'one'), ('https://op', 'two'),
+                     ('https://op2', 'one')]:
+        _dir = tmpdir.join(quote_plus(iss))
+        if not _dir.check():
+            _dir.mkdir()
+        _dir.join(quote_plus(tag)).write('{}')
+    _entpath = str(tmpdir)
+
+    assert configured_instances(_entpath) == [
+        ('https://op', 'one'), ('https://op', 'two'), ('https://op2', 'one')]
+    assert configured_instances(_entpath, tag='one') == [
+        ('https://op', 'one'), ('https://op2', 'one')]
+
+    app = App(active=[('https://op', 'two')])
+    assert select_instances(app, _entpath, 'restart') == [
+        ('https://op', 'two')]
+    assert select_instances(app, _entpath, 'start', iss='https://op') == [
+        ('https://op', 'one')]
+
+
+def test_workers_limit(tmpdir):
+    bulk = Bulk(App(), str(tmpdir), workers=4)
+    _op = bulk.start_operation('start', workers=10000)
+    assert _op.workers == 4
+    for _ in range(100):
+        if _op.is_done():
+            break
+        time.sleep(0.01)
+    _op = bulk.start_operation('start', workers=-3)
+    assert _op.workers == 1
+
+    cherrypy.request.method = 'POST'
+    try:
+        with pytest.raises(cherrypy.HTTPError) as err:
+            bulk.run('start', workers='many')
+        assert err.value.status == 400
+    finally:
+        cherrypy.request.method = 'GET'
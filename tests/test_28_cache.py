@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from oidctest import cache
+from oidctest.cache import LRUCache
+
+
+def test_lru():
+    evicted = []
+    _cache = LRUCache(max_entries=2,
+                      on_evict=lambda k, v, r: evicted.append((k, r)))
+    _cache['a'] = 1
+    _cache['b'] = 2
+    # a is now the most recently used
+    assert _cache['a'] == 1
+    _cache['c'] = 3
+
+    assert 'b' not in _cache
+    assert sorted(_cache.keys()) == ['a', 'c']
+    assert evicted == [('b', cache.LRU)]
+
+    with pytest.raises(KeyError):
+        _cache['b']
+
+    stats = _cache.stats()
+    assert stats['entries'] == 2
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['evictions'][cache.LRU] == 1
+
+
+def test_ttl():
+    _cache = LRUCache(ttl=60)
+    _cache['a'] = 1
+    _cache['b'] = 2
+    _cache._used['a'] -= 120
+
+    # Expired entries are not handed out
+    assert _cache.get('a') is None
+    assert 'a' not in _cache
+
+    _cache._used['b'] -= 120
+    _cache['c'] = 3
+    # and are swept when something is added
+    assert _cache.keys() == ['c']
+    assert _cache.stats()['evictions'][cache.TTL] == 2
+
+
+def test_memory(monkeypatch):
+    _cache = LRUCache(max_memory=1000)
+    monkeypatch.setattr(cache, 'rss', lambda: 500)
+    for i in range(20):
+        _cache[i] = i
+    assert len(_cache) == 20
+
+    monkeypatch.setattr(cache, 'rss', lambda: 2000)
+    _cache[20] = 20
+    # The least recently used tenth is dropped
+    assert len(_cache) == 19
+    assert 0 not in _cache and 1 not in _cache
+    assert _cache.stats()['evictions'][cache.MEMORY] == 2
+
+
+def test_size():
+    _cache = LRUCache(max_size=10, sizeof=lambda k, v: len(v))
+    _cache['a'] = 'xxxx'
+    _cache['b'] = 'xxxx'
+    _cache['a'] = 'xxx'
+    assert _cache.size == 7
+
+    _cache['c'] = 'xxxx'
+    # b was used least recently
+    assert _cache.keys() == ['a', 'c']
+    assert _cache.stats()['size'] == 7
+    assert _cache.stats()['evictions'][cache.SIZE] == 1
+
+    # Kept although too big
+    _cache['d'] = 20 * 'x'
+    assert _cache.keys() == ['d']
+    _cache.pop('d')
+    assert _cache.size == 0
+
+
+def test_rebuild_on_miss():
+    _cache = LRUCache(max_entries=1)
+    built = []
+
+    def get(key):
+        try:
+            return _cache[key]
+        except KeyError:
+            built.append(key)
+            _cache[key] = time.time()
+            return _cache[key]
+
+    get('x')
+    get('x')
+    get('y')
+    get('x')
+    assert built == ['x', 'y', 'x']
+
+
+def test_removed():
+    dropped = []
+    _cache = LRUCache(on_evict=lambda k, v, r: dropped.append((k, v, r)))
+    _cache['a'] = 1
+    _cache['a'] = 1
+    _cache['a'] = 2
+    _cache['b'] = 3
+    _cache['c'] = 4
+    del _cache['a']
+    assert _cache.pop('b') == 3
+    assert _cache.pop('b', None) is None
+    _cache.clear()
+    assert dropped == [('a', 1, cache.REPLACED), ('a', 2, cache.REMOVED),
+                       ('b', 3, cache.REMOVED), ('c', 4, cache.REMOVED)]
+    # Not counted as evictions
+    assert sum(_cache.stats()['evictions'].values()) == 0
@@ -0,0 +1,123 @@
+import pytest
+from oic.utils.keyio import KeyBundle
+from oic.utils.keyio import KeyJar
+
+from oidctest import UnknownTestID
+from oidctest.cp.op_handler import Prototype
+from oidctest.keys import SharedKeyJar
+from oidctest.keys import clone_keybundle
+from oidctest.keys import copy_issuer_keys
+from oidctest.rp.provider import _jwks
+
+
+def test_clone_keybundle():
+    kb = KeyBundle(_jwks['keys'])
+    _kb = clone_keybundle(kb)
+    assert [k.kid for k in _kb.keys()] == [k.kid for k in kb.keys()]
+
+    # Same key material, separate state
+    assert _kb.keys()[0].key is kb.keys()[0].key
+    _kb.keys()[0].inactive_since = 10
+    assert kb.keys()[0].inactive_since == 0
+    _kb.remove(_kb.keys()[1])
+    assert len(kb) == 3
+
+    assert len(clone_keybundle(_kb, active_only=True)) == 1
+
+
+def test_copy_issuer_keys():
+    kj = KeyJar()
+    kj.add_kb('', KeyBundle(_jwks['keys']))
+    kj.issuer_keys[''][0].keys()[2].inactive_since = 10
+    copy_issuer_keys(kj, '', 'https://op.example.com')
+
+    ref = KeyJar()
+    ref.import_jwks(kj.export_jwks(True, ''), 'https://op.example.com')
+
+    def kids(keyjar):
+        return [(k.kty, k.kid, k.use) for kb in
+                keyjar.issuer_keys['https://op.example.com'] for k in
+                kb.keys()]
+
+    assert kids(kj) == kids(ref)
+    assert len(kids(kj)) == 2
+
+
+def test_shared_keyjar():
+    template = KeyJar()
+    template.add_kb('', KeyBundle(_jwks['keys']))
+    template.add_kb('https://example.com/op', KeyBundle(_jwks['keys']))
+
+    kj = SharedKeyJar(template, issuers=[''])
+    assert list(kj.issuer_keys.keys()) == ['']
+    assert kj.issuer_keys[''][0] is template.issuer_keys[''][0]
+
+    copy_issuer_keys(kj, '', 'https://op.example.com')
+    assert kj.issuer_keys['https://op.example.com'][0] is \
+           template.issuer_keys[''][0]
+
+    # A key rollover, the template is left as it was
+    for kb in kj.writable(''):
+        for key in kb.keys():
+            key.inactive_since = 10
+    kj.add_kb('', KeyBundle(_jwks['keys'][:1]))
+    assert len(kj.issuer_keys['']) == 2
+    assert len(template.issuer_keys['']) == 1
+    assert [k.inactive_since for k in template.issuer_keys[''][0].keys()] == \
+           [0, 0, 0]
+    assert kj.issuer_keys['https://op.example.com'][0] is \
+           template.issuer_keys[''][0]
+
+    # Only active keys are copied
+    copy_issuer_keys(kj, '', 'https://op2.example.com')
+    assert len(kj.get_issuer_keys('https://op2.example.com')) == 1
+
+    kj.remove_outdated()
+    assert len(kj.issuer_keys['']) == 1
+    assert len(template.issuer_keys['']) == 1
+    assert len(template.issuer_keys[''][0]) == 3
+
+
+class Server(object):
+    behavior_type = []
+
+
+class OP(object):
+    def __init__(self):
+        self.capabilities = {'id_token_signing_alg_values_supported':
+                                 ['RS256']}
+        self.jwx_def = {'signing_alg': {'id_token': 'RS256', 'userinfo': ''},
+                        'encryption_alg': {}, 'encryption_enc': {}}
+        self.claims_type = ['normal']
+        self.behavior_type = []
+        self.server = Server()
+
+
+def test_prototype():
+    conf = {
+        'rp-id_token-sig-es256': {
+            'capabilities': {
+                'id_token_signing_alg_values_supported': ['ES256']},
+            'behavior': ['ath']
+        }
+    }
+    proto = Prototype('rp-id_token-sig-es256', conf)
+
+    op1 = OP()
+    proto.apply(op1)
+    assert op1.jwx_def['signing_alg']['id_token'] == 'ES256'
+    assert op1.jwx_def['signing_alg']['userinfo'] == ''
+    assert op1.claims_type == ['normal']
+    assert op1.behavior_type == ['ath']
+    assert op1.server.behavior_type is op1.behavior_type
+
+    op2 = OP()
+    proto.apply(op2)
+    # Not shared between instances
+    op1.behavior_type.append('issi')
+    assert op2.behavior_type == ['ath']
+
+
+def test_prototype_unknown():
+    with pytest.raises(UnknownTestID):
+        Prototype('rp-foo', {'rp-foo': {}})
@@ -0,0 +1,92 @@
+import io
+import json
+import time
+
+from jwkest.jwk import RSAKey
+from jwkest.jws import JWS
+
+from oidctest import keypool
+from oidctest.keypool import EC_KEY
+from oidctest.keypool import KeyPool
+from oidctest.keypool import RSA_KEY
+from oidctest.keypool import generate
+from oidctest.keypool import load
+from oidctest.keypool import serve
+
+KINDS = [(RSA_KEY, 1024), (EC_KEY, 'P-256')]
+
+
+def wait_for(func, timeout=30):
+    _deadline = time.time() + timeout
+    while time.time() < _deadline:
+        if func():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_generate_and_load():
+    _key = load(RSA_KEY, generate(RSA_KEY, 1024))
+    assert _key.has_private()
+    assert _key.size_in_bits() == 1024
+
+    _jwk = RSAKey(use='sig').load_key(_key)
+    _jws = JWS('{"foo": "bar"}', alg='RS256').sign_compact([_jwk])
+    assert JWS().verify_compact(_jws, [_jwk]) == {'foo': 'bar'}
+
+
+def test_serve():
+    out = io.StringIO()
+    serve(io.StringIO('EC P-256\nDSA 1024\n'), out)
+    _lines = out.getvalue().splitlines()
+    assert len(_lines) == 1
+    info = json.loads(_lines[0])
+    assert info['typ'] == EC_KEY
+    assert set(info['key'].keys()) == {'d', 'x', 'y'}
+
+
+def test_pool():
+    pool = KeyPool(depth=2, kinds=KINDS)
+    try:
+        # Nothing in stock yet, made on the spot
+        assert pool.take(RSA_KEY, 1024).size_in_bits() == 1024
+        assert pool.stats()['inline'] == 1
+        assert pool.is_running()
+
+        assert wait_for(lambda: pool.stats()['depth'] == {'RSA-1024': 2,
+                                                           'EC-P-256': 2})
+        assert pool.take(RSA_KEY, 1024).size_in_bits() == 1024
+        assert pool.take(EC_KEY, 'P-256')['d']
+
+        stats = pool.stats()
+        assert stats['served'] == 2
+        assert stats['inline'] == 1
+        assert stats['generated'] >= 4
+        assert stats['refill_rate'] > 0
+
+        # Topped up again
+        assert wait_for(lambda: pool.stats()['generated'] == 6)
+    finally:
+        pool.stop()
+    assert not pool.is_running()
+
+
+def test_no_pool():
+    pool = KeyPool(depth=0, kinds=KINDS)
+    pool.take(EC_KEY, 'P-256')
+    assert pool.proc is None
+    assert pool.stats()['inline'] == 1
+
+    # Not a kind the pool keeps
+    pool = KeyPool(depth=2, kinds=[(EC_KEY, 'P-256')])
+    pool.take(RSA_KEY, 1024)
+    assert pool.proc is None
+
+
+def test_new_ec_key():
+    keypool.configure(depth=0)
+    _key = keypool.new_ec_key(kid='rotated', use='sig')
+    assert _key.serialize(private=True)['kid'] == 'rotated'
+
+    _jws = JWS('{"foo": "bar"}', alg='ES256').sign_compact([_key])
+    assert JWS().verify_compact(_jws, [_key]) == {'foo': 'bar'}
@@ -0,0 +1,159 @@
+import os
+import time
+
+import cherrypy
+import pytest
+
+from oidctest.cp.jwks import InstanceJWKS
+from oidctest.cp.jwks import JWKS
+from oidctest.cp.jwks import JWKSStore
+from oidctest.cp.jwks import digest
+from oidctest.cp.jwks import remove_stale_files
+from oidctest.cp.op_handler import OPHandler
+
+JWKS_1 = {'keys': [{'kty': 'RSA', 'kid': 'a', 'n': 'xyz', 'e': 'AQAB'}]}
+JWKS_2 = {'keys': [{'kty': 'EC', 'kid': 'b', 'crv': 'P-256', 'x': 'x',
+                    'y': 'y'}]}
+
+
+def test_digest():
+    _, d1 = digest(JWKS_1)
+    _, d2 = digest({'keys': [{'e': 'AQAB', 'n': 'xyz', 'kid': 'a',
+                              'kty': 'RSA'}]})
+    assert d1 == d2
+    assert digest(JWKS_2)[1] != d1
+
+
+def test_store(tmpdir):
+    store = JWKSStore(directory=str(tmpdir))
+    d1 = store.add(JWKS_1)
+    assert store.add(JWKS_1) == d1
+    d2 = store.add(JWKS_2)
+    assert len(store) == 2
+    assert store.get(d1) == digest(JWKS_1)[0]
+    assert store.get('foo') is None
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        ['jwks-{}.json'.format(d1), 'jwks-{}.json'.format(d2)])
+    # Not taken for the files earlier versions left behind
+    assert remove_stale_files(str(tmpdir), max_age=-1) == 0
+
+
+def test_remove_stale_files(tmpdir):
+    for name in ['jwks_abc.json', 'jwks_def.json', 'favicon.ico']:
+        tmpdir.join(name).write('{}')
+    _old = time.time() - 1000
+    os.utime(str(tmpdir.join('jwks_abc.json')), (_old, _old))
+    os.utime(str(tmpdir.join('favicon.ico')), (_old, _old))
+
+    assert remove_stale_files(str(tmpdir), max_age=100) == 1
+    assert sorted(os.listdir(str(tmpdir))) == ['favicon.ico', 'jwks_def.json']
+
+
+def test_serve():
+    store = JWKSStore()
+    _digest = store.add(JWKS_1)
+    _handler = JWKS(store)
+    assert _handler.default('{}.json'.format(_digest)) == store.get(_digest)
+    assert cherrypy.response.headers['ETag'] == '"{}"'.format(_digest)
+    assert 'immutable' in cherrypy.response.headers['Cache-Control']
+
+    cherrypy.request.headers['If-None-Match'] = '"{}"'.format(_digest)
+    try:
+        with pytest.raises(cherrypy.HTTPRedirect) as err:
+            _handler.default('{}.json'.format(_digest))
+        assert err.value.status == 304
+    finally:
+        del cherrypy.request.headers['If-None-Match']
+
+    with pytest.raises(cherrypy.NotFound):
+        _handler.default('foo.json')
+
+
+class OP(object):
+    def __init__(self, name, behavior_type):
+        self.name = name
+        self.behavior_type = behavior_type
+
+
+def test_publish_jwks():
+    store = JWKSStore()
+    op_handler = OPHandler(None, {'baseurl': 'https://rp.example.com/'}, {},
+                           {}, '', jwks_store=store)
+    assert op_handler.jwks_store is store
+    _op = OP('https://rp.example.com/lib/rp-discovery', [])
+    op_handler.publish_jwks(_op, JWKS_1)
+    _digest = digest(JWKS_1)[1]
+    assert _op.jwks_uri == 'https://rp.example.com/jwks/{}.json'.format(
+        _digest)
+
+    # Rotates keys so always at the same place
+    _op = OP('https://rp.example.com/lib/rp-key-rotation-op-sign-key',
+             ['rotsig'])
+    op_handler.publish_jwks(_op, JWKS_1)
+    assert _op.jwks_uri == '{}/jwks.json'.format(_op.name)
+    assert InstanceJWKS().index(_op) == op_handler.jwks_store.get(_digest)
+    _op.jwks = JWKS_2
+    assert InstanceJWKS().index(_op) == digest(JWKS_2)[0]
+    assert cherrypy.response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_held():
+    store = JWKSStore(max_entries=1)
+    d1 = store.hold(JWKS_1)
+    assert store.hold(JWKS_1) == d1
+    # Doesn't push out a held document
+    store.add(JWKS_2)
+    store.add({'keys': []})
+    assert store.get(d1) == digest(JWKS_1)[0]
+
+    store.release(d1)
+    assert store.get(d1) == digest(JWKS_1)[0]
+    store.release(d1)
+    store.add(JWKS_2)
+    assert store.get(d1) is None
+
+
+def test_from_file(tmpdir):
+    store = JWKSStore(max_entries=1, directory=str(tmpdir))
+    d1 = store.add(JWKS_1)
+    store.add(JWKS_2)
+    assert d1 not in store.docs
+    assert store.get(d1) == digest(JWKS_1)[0]
+    assert store.get('../jwks-{}'.format(d1)) is None
+
+
+def test_evicted_op_releases_jwks():
+    store = JWKSStore(max_entries=1)
+    op_handler = OPHandler(None, {'baseurl': 'https://rp.example.com/'}, {},
+                           {}, '', max_entries=1, jwks_store=store)
+    _op = OP('https://rp.example.com/lib/rp-discovery', [])
+    op_handler.publish_jwks(_op, JWKS_1)
+    op_handler.op['lib/rp-discovery'] = _op
+    _digest = _op.jwks_digest
+    assert _digest in store.held
+
+    # Published again with other keys
+    op_handler.publish_jwks(_op, JWKS_2)
+    assert _digest not in store.held
+    op_handler.op['lib/rp-other'] = OP('https://rp.example.com/lib/rp-other',
+                                       [])
+    assert _op.jwks_digest not in store.held
+
+
+def test_removed_op_releases_jwks():
+    store = JWKSStore()
+    op_handler = OPHandler(None, {'baseurl': 'https://rp.example.com/'}, {},
+                           {}, '', jwks_store=store)
+    _op = OP('https://rp.example.com/lib/rp-discovery', [])
+    op_handler.publish_jwks(_op, JWKS_1)
+    op_handler.op['lib/rp-discovery'] = _op
+    # Put back, still held
+    op_handler.op['lib/rp-discovery'] = _op
+    assert _op.jwks_digest in store.held
+
+    _new = OP('https://rp.example.com/lib/rp-discovery', [])
+    op_handler.publish_jwks(_new, JWKS_2)
+    op_handler.op['lib/rp-discovery'] = _new
+    assert _op.jwks_digest not in store.held
+    del op_handler.op['lib/rp-discovery']
+    assert store.held == {}
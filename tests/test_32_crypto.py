@@ -0,0 +1,93 @@
+from jwkest.ecc import P256
+from jwkest.jwe import JWE
+from jwkest.jwk import ECKey
+from jwkest.jwk import RSAKey
+from jwkest.jwk import SYMKey
+from jwkest.jws import JWS
+from oic.oic import provider
+from oic.oic.message import IdToken
+
+from oidctest import crypto
+from oidctest.crypto import CryptoPool
+from oidctest.keypool import RSA_KEY
+from oidctest.keypool import generate
+from oidctest.keypool import load
+from oidctest.rp.provider import PooledJWE
+from oidctest.rp.provider import PooledJWT
+
+PAYLOAD = '{"iss": "https://op.example.com", "sub": "foo"}'
+
+RSA = RSAKey(use='sig', kid='rsa').load_key(load(RSA_KEY,
+                                                 generate(RSA_KEY, 1024)))
+EC = ECKey(use='sig', kid='ec').load_key(P256)
+
+
+def test_inline():
+    pool = CryptoPool(workers=0)
+    _jws = pool.sign(PAYLOAD, 'RS256', [RSA])
+    assert JWS().verify_compact(_jws, [RSA])
+    assert pool.stats()['inline'] == 1
+    assert pool.executor is None
+
+
+def test_pool():
+    pool = CryptoPool(workers=1)
+    try:
+        for alg, key in [('RS256', RSA), ('ES256', EC)]:
+            _jws = pool.sign(PAYLOAD, alg, [key])
+            assert JWS().verify_compact(_jws, [key])['sub'] == 'foo'
+
+        # Not worth the trouble
+        _sym = SYMKey(key='secret', kid='s')
+        assert JWS().verify_compact(pool.sign(PAYLOAD, 'HS256', [_sym]),
+                                    [_sym])
+
+        _enc = RSAKey(use='enc', kid='enc').load_key(RSA.key)
+        _jwe = pool.encrypt(PAYLOAD, [_enc], alg='RSA1_5',
+                            enc='A128CBC-HS256')
+        assert JWE().decrypt(_jwe, [_enc]).decode() == PAYLOAD
+
+        stats = pool.stats()
+        assert stats['offloaded'] == 3
+        assert stats['inline'] == 1
+        assert stats['fallbacks'] == 0
+    finally:
+        pool.stop()
+
+
+def test_fallback():
+    pool = CryptoPool(workers=1)
+    pool.start()
+    # The workers go away
+    for _proc in list(pool.executor._processes.values()):
+        _proc.kill()
+        _proc.join()
+
+    _jws = pool.sign(PAYLOAD, 'ES256', [EC])
+    assert JWS().verify_compact(_jws, [EC])
+    assert pool.stats()['fallbacks'] == 1
+    assert pool.executor is None
+
+    # Started again when needed
+    try:
+        pool.sign(PAYLOAD, 'ES256', [EC])
+        assert pool.stats()['offloaded'] == 1
+    finally:
+        pool.stop()
+
+
+def test_provider_hooks():
+    _idt = PooledJWT(IdToken(iss='https://op.example.com', sub='foo'))
+    # Still the message
+    assert _idt.to_dict()['sub'] == 'foo'
+    _jws = _idt.to_jwt([RSA], 'RS256')
+    assert JWS().verify_compact(_jws, [RSA])['sub'] == 'foo'
+
+    # What pyoidc's Provider.encrypt uses
+    assert provider.JWE is PooledJWE
+    _enc = RSAKey(use='enc', kid='enc').load_key(RSA.key)
+    _before = crypto.default_pool().stats()['inline']
+    _jwe = provider.JWE(PAYLOAD, alg='RSA1_5', enc='A128CBC-HS256').encrypt(
+        [_enc], context='public')
+    assert JWE().decrypt(_jwe, [_enc]).decode() == PAYLOAD
+    assert crypto.default_pool().stats()['inline'] == _before + 1
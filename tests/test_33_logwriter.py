@@ -0,0 +1,61 @@
+import os
+import threading
+
+from oidctest.logwriter import LogWriter
+
+
+def test_inline(tmpdir):
+    writer = LogWriter()
+    _name = os.path.join(str(tmpdir), 'op', 'rp-discovery.txt')
+    writer.write(_name, 'foo\n\n')
+    writer.write(_name, 'bar\n\n')
+    assert open(_name).read() == 'foo\n\nbar\n\n'
+    assert writer.stats()['inline'] == 2
+
+
+def test_background(tmpdir):
+    writer = LogWriter(max_open=2)
+    writer.start()
+    try:
+        _names = [os.path.join(str(tmpdir), 'op', '{}.txt'.format(n))
+                  for n in range(3)]
+        for i in range(10):
+            for _name in _names:
+                writer.write(_name, '{}\n'.format(i))
+        assert writer.flush()
+        for _name in _names:
+            assert open(_name).read() == ''.join(
+                '{}\n'.format(i) for i in range(10))
+        assert len(writer.files) <= 2
+
+        # Closes the files in the directory
+        writer.write(_names[0], 'x\n')
+        assert writer.flush(os.path.join(str(tmpdir), 'op'))
+        assert writer.files == {}
+
+        stats = writer.stats()
+        assert stats['entries'] == 31
+        assert stats['inline'] == 0
+        assert stats['errors'] == 0
+    finally:
+        writer.stop()
+
+
+def test_backpressure(tmpdir):
+    writer = LogWriter(max_queue=1)
+    writer.start()
+    _name = os.path.join(str(tmpdir), 'op', 'test.txt')
+
+    _threads = [
+        threading.Thread(target=writer.write,
+                         args=(_name, '{}\n'.format(n)))
+        for n in range(20)]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+
+    # Whatever is left is written before stopping
+    writer.stop()
+    assert len(open(_name).readlines()) == 20
+    assert writer.stats()['max_depth'] == 1
@@ -0,0 +1,100 @@
+import os
+
+from oic.oic.message import RegistrationRequest
+from otest.events import EV_EXCEPTION
+from otest.events import EV_FAULT
+from otest.events import EV_HTTP_REQUEST
+from otest.events import EV_PROTOCOL_REQUEST
+from otest.events import EV_REQUEST
+from otest.events import EV_RESPONSE
+from otest.events import Events
+from otest.events import HTTPRequest
+from otest.events import Operation
+from otest.events import layout
+
+from oidctest.eventlog import EventLog
+from oidctest.eventlog import format_events
+from oidctest.eventlog import log_names
+from oidctest.eventlog import read_text
+from oidctest.eventlog import render
+from oidctest.eventlog import request_endpoint
+from oidctest.eventlog import to_record
+
+
+def request_events(endpoint, n=0):
+    ev = Events()
+    ev.store('Init', '{} Test tool version:1.0 {}'.format(10 * '=', 10 * '='))
+    ev.store(EV_HTTP_REQUEST,
+             HTTPRequest('/op/rp-discovery/{}'.format(endpoint), 'GET'))
+    ev.store(EV_REQUEST, {'client_id': 'abc', 'n': n})
+    ev.store(EV_RESPONSE, Operation('Response', status=200, n=n))
+    return ev
+
+
+def write(base, events):
+    _endpoint = request_endpoint(events, '/op/rp-discovery/')
+    with open(base + '.jsonl', 'a') as fp:
+        fp.write(format_events(events, _endpoint))
+
+
+def test_render():
+    ev = request_events('token')
+    ev.store(EV_PROTOCOL_REQUEST,
+             RegistrationRequest(redirect_uris=['https://rp.example.com/cb']))
+    ev.store(EV_EXCEPTION, ValueError('bad'), note='Registration')
+    ev.store(EV_FAULT, RegistrationRequest(contacts=['ops@example.com']))
+    for event in ev:
+        assert render(to_record(event)) == layout(0, event)
+
+
+def test_filter(tmpdir):
+    base = os.path.join(str(tmpdir), 'rp-discovery')
+    for n, endpoint in enumerate(['registration', 'authorization', 'token',
+                                  'token']):
+        write(base, request_events(endpoint, n))
+
+    _log = EventLog(base)
+    assert len(_log.records()) == 16
+    assert [r['data']['n'] for r in _log.records(typ='Request')] == [
+        0, 1, 2, 3]
+    assert [r['data']['n'] for r in _log.records(typ='request',
+                                                 endpoint='token')] == [2, 3]
+    _recs = _log.records(typ='request', start=1, limit=2)
+    assert [r['data']['n'] for r in _recs] == [1, 2]
+    assert _log.records(endpoint='userinfo') == []
+
+    # The last two
+    assert [r['type'] for r in _log.records(start=-2)] == [
+        'request', 'response']
+
+    # Only what is new is added to the index
+    write(base, request_events('userinfo', 4))
+    assert _log.update_index() == 20
+    assert len(_log.records(endpoint='userinfo')) == 4
+    assert os.path.getsize(_log.index_name) == 20 * 16
+
+
+def test_bad_line(tmpdir):
+    base = os.path.join(str(tmpdir), 'rp-discovery')
+    write(base, request_events('registration', 0))
+    with open(base + '.jsonl', 'a') as fp:
+        fp.write('{"type": "requ\n')
+    write(base, request_events('token', 1))
+
+    _log = EventLog(base)
+    # Skipped, what comes after is still there
+    assert _log.update_index() == 8
+    assert [r['data']['n'] for r in _log.records(typ='request')] == [0, 1]
+
+
+def test_read_text(tmpdir):
+    base = os.path.join(str(tmpdir), 'rp-discovery')
+    tmpdir.join('rp-discovery.txt').write('Old\n\n')
+    ev = request_events('token')
+    write(base, ev)
+
+    _expected = '\n'.join(layout(0, e) for e in ev) + '\n\n'
+    assert read_text(base + '.txt') == 'Old\n\n' + _expected
+    assert read_text(os.path.join(str(tmpdir), 'foo.txt')) is None
+
+    assert log_names(os.listdir(str(tmpdir))) == ['rp-discovery.txt']
@@ -0,0 +1,102 @@
+import gzip
+import io
+import os
+import tarfile
+
+import cherrypy
+import pytest
+
+from oidctest.archive import ArchiveCache
+from oidctest.archive import dir_members
+from oidctest.archive import fingerprint
+from oidctest.archive import tar_stream
+from oidctest.archive import write_archive
+from oidctest.cp.log_handler import OPTar
+
+
+def make_logs(tmpdir):
+    tmpdir.join('rp-discovery.txt').write('foo\n' * 10000)
+    tmpdir.join('rp-registration.txt').write('bar\n')
+    tmpdir.join('.hidden').write('x')
+    return str(tmpdir)
+
+
+def test_tar_stream(tmpdir):
+    _dir = make_logs(tmpdir)
+    _members = dir_members(_dir, 'op/')
+    _members.append(('op/rendered.txt', lambda: b'text'))
+    chunks = list(tar_stream(_members, chunk_size=1024))
+    assert len(chunks) > 1
+
+    _data = b''.join(chunks)
+    assert len(_data) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(_data)) as tar:
+        assert tar.getnames() == ['op/rp-discovery.txt',
+                                  'op/rp-registration.txt', 'op/rendered.txt']
+        assert tar.extractfile('op/rp-discovery.txt').read() == \
+            b'foo\n' * 10000
+        assert tar.extractfile('op/rendered.txt').read() == b'text'
+
+
+def test_compressed(tmpdir):
+    _dir = make_logs(tmpdir)
+    _data = b''.join(tar_stream(dir_members(_dir), compress=True))
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(_data))) as tar:
+        assert tar.extractfile('rp-registration.txt').read() == b'bar\n'
+
+
+def test_write_archive(tmpdir):
+    _dir = make_logs(tmpdir.mkdir('log'))
+    _name = os.path.join(str(tmpdir), 'backup', 'op', 'op.tar.gz')
+    write_archive(_name, tar_stream(dir_members(_dir), compress=True))
+    with tarfile.open(_name) as tar:
+        assert len(tar.getnames()) == 2
+
+
+def test_fingerprint(tmpdir):
+    _dir = make_logs(tmpdir)
+    _fp = fingerprint(_dir)
+    assert fingerprint(_dir) == _fp
+    tmpdir.join('rp-registration.txt').write('bar\nbar\n')
+    assert fingerprint(_dir) != _fp
+
+
+def test_cache(tmpdir):
+    _dir = make_logs(tmpdir.mkdir('log'))
+    cache = ArchiveCache(str(tmpdir.join('tar')))
+
+    def make():
+        return tar_stream(dir_members(_dir))
+
+    _fp = fingerprint(_dir)
+    _data = b''.join(cache.archive(('op', 'tag'), _fp, make))
+    assert b''.join(cache.archive(('op', 'tag'), _fp, make)) == _data
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+    # Not kept if not all of it was sent
+    _stream = cache.archive(('op', 'tag'), 'other', make)
+    next(_stream)
+    _stream.close()
+    assert os.listdir(str(tmpdir.join('tar', 'op', 'tag'))) == [_fp]
+
+    # Replaces the older one
+    b''.join(cache.archive(('op', 'tag'), 'other', make))
+    assert os.listdir(str(tmpdir.join('tar', 'op', 'tag'))) == ['other']
+
+
+def test_op_tar(tmpdir):
+    make_logs(tmpdir.mkdir('log').mkdir('op').mkdir('tag').mkdir('C.T.T.T'))
+    _tar = OPTar(str(tmpdir))
+    _data = b''.join(_tar.index('op', 'tag', 'C.T.T.T'))
+    with tarfile.open(fileobj=io.BytesIO(_data)) as tar:
+        assert tar.getnames() == ['./rp-discovery.txt',
+                                  './rp-registration.txt']
+
+    _etag = cherrypy.response.headers['ETag']
+    cherrypy.request.headers['If-None-Match'] = _etag
+    try:
+        with pytest.raises(cherrypy.HTTPRedirect) as err:
+            _tar.index('op', 'tag', 'C.T.T.T')
+        assert err.value.status == 304
+    finally:
+        del cherrypy.request.headers['If-None-Match']
@@ -0,0 +1,65 @@
+import os
+import time
+
+from oidctest.dir_index import DirIndex
+from oidctest.dir_index import page_links
+from oidctest.dir_index import page_of
+from oidctest.inotify import Watcher
+
+
+def wait_for(func, timeout=5):
+    _end = time.time() + timeout
+    while time.time() < _end:
+        if func():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_page_of():
+    items = list(range(250))
+    assert page_of(items, 1) == (list(range(100)), 1, 3)
+    assert page_of(items, 3) == (list(range(200, 250)), 3, 3)
+    assert page_of(items, 7)[1] == 3
+    assert page_of([], 1) == ([], 1, 1)
+    assert page_links('/log', 1, 1) == ''
+    assert 'page=2' in page_links('/log', 1, 3)
+
+
+def test_mtime(tmpdir):
+    index = DirIndex()
+    tmpdir.join('b.txt').write('')
+    tmpdir.mkdir('a')
+    _listing = index.listing(str(tmpdir))
+    assert _listing.dirs == ['a']
+    assert _listing.files == ['b.txt']
+
+    # Made long ago, so the modification time can be relied on
+    _old = time.time() - 100
+    os.utime(str(tmpdir), (_old, _old))
+    _listing = index.listing(str(tmpdir))
+    assert index.listing(str(tmpdir)) is _listing
+
+    tmpdir.join('c.txt').write('')
+    assert index.listing(str(tmpdir)).files == ['b.txt', 'c.txt']
+
+
+def test_inotify(tmpdir):
+    watcher = Watcher()
+    index = DirIndex(watcher=watcher)
+    try:
+        tmpdir.join('b.txt').write('')
+        _listing = index.listing(str(tmpdir))
+        if not _listing.watched:  # No inotify here
+            return
+        assert index.listing(str(tmpdir)) is _listing
+
+        tmpdir.join('a.txt').write('')
+        assert wait_for(lambda: index.listing(str(tmpdir)).files == [
+            'a.txt', 'b.txt'])
+
+        tmpdir.join('a.txt').remove()
+        assert wait_for(lambda: index.listing(str(tmpdir)).files == [
+            'b.txt'])
+    finally:
+        watcher.stop()
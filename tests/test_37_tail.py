@@ -0,0 +1,86 @@
+import os
+
+import cherrypy
+import pytest
+from otest.events import EV_REQUEST
+from otest.events import Events
+
+from oidctest.cp import tail
+from oidctest.eventlog import EventLog
+from oidctest.eventlog import format_events
+
+
+def test_sse():
+    assert tail.sse('foo') == b'data: foo\n\n'
+    assert tail.sse('foo\nbar', 7) == b'id: 7\ndata: foo\ndata: bar\n\n'
+
+
+def test_serve_text():
+    cherrypy.request.headers['Range'] = 'bytes=2-4'
+    try:
+        assert tail.serve_text('abcdefg') == b'cde'
+        assert cherrypy.response.headers['Content-Range'] == 'bytes 2-4/7'
+
+        cherrypy.request.headers['Range'] = 'bytes=10-'
+        with pytest.raises(cherrypy.HTTPError) as err:
+            tail.serve_text('abcdefg')
+        assert err.value.status == 416
+    finally:
+        del cherrypy.request.headers['Range']
+    assert tail.serve_text('abcdefg') == b'abcdefg'
+
+
+def test_follow_events(tmpdir, monkeypatch):
+    monkeypatch.setattr(tail, 'INTERVAL', 0.01)
+    base = os.path.join(str(tmpdir), 'rp-discovery')
+
+    def write(n):
+        ev = Events()
+        ev.store(EV_REQUEST, {'n': n})
+        with open(base + '.jsonl', 'a') as fp:
+            fp.write(format_events(ev, 'token'))
+
+    write(0)
+    _events = tail.start_stream(tail.follow_events(EventLog(base), max_time=5))
+    assert next(_events).startswith(b'id: 1\ndata: ')
+    # Waits for more
+    write(1)
+    _next = next(_events)
+    assert _next.startswith(b'id: 2\ndata: ')
+    assert b"'n': 1" in _next
+    assert tail.followers.active == 1
+    _events.close()
+    assert tail.followers.active == 0
+
+
+def test_follow_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(tail, 'INTERVAL', 0.01)
+    fn = tmpdir.join('log.txt')
+    fn.write('one\ntwo\nthr')
+
+    _lines = tail.follow_file(str(fn), -8, max_time=5)
+    # Starts at a line
+    assert next(_lines) == b'id: 8\ndata: two\n\n'
+    fn.write('ee\n', mode='a')
+    assert next(_lines) == b'id: 14\ndata: three\n\n'
+    _lines.close()
+
+
+def test_start_stream(tmpdir, monkeypatch):
+    monkeypatch.setattr(tail, 'followers', tail.Followers(2))
+    fn = tmpdir.join('log.txt')
+    fn.write('one\n')
+
+    # The places are taken before any of the streams is read
+    first = tail.start_stream(tail.follow_file(str(fn), max_time=5))
+    second = tail.start_stream(tail.follow_file(str(fn), max_time=5))
+    assert tail.followers.active == 2
+    with pytest.raises(cherrypy.HTTPError) as err:
+        tail.start_stream(tail.follow_file(str(fn), max_time=5))
+    assert err.value.status == 503
+    assert tail.followers.active == 2
+
+    # Given back also by a stream that was never read
+    first.close()
+    del second
+    assert tail.followers.active == 0
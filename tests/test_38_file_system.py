@@ -0,0 +1,87 @@
+import json
+import time
+
+from oidctest.file_system import FileSystem
+from oidctest.file_system import JSON_CONV
+from oidctest.file_system import Rescanner
+from oidctest.inotify import Watcher
+
+
+def forgotten(fs, key):
+    for _ in range(200):
+        if key not in fs.db:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_inotify(tmpdir):
+    watcher = Watcher()
+    _dir = tmpdir.mkdir('html')
+    _dir.join('main.html').write('<p>main</p>')
+    fs = FileSystem(str(_dir), watcher=watcher)
+    try:
+        if not fs.watched:  # No inotify here
+            return
+        assert fs['main.html'] == '<p>main</p>'
+        # Only looked up from now on
+        assert fs.db['main.html'] == '<p>main</p>'
+
+        _dir.join('main.html').write('<p>changed</p>')
+        assert forgotten(fs, 'main.html')
+        assert fs['main.html'] == '<p>changed</p>'
+
+        fs['logs.html'] = '<p>logs</p>'
+        assert sorted(fs.keys()) == ['logs.html', 'main.html']
+    finally:
+        fs.close()
+        watcher.stop()
+
+
+def test_rescan(tmpdir):
+    rescanner = Rescanner(0.01)
+    _dir = tmpdir.mkdir('html')
+    _dir.join('main.html').write('<p>main</p>')
+    fs = FileSystem(str(_dir), watcher=False, rescanner=rescanner)
+    try:
+        assert not fs.watched
+        assert fs['main.html'] == '<p>main</p>'
+
+        _dir.join('main.html').write('<p>changed</p>')
+        # Make sure the modification time differs
+        _dir.join('main.html').setmtime(time.time() + 10)
+        assert forgotten(fs, 'main.html')
+        assert fs['main.html'] == '<p>changed</p>'
+
+        _dir.join('main.html').remove()
+        assert forgotten(fs, 'main.html')
+        try:
+            fs['main.html']
+        except KeyError:
+            pass
+        else:
+            assert False
+    finally:
+        fs.close()
+        rescanner.stop()
+
+
+def test_lazy(tmpdir):
+    _dir = tmpdir.mkdir('entities')
+    for n in range(10):
+        _dir.join('e{}'.format(n)).write(json.dumps({'n': n, 'x': 'x' * 80}))
+    fs = FileSystem(str(_dir), value_conv=JSON_CONV, c_size=500,
+                    watcher=False, rescanner=Rescanner(60))
+    try:
+        # Nothing read
+        assert sorted(fs.keys()) == ['e{}'.format(n) for n in range(10)]
+        assert len(fs.db) == 0
+
+        assert fs['e3']['n'] == 3
+        assert sorted(v['n'] for k, v in fs.items()) == list(range(10))
+        # Only as much as fits is kept
+        assert fs.db.size <= 500
+        assert len(fs.db) < 10
+        assert sorted(fs.fmtime) == sorted(fs.db.keys())
+    finally:
+        fs.close()
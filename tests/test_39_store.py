@@ -0,0 +1,125 @@
+import copy
+import json
+import os
+import pickle
+import time
+from urllib.parse import quote_plus
+
+import pytest
+
+from oidctest.ass_port import AssignedPorts
+from oidctest.tt.rest import NoSuchFile
+from oidctest.tt.rest import REST
+from oidctest.tt.rest import thaw
+from oidctest.tt.store import FileStore
+from oidctest.tt.store import SQLiteStore
+from oidctest.tt.store import migrate
+
+ISS = quote_plus('https://op.example.org/')
+CONF = json.dumps({'tool': {'profile': 'C.T.T.T'}})
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def backend(request, tmpdir):
+    if request.param == 'file':
+        return FileStore(str(tmpdir.join('entities')))
+    return SQLiteStore(str(tmpdir.join('entities.db')))
+
+
+def test_store(backend):
+    backend.write(ISS, 'one', CONF)
+    # With or without a trailing '/'
+    assert backend.read(ISS[:-3], 'one') == CONF
+    assert backend.tags(ISS[:-3]) == ['one']
+    with pytest.raises(KeyError):
+        backend.read(ISS, 'two')
+
+    _conf = json.dumps({'tool': {'profile': 'I.T.T.T'}})
+    assert backend.replace(ISS, 'one', _conf)
+    assert not backend.replace(ISS, 'one', _conf)
+    with pytest.raises(KeyError):
+        backend.replace(ISS, 'two', _conf)
+
+    assert backend.mtime(ISS, 'one') > 0
+    backend.write(ISS[:-3], 'two', CONF)
+    assert backend.items() == {ISS: ['one', 'two']}
+    assert backend.issuers() == [ISS]
+
+    backend.delete(ISS, 'one')
+    backend.delete(ISS, 'two')
+    assert backend.items() == {}
+    assert backend.issuers() == []
+
+
+def test_rest(backend):
+    rest = REST('https://localhost/', backend=backend)
+    rest.write(ISS, 'one', {'tool': {'profile': 'C.T.T.T'}})
+    assert rest.read_conf(ISS[:-3], 'one') == (
+        'json', {'tool': {'profile': 'C.T.T.T'}})
+    with pytest.raises(NoSuchFile):
+        rest.read_conf(ISS, 'two')
+    rest.touch(ISS, 'one')
+    assert rest.conf_mtime(ISS, 'one') > 0
+
+
+def test_delete(backend, tmpdir):
+    ports = AssignedPorts(str(tmpdir.join('assport')), 60000, 60009)
+    rest = REST('https://localhost/', assigned_ports=ports, backend=backend)
+    rest.write(ISS, 'one', CONF)
+    ports.register_port(ISS, 'one')
+    # The other spelling of the issuer, not quoted
+    rest.delete('https://op.example.org', 'one')
+    with pytest.raises(KeyError):
+        backend.read(ISS, 'one')
+    assert ports.register_port(ISS, 'two') == 60000
+
+
+def test_migrate(tmpdir):
+    src = FileStore(str(tmpdir.join('entities')))
+    src.write(ISS, 'one', CONF)
+    src.write(quote_plus('https://op.example.com'), 'two', CONF)
+    src.write(quote_plus('https://op.example.com'), 'bad', 'not json')
+
+    dst = SQLiteStore(str(tmpdir.join('entities.db')))
+    n, bad = migrate(src, dst)
+    assert n == 2
+    assert bad == [(quote_plus('https://op.example.com'), 'bad')]
+    assert dst.items() == {ISS: ['one'],
+                           quote_plus('https://op.example.com'): ['two']}
+    assert dst.read(ISS, 'one') == CONF
+
+
+def test_conf_cache(tmpdir):
+    _info = tmpdir.mkdir('entity_info')
+    _info.join('common.json').write(json.dumps({'client': {}}))
+    _info.join('registration_info.json').write(
+        json.dumps({'registration_info': {'redirect_uris': ['cb']}}))
+    rest = REST('https://localhost/', entinfo=str(_info),
+                backend=FileStore(str(tmpdir.join('entities'))))
+    rest.write(ISS, 'one', CONF)
+    # Old enough to be kept
+    _old = time.time() - 10
+    os.utime(rest.entity_file(ISS, 'one'), (_old, _old))
+
+    typ, _conf = rest._shared_conf(ISS, 'one')
+    assert rest._shared_conf(ISS, 'one')[1] is _conf
+    with pytest.raises(TypeError):
+        _conf['tool']['profile'] = 'I.T.T.T'
+    assert thaw(_conf) == {'tool': {'profile': 'C.T.T.T'}}
+    assert copy.deepcopy(_conf) == _conf
+    assert pickle.loads(pickle.dumps(_conf)) == _conf
+
+    # What callers get they may change
+    rest.read_conf(ISS, 'one')[1]['tool']['profile'] = 'I.T.T.T'
+    assert rest.read_conf(ISS, 'one')[1] == {'tool': {'profile': 'C.T.T.T'}}
+
+    _const = rest.construct_config(ISS, 'one')
+    assert _const['client']['registration_info'] == {'redirect_uris': ['cb']}
+    # A copy of the kept one
+    _const['client']['extra'] = 1
+    assert 'extra' not in rest.construct_config(ISS, 'one')['client']
+    assert rest.constructed.stats()['hits'] == 1
+
+    rest.write(ISS, 'one', json.dumps({'tool': {'profile': 'I.T.T.T'}}))
+    assert rest.read_conf(ISS, 'one')[1]['tool']['profile'] == 'I.T.T.T'
+    assert rest.construct_config(ISS, 'one')['tool']['profile'] == 'I.T.T.T'
@@ -0,0 +1,91 @@
+import json
+import os
+import time
+from urllib.parse import quote_plus
+
+import pytest
+
+from oidctest.tt.history import ConfigHistory
+
+ISS = quote_plus('https://op.example.org/')
+
+
+def conf(profile):
+    return json.dumps({'tool': {'profile': profile}})
+
+
+def test_versions(tmpdir):
+    history = ConfigHistory(str(tmpdir))
+    assert history.latest(ISS, 'one') is None
+    assert history.save(ISS, 'one', conf('C.T.T.T')) == 1
+    # Not changed
+    assert history.save(ISS, 'one', conf('C.T.T.T')) == 1
+    assert history.save(ISS, 'one', conf('I.T.T.T')) == 2
+    # Same as an earlier one, stored once
+    assert history.save(ISS[:-3], 'one', conf('C.T.T.T')) == 3
+    assert len(os.listdir(str(tmpdir.join('blobs')))) <= 2
+
+    assert history.latest(ISS, 'one')['version'] == 3
+    assert [e['version'] for e in history.versions(ISS, 'one')] == [1, 2, 3]
+    assert history.read(ISS, 'one', 2) == conf('I.T.T.T')
+    assert history.read(ISS, 'one') == conf('C.T.T.T')
+    with pytest.raises(KeyError):
+        history.read(ISS, 'one', 4)
+    with pytest.raises(KeyError):
+        history.read(ISS, 'two')
+
+    _diff = history.diff(ISS, 'one', 1, 2)
+    assert '-    "profile": "C.T.T.T"' in _diff
+    assert '+    "profile": "I.T.T.T"' in _diff
+    assert history.diff(ISS, 'one', 1) == ''
+
+
+def test_retention(tmpdir):
+    history = ConfigHistory(str(tmpdir), keep=2)
+    for n in range(5):
+        history.save(ISS, 'one', conf('C.T.T.{}'.format(n)))
+    assert [e['version'] for e in history.versions(ISS, 'one')] == [4, 5]
+
+    # Only the blobs still used are left
+    assert history.collect(now=time.time() + 7200) == 3
+    assert history.read(ISS, 'one', 4) == conf('C.T.T.3')
+
+
+def test_max_age(tmpdir):
+    history = ConfigHistory(str(tmpdir), max_age=60)
+    history.save(ISS, 'one', conf('C.T.T.T'))
+    history.save(ISS, 'one', conf('I.T.T.T'))
+    history.collect(now=time.time() + 120)
+    # The latest is always kept
+    assert [e['version'] for e in history.versions(ISS, 'one')] == [2]
+    assert history.read(ISS, 'one') == conf('I.T.T.T')
+
+
+def test_save_pruned(tmpdir):
+    history = ConfigHistory(str(tmpdir), keep=1)
+    history.save(ISS, 'one', conf('C.T.T.T'))
+    _blob = history._blob_name(history.latest(ISS, 'one')['digest'])
+    history.save(ISS, 'one', conf('I.T.T.T'))
+    # Version 1 is gone but its blob is still there, old enough to collect
+    _old = time.time() - 7200
+    os.utime(_blob, (_old, _old))
+
+    assert history.save(ISS, 'one', conf('C.T.T.T')) == 3
+    # Reused, so young again
+    assert os.stat(_blob).st_mtime > time.time() - 60
+    assert history.collect() == 0
+    assert history.collect(now=time.time() + 7200) == 1
+    assert history.read(ISS, 'one') == conf('C.T.T.T')
+
+
+def test_blob_missing(tmpdir):
+    history = ConfigHistory(str(tmpdir))
+    history.save(ISS, 'one', conf('C.T.T.T'))
+    history.save(ISS, 'one', conf('I.T.T.T'))
+    os.unlink(history._blob_name(history.latest(ISS, 'one')['digest']))
+
+    with pytest.raises(KeyError):
+        history.read(ISS, 'one')
+    with pytest.raises(KeyError):
+        history.diff(ISS, 'one', 1)
+    assert history.read(ISS, 'one', 1) == conf('C.T.T.T')
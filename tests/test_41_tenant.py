@@ -0,0 +1,56 @@
+import threading
+import time
+
+from oidctest.optt.tenant import MultiTenant
+
+
+class Config(object):
+    pass
+
+
+class Tenant(object):
+    def __init__(self, path):
+        self.path = path
+        self.last_access = time.time()
+
+    def is_stale(self):
+        return False
+
+
+class SlowBuild(MultiTenant):
+    def __init__(self, *args, **kwargs):
+        MultiTenant.__init__(self, *args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.built = []
+
+    def build(self, path, port):
+        self.built.append(path)
+        if path == 'slow':
+            self.started.set()
+            self.release.wait(5)
+        return Tenant(path)
+
+
+def test_build_one_path_at_a_time(tmpdir):
+    _p2p = tmpdir.join('path2port.csv')
+    _p2p.write('Path,Port\nslow,9100\nfast,9101\n')
+    mt = SlowBuild(Config(), None, None, {}, str(_p2p), None, '')
+
+    res = []
+    _threads = [threading.Thread(target=lambda: res.append(mt.get('slow')))
+                for _ in range(2)]
+    for _thread in _threads:
+        _thread.start()
+    assert mt.started.wait(5)
+    try:
+        # Not held up by the one being built
+        assert mt.get('fast').path == 'fast'
+    finally:
+        mt.release.set()
+    for _thread in _threads:
+        _thread.join(5)
+
+    # Built once, the other request waited for it
+    assert mt.built.count('slow') == 1
+    assert res[0] is res[1]